@@ -0,0 +1,296 @@
+'''
+Control ALTA and pull its data over USB, talking to pyboard/protocol.py.
+
+    python ALTA_cli.py /dev/ttyACM0 status
+    python ALTA_cli.py /dev/ttyACM0 start isothermal -15 --repeats 100
+    python ALTA_cli.py /dev/ttyACM0 pause
+    python ALTA_cli.py /dev/ttyACM0 pull data/ --out data/ --ingest
+
+pull lists the directory, then fetches every file which is missing or a
+different size locally as large CRC checked chunks of the files joined
+together. Of a journal (journal.py), only what was appended since the last
+pull is fetched. Chunks which fail their check are fetched again. A pull which is
+interrupted leaves .part files, and the next pull carries on from them.
+'''
+
+import argparse
+import json
+import os
+import select
+import sys
+import time
+
+from binascii import crc32
+
+CHUNK = 4096 # (bytes) Requested per chunk, the most the board sends
+RETRIES = 3
+# Only ever appended to on ALTA, so a shorter local copy is a prefix
+APPEND_ONLY = ('journal.csv', 'journal.idx', 'approach.csv', 'melt.csv',
+               'recovery.csv', 'profile.csv', 'schedule.csv')
+
+
+class ProtocolError(Exception):
+    '''ALTA answered ERR, or the answer didn't make sense'''
+
+
+class Client():
+    def __init__(self, fd, timeout=5, echo=False):
+        '''
+        fd: Open file descriptor of the port
+        timeout: (s) Longest wait for any part of an answer
+        echo: Print anything else ALTA writes on the port
+        '''
+        self.fd = fd
+        self.timeout = timeout
+        self.echo = echo
+        self.buf = bytearray()
+
+    def fill(self):
+        '''Read what has arrived, waiting up to timeout for something'''
+        if not select.select([self.fd], [], [], self.timeout)[0]:
+            raise TimeoutError('no answer from ALTA')
+        data = os.read(self.fd, 65536)
+        if not data:
+            raise ProtocolError('port closed')
+        self.buf += data
+
+    def readline(self):
+        while b'\n' not in self.buf:
+            self.fill()
+        i = self.buf.index(b'\n')
+        line = bytes(self.buf[:i])
+        del self.buf[:i + 1]
+        return line.decode(errors='replace').rstrip('\r')
+
+    def read(self, n):
+        while len(self.buf) < n:
+            self.fill()
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    def answer(self):
+        '''The next OK or ERR line, skipping what ALTA prints'''
+        while True:
+            line = self.readline()
+            if line.startswith('OK '):
+                return json.loads(line[3:])
+            if line.startswith('ERR '):
+                raise ProtocolError(line[4:])
+            if self.echo and line:
+                print('alta:', line, file=sys.stderr)
+
+    def request(self, *words):
+        os.write(self.fd, (' '.join(str(w) for w in words) + '\n').encode())
+        return self.answer()
+
+    def resync(self):
+        '''Discard a half read answer, e.g. after a timeout'''
+        time.sleep(0.2)
+        while select.select([self.fd], [], [], 0.2)[0]:
+            if not os.read(self.fd, 65536):
+                break
+        self.buf = bytearray()
+
+    def ls(self, path=None):
+        '''[(name, size)] of the files in path on ALTA, listed page by page'''
+        reply = self.request('ls', path) if path else self.request('ls')
+        files = []
+        while True:
+            for _ in range(reply['files']):
+                name, size = self.readline().rsplit(',', 1)
+                files.append((name, int(size)))
+            if not reply['files'] or len(files) >= reply['total']:
+                return files
+            reply = self.request('ls', reply['dir'], len(files))
+
+    def data(self, *words):
+        '''Answer to chunk or get, with its CRC checked'''
+        reply = self.request(*words)
+        data = self.read(reply['length'])
+        if crc32(data) != reply['crc']:
+            raise ProtocolError('crc mismatch at {}'.format(reply['offset']))
+        return reply, data
+
+    def chunk(self, offset, length):
+        '''Bytes of the joined files of the last ls, retrying failures'''
+        for attempt in range(RETRIES):
+            try:
+                return self.data('chunk', offset, length)[1]
+            except (ProtocolError, TimeoutError) as e:
+                if attempt == RETRIES - 1:
+                    raise
+                print('retrying chunk at {}: {}'.format(offset, e),
+                      file=sys.stderr)
+                self.resync()
+
+    def get(self, path):
+        '''Whole contents of one file on ALTA'''
+        data = bytearray()
+        while True:
+            reply, chunk = self.data('get', path, len(data), CHUNK)
+            data += chunk
+            if not chunk or len(data) >= reply['size']:
+                return bytes(data)
+
+
+def needed(files, out):
+    '''
+    Byte ranges [start, end) of the joined files to fetch into out: those
+    missing or of a different size, from the end of any .part file, or of
+    the local copy of an APPEND_ONLY file. Empty files are left to the caller
+    '''
+    ranges = []
+    start = 0
+    for name, size in files:
+        end = start + size
+        path = os.path.join(out, name)
+        if size and not (os.path.exists(path) and
+                         os.path.getsize(path) == size):
+            part = path + '.part'
+            if (name in APPEND_ONLY and os.path.exists(path)
+                    and os.path.getsize(path) < size):
+                os.replace(path, part) # Fetch only what was appended
+            have = os.path.getsize(part) if os.path.exists(part) else 0
+            if have > size:
+                os.remove(part)
+                have = 0
+            if ranges and ranges[-1][1] == start + have:
+                ranges[-1][1] = end # Merge with the previous range
+            elif start + have < end:
+                ranges.append([start + have, end])
+        start = end
+    return ranges
+
+
+class Writer():
+    '''Spreads the bytes of the joined files back over the files in out'''
+    def __init__(self, files, out):
+        self.out = out
+        self.files = files
+        self.starts = [0]
+        for _, size in files:
+            self.starts.append(self.starts[-1] + size)
+        self.written = 0
+
+    def write(self, offset, data):
+        i = 0
+        while self.starts[i + 1] <= offset and i < len(self.files) - 1:
+            i += 1
+        while i < len(self.files):
+            name, size = self.files[i]
+            path = os.path.join(self.out, name)
+            part = path + '.part'
+            n = min(len(data), self.starts[i + 1] - offset)
+            mode = 'ab' if offset > self.starts[i] else 'wb'
+            with open(part, mode) as f:
+                f.write(data[:n])
+            if offset + n == self.starts[i + 1]:
+                os.replace(part, path)
+                self.written += 1
+            data = data[n:]
+            offset += n
+            i += 1
+            if not data:
+                break
+
+
+def pull(client, path, out):
+    '''Copy the files of path on ALTA into out, returns (files, bytes)'''
+    os.makedirs(out, exist_ok=True)
+    files = client.ls(path)
+    writer = Writer(files, out)
+    for name, size in files:
+        if size == 0 and not os.path.exists(os.path.join(out, name)):
+            open(os.path.join(out, name), 'wb').close()
+            writer.written += 1
+    total = 0
+    for start, end in needed(files, out):
+        offset = start
+        while offset < end:
+            data = client.chunk(offset, min(CHUNK, end - offset))
+            if not data:
+                raise ProtocolError('{} ended at {}'.format(path, offset))
+            writer.write(offset, data)
+            offset += len(data)
+            total += len(data)
+    return writer.written, total
+
+
+def open_port(path):
+    '''Open a serial port (raw) or pty for reading and writing'''
+    fd = os.open(path, os.O_RDWR | getattr(os, 'O_NOCTTY', 0))
+    if os.isatty(fd):
+        import tty
+        tty.setraw(fd)
+    return fd
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split('\n\n', 1)[1])
+    parser.add_argument('port', help='serial port of the pyBoard')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='show what ALTA prints')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name in ('status', 'stop', 'pause', 'resume', 'exit'):
+        commands.add_parser(name)
+    start = commands.add_parser('start')
+    start.add_argument('mode', choices=('isothermal', 'linear'))
+    start.add_argument('setpoint', type=float,
+                       help='deg C (isothermal) or deg C/min (linear)')
+    start.add_argument('--repeats', type=int, default=0,
+                       help='stop after this many, 0 until one goes wrong')
+    start.add_argument('--data', help='directory on ALTA')
+    ls = commands.add_parser('ls')
+    ls.add_argument('path', nargs='?')
+    get = commands.add_parser('get')
+    get.add_argument('path')
+    get.add_argument('--out', help='local file, the same name if not given')
+    pull_parser = commands.add_parser('pull')
+    pull_parser.add_argument('path', nargs='?', default='data',
+                             help='directory on ALTA')
+    pull_parser.add_argument('--out', default='data',
+                             help='local directory')
+    pull_parser.add_argument('--ingest', action='store_true',
+                             help='ingest into the RunStore after')
+    args = parser.parse_args()
+
+    fd = open_port(args.port)
+    client = Client(fd, echo=args.verbose)
+    client.resync() # Skip anything ALTA printed before
+    try:
+        if args.command == 'start':
+            words = ['start', args.mode, args.setpoint, args.repeats]
+            if args.data:
+                words.append(args.data)
+            print(client.request(*words))
+        elif args.command == 'ls':
+            for name, size in client.ls(args.path):
+                print('{:>10}  {}'.format(size, name))
+        elif args.command == 'get':
+            out = args.out or os.path.basename(args.path)
+            with open(out, 'wb') as f:
+                f.write(client.get(args.path))
+        elif args.command == 'pull':
+            wall_start = time.perf_counter()
+            files, total = pull(client, args.path, args.out)
+            wall = time.perf_counter() - wall_start
+            print('{} files, {} bytes in {:.1f} s ({:.0f} kB/s)'.format(
+                files, total, wall, total / 1000 / max(wall, 1e-9)))
+            if args.ingest:
+                from ALTA_store import RunStore
+                added, removed = RunStore(args.out).ingest()
+                print('ingested {} new, {} removed'.format(added, removed))
+        else:
+            print(client.request(args.command))
+    except ProtocolError as e:
+        sys.exit('ALTA: {}'.format(e))
+    finally:
+        os.close(fd)
+
+
+if __name__ == '__main__':
+    main()
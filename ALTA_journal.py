@@ -0,0 +1,98 @@
+'''
+Explode an ALTA journal (pyboard/journal.py) back into a file per repeat.
+
+    python ALTA_journal.py data/journal.csv --out exploded/
+    python ALTA_journal.py data/journal.csv --reindex
+
+Each finished repeat is written as the file ALTA writes without a journal,
+e.g. 12_isothermal-15_frozen_81842.csv, so ALTA_store.py, ALTA_plots.py and
+the rest read it as before. Repeats which went wrong or were cut short by a
+reset are skipped. --reindex rebuilds journal.idx, e.g. if the board was
+reset between writing a footer and its index record.
+'''
+
+import argparse
+import os
+import struct
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'pyboard'))
+
+from journal import INDEX, RECORD
+
+
+def repeats(path):
+    '''
+    Yield (repeat, mode, setpoint, outcome, value, offset, length, lines) for
+    each repeat with a footer, setpoint and value as written, lines as bytes
+    '''
+    header = None
+    lines = []
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'#start,'):
+                header = line.decode().strip().split(',')[1:]
+                start = offset
+                lines = []
+            elif line.startswith(b'#end,'):
+                footer = line.decode().strip().split(',')[1:]
+                if header is not None and header[0] == footer[0]:
+                    yield (int(header[0]), header[1], header[2], footer[1],
+                           footer[2], start, offset + len(line) - start,
+                           lines)
+                header = None
+            elif header is not None:
+                lines.append(line)
+            offset += len(line)
+
+
+def filename(repeat, mode, setpoint, outcome, value):
+    return '{}_{}{}_{}_{}.csv'.format(repeat, mode, setpoint, outcome, value)
+
+
+def explode(path, out):
+    '''Write each finished repeat of the journal into out, returns how many'''
+    os.makedirs(out, exist_ok=True)
+    n = 0
+    for repeat, mode, setpoint, outcome, value, _, _, lines in repeats(path):
+        if outcome == 'error':
+            continue
+        name = filename(repeat, mode, setpoint, outcome, value)
+        with open(os.path.join(out, name), 'wb') as f:
+            f.writelines(lines)
+        n += 1
+    return n
+
+
+def reindex(path):
+    '''Rebuild the index of the journal, returns the number of repeats'''
+    records = [struct.pack(RECORD, repeat, offset, length)
+               for repeat, _, _, _, _, offset, length, _ in repeats(path)]
+    index = os.path.join(os.path.dirname(path), INDEX)
+    with open(index + '.tmp', 'wb') as f:
+        f.writelines(records)
+    os.replace(index + '.tmp', index)
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('journal', help='journal.csv from the data directory')
+    parser.add_argument('--out', help='directory for the repeat files')
+    parser.add_argument('--reindex', action='store_true',
+                        help='rebuild journal.idx next to the journal')
+    args = parser.parse_args()
+
+    if args.reindex:
+        print('indexed {} repeats'.format(reindex(args.journal)))
+    if args.out:
+        print('wrote {} repeats to {}'.format(explode(args.journal, args.out),
+                                              args.out))
+    if not args.reindex and not args.out:
+        parser.error('give --out and/or --reindex')
+
+
+if __name__ == '__main__':
+    main()
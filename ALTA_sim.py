@@ -0,0 +1,318 @@
+'''
+Run the pyboard ALTA code on a host machine against a simulated rig.
+
+The real ALTA class from pyboard/ALTA.py is driven by stand-in peripherals
+(simulator/) backed by a thermal model of the Peltier/aluminium block/sample
+with stochastic nucleation. Time comes from a virtual clock that only moves
+when ALTA sleeps, so a day of repeats runs in seconds.
+
+    python ALTA_sim.py isothermal -15 --repeats 200
+    python ALTA_sim.py linear -1 --hours 24 --data sim_data/
+    python ALTA_sim.py profile steps.json --repeats 10
+    python ALTA_sim.py adaptive -13 -14 -15 --target 0.5
+    python ALTA_sim.py isothermal -15 --hours 6 --cells 4
+    python ALTA_sim.py isothermal -15 --hours 1 --asyncio
+    python ALTA_sim.py isothermal -15 --repeats 20 --telemetry telemetry.bin
+    python ALTA_sim.py isothermal -15 --repeats 3 --drivers --profile
+
+Or from Python:
+
+    import ALTA_sim
+    result = ALTA_sim.simulate('isothermal', -15, repeats=50, seed=1)
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for path in ('pyboard', 'simulator'): # simulator first, for the fake pyb
+    path = os.path.join(HERE, path)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import aio
+from clock import clock
+from rig import Rig
+import ALTA
+from cells import CellScheduler
+from runtime import Runtime
+from telemetry import TelemetryLink
+from journal import JOURNAL
+from profiler import Profiler
+from schedule import new_plan
+import ALTA_journal
+
+
+def use_virtual_time():
+    '''Point the time module of every loaded pyboard module at the clock'''
+    pyboard = os.path.join(HERE, 'pyboard')
+    for module in list(sys.modules.values()):
+        filename = getattr(module, '__file__', None) or ''
+        if filename.startswith(pyboard) and hasattr(module, 'time'):
+            module.time = clock
+
+
+use_virtual_time()
+
+
+class HostTicks():
+    '''
+    ticks_us of the computer running the simulation, for a Profiler timing
+    the pyboard code itself rather than the virtual clock
+    '''
+    def ticks_us(self):
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(self, end, start):
+        return end - start
+
+
+def outcomes(filepath):
+    '''Count the outcome of each repeat file, or journal entry, in filepath'''
+    counts = {}
+    journal = os.path.join(filepath, JOURNAL)
+    if os.path.exists(journal):
+        for entry in ALTA_journal.repeats(journal):
+            counts[entry[3]] = counts.get(entry[3], 0) + 1
+    for f in os.listdir(filepath):
+        parts = f[:-len('.csv')].split('_')
+        if f.endswith('.csv') and len(parts) == 4:
+            counts[parts[2]] = counts.get(parts[2], 0) + 1
+    return counts
+
+
+def until(steps, hours):
+    '''Stop a generator of ALTA steps after hours of virtual time'''
+    for step in steps:
+        if clock.elapsed_ms() > hours * 3600000:
+            return
+        yield step
+
+
+def simulate(mode='isothermal', setpoint=-15, repeats=None, hours=None,
+             filepath=None, seed=None, verbose=False, drivers=False, cells=1,
+             runtime=False, commands=(), **alta_kwargs):
+    '''
+    Run repeats of an experiment on a simulated rig.
+    mode: 'isothermal' (setpoint in deg C), 'linear' (setpoint in deg C/min)
+        'profile' (setpoint a list of segments, see pyboard/profiles.py) or
+        'adaptive' (setpoint a plan from pyboard/schedule.py, run until it
+        is done)
+    repeats: Stop after this many repeats
+    hours: Stop after this much virtual time
+    filepath: Directory for the data files, a temporary one if None
+    seed: Seed for the nucleation and sensor noise
+    verbose: Show ALTA's REPL output
+    drivers: Read the PRTs through the MAX31865 driver and simulated SPI
+    cells: Number of cells run by a CellScheduler, each with its own rig and
+        a subdirectory of filepath. Runs for hours (default 1)
+    runtime: Run under the asyncio Runtime. Runs for hours (default 1)
+    commands: With runtime, (time_s, line) commands to send it
+    alta_kwargs: Passed to ALTA, e.g. adaptive_melt=True
+    Returns a dict summarising the run.
+    '''
+    if cells > 1:
+        return simulate_cells(mode, setpoint, hours or 1, filepath, seed,
+                              verbose, drivers, cells, **alta_kwargs)
+    if runtime:
+        return simulate_runtime(mode, setpoint, hours or 1, filepath, seed,
+                                verbose, drivers, commands, **alta_kwargs)
+    if repeats is None and hours is None and mode != 'adaptive':
+        repeats = 1
+    if filepath is None:
+        filepath = tempfile.mkdtemp(prefix='alta_sim_')
+    filepath = os.path.join(filepath, '')
+    os.makedirs(filepath, exist_ok=True)
+
+    clock.reset()
+    use_virtual_time()
+    rig = Rig(seed, drivers)
+    output = contextlib.nullcontext() if verbose else \
+             contextlib.redirect_stdout(io.StringIO())
+    wall_start = time.perf_counter()
+    with output:
+        alta = rig.make_alta(**alta_kwargs)
+        repeat = alta.get_repeat_number(filepath)
+        done = 0
+        if mode == 'adaptive': # The schedule picks each repeat's setpoint
+            last = None if repeats is None else repeat + repeats
+            steps = alta.campaign_steps(mode, filepath, setpoint, last)
+            alta.run(steps if hours is None else until(steps, hours))
+            done = alta.done
+        else:
+            profile = alta.make_profile(mode, setpoint)
+            while repeats is None or done < repeats:
+                if hours is not None and clock.elapsed_ms() > hours * 3600000:
+                    break
+                repeat += 1
+                done += 1
+                if not alta.run(alta.profile_steps(filepath, profile,
+                                                   repeat)):
+                    break
+    wall = time.perf_counter() - wall_start
+
+    return {'filepath': filepath,
+            'repeats': done,
+            'outcomes': outcomes(filepath),
+            'virtual_s': clock.elapsed_ms() / 1000,
+            'wall_s': wall,
+            'freezes': rig.model.freezes}
+
+
+def simulate_cells(mode, setpoint, hours, filepath, seed, verbose, drivers,
+                   cells, **alta_kwargs):
+    '''Run several cells from one CellScheduler, see simulate'''
+    if filepath is None:
+        filepath = tempfile.mkdtemp(prefix='alta_sim_')
+    clock.reset()
+    use_virtual_time()
+    rigs = [Rig(seed if i == 0 else None, drivers) for i in range(cells)]
+    output = contextlib.nullcontext() if verbose else \
+             contextlib.redirect_stdout(io.StringIO())
+    wall_start = time.perf_counter()
+    with output:
+        scheduler = CellScheduler(rigs[0].lcd)
+        for i, rig in enumerate(rigs):
+            alta = rig.make_alta(lcd=False, ticker=scheduler.ticker,
+                                 buffered_log=True, **alta_kwargs)
+            cell_path = os.path.join(filepath, 'cell{}'.format(i + 1), '')
+            os.makedirs(cell_path, exist_ok=True)
+            steps = alta.campaign_steps(mode, cell_path, setpoint)
+            scheduler.add(alta, until(steps, hours))
+        scheduler.run()
+        summary = scheduler.summary()
+    wall = time.perf_counter() - wall_start
+
+    cell_outcomes = [outcomes(os.path.join(filepath, 'cell{}'.format(i + 1)))
+                     for i in range(cells)]
+    return {'filepath': filepath,
+            'repeats': sum(sum(c.values()) for c in cell_outcomes),
+            'outcomes': cell_outcomes,
+            'virtual_s': clock.elapsed_ms() / 1000,
+            'wall_s': wall,
+            'freezes': sum(rig.model.freezes for rig in rigs),
+            'summary': summary}
+
+
+def simulate_runtime(mode, setpoint, hours, filepath, seed, verbose, drivers,
+                     commands, **alta_kwargs):
+    '''Run one cell under the asyncio Runtime, see simulate'''
+    if filepath is None:
+        filepath = tempfile.mkdtemp(prefix='alta_sim_')
+    filepath = os.path.join(filepath, '')
+    os.makedirs(filepath, exist_ok=True)
+    clock.reset()
+    use_virtual_time()
+    rig = Rig(seed, drivers)
+    telemetry = io.StringIO()
+    output = contextlib.nullcontext() if verbose else \
+             contextlib.redirect_stdout(io.StringIO())
+    wall_start = time.perf_counter()
+    with output:
+        alta = rig.make_alta(buffered_log=True, **alta_kwargs)
+        runtime = Runtime(alta, aio.ScriptedReader(commands), telemetry)
+        steps = alta.campaign_steps(mode, filepath, setpoint)
+        loop = aio.new_event_loop()
+        try:
+            loop.run_until_complete(runtime.main(until(steps, hours)))
+        finally:
+            loop.close()
+    wall = time.perf_counter() - wall_start
+
+    counts = outcomes(filepath)
+    return {'filepath': filepath,
+            'repeats': sum(counts.values()),
+            'outcomes': counts,
+            'virtual_s': clock.elapsed_ms() / 1000,
+            'wall_s': wall,
+            'freezes': rig.model.freezes,
+            'summary': '\n'.join((runtime.ticker.summary(), runtime.summary())),
+            'telemetry': telemetry.getvalue()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('mode', choices=('isothermal', 'linear', 'profile',
+                                         'adaptive'))
+    parser.add_argument('setpoint', nargs='+',
+                        help='deg C (isothermal), deg C/min (linear), a '
+                             'JSON file of segments (profile), or several '
+                             'deg C (adaptive)')
+    parser.add_argument('--repeats', type=int)
+    parser.add_argument('--hours', type=float, help='virtual hours to run for')
+    parser.add_argument('--data', help='output directory')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('--drivers', action='store_true',
+                        help='use the MAX31865 driver with a simulated chip')
+    parser.add_argument('--cells', type=int, default=1,
+                        help='run this many cells from one scheduler')
+    parser.add_argument('--adaptive-melt', action='store_true',
+                        help='end each melt once the sample is clear')
+    parser.add_argument('--model-approach', action='store_true',
+                        help='back off full cooling using the block model')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='run under the asyncio runtime')
+    parser.add_argument('--journal', action='store_true',
+                        help='append the repeats to one journal file')
+    parser.add_argument('--telemetry', metavar='PATH',
+                        help='send binary telemetry to a file or pty')
+    parser.add_argument('--zero-alloc', action='store_true',
+                        help='run the loops without allocating')
+    parser.add_argument('--target', type=float, default=0.5,
+                        help='relative half width of the confidence interval '
+                             'on each nucleation rate (adaptive)')
+    parser.add_argument('--profile', action='store_true',
+                        help='time the sections of each tick on this computer')
+    args = parser.parse_args()
+    if args.mode == 'adaptive':
+        setpoint = new_plan([float(T) for T in args.setpoint], args.target)
+    elif len(args.setpoint) > 1:
+        parser.error('one setpoint for {}'.format(args.mode))
+    elif args.mode == 'profile':
+        with open(args.setpoint[0]) as f:
+            setpoint = json.load(f)
+    else:
+        setpoint = float(args.setpoint[0])
+
+    link = None
+    if args.telemetry:
+        if args.cells > 1:
+            parser.error('--telemetry sends one cell, not --cells')
+        link = TelemetryLink(open(args.telemetry, 'wb', buffering=0))
+    profiler = None
+    if args.profile:
+        if args.cells > 1:
+            parser.error('--profile times one cell, not --cells')
+        profiler = Profiler(clock=HostTicks())
+    result = simulate(args.mode, setpoint, args.repeats, args.hours,
+                      args.data, args.seed, args.verbose, args.drivers,
+                      args.cells, args.asyncio,
+                      adaptive_melt=args.adaptive_melt,
+                      model_approach=args.model_approach,
+                      journal=args.journal,
+                      link=link,
+                      profiler=profiler,
+                      zero_alloc=args.zero_alloc)
+    if link is not None:
+        print(link.summary())
+    if 'summary' in result:
+        print(result['summary'])
+    if profiler is not None:
+        print('last repeat, per tick (profile.csv in the data has them all):')
+        profiler.report()
+    print('{repeats} repeats in {virtual_s:.0f} s virtual, {wall_s:.1f} s wall'
+          .format(**result))
+    print('outcomes:', result['outcomes'])
+    print('data:', result['filepath'])
+
+
+if __name__ == '__main__':
+    main()
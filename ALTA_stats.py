@@ -0,0 +1,275 @@
+'''
+Nucleation statistics from a campaign of ALTA repeats.
+
+Works on the index of an ALTA_store.RunStore, with numpy array operations
+over all the repeats at once rather than Python loops over them:
+- Isothermal repeats give a lag time: from the start of the hold to freezing.
+  liquid_ repeats are censored at the end of their hold, early_ repeats froze
+  before the hold started and are only counted.
+- kaplan_meier() gives the fraction still liquid against lag time.
+- rate_constants() fits a constant nucleation rate k at each temperature,
+  S(t) = exp(-k t), and fit_rates() fits ln k against temperature. Where
+  nothing froze k has no estimate, only an upper bound.
+- frozen_fraction() gives the fraction of linear repeats frozen against
+  temperature, per cooling rate, down to where the liquid ones stopped being
+  watched. early_ repeats are only counted, as for lag times.
+- Confidence intervals come from bootstrap resamples, all drawn at once as a
+  (resamples, repeats) matrix of weights.
+
+    python ALTA_stats.py data/
+'''
+
+import argparse
+
+import numpy as np
+
+from ALTA_store import MODES, MS_PER_MIN, OUTCOMES, RunStore
+
+ISOTHERMAL = MODES.index('isothermal')
+LINEAR = MODES.index('linear')
+EARLY = OUTCOMES.index('early')
+FROZEN = OUTCOMES.index('frozen')
+LIQUID = OUTCOMES.index('liquid')
+
+RESAMPLES = 1000 # Bootstrap resamples
+CONFIDENCE = 0.95
+
+
+def lag_times(index):
+    '''
+    Lag times (s) and whether each froze (True) or is censored (False), for
+    the isothermal repeats in index which reached the hold
+    '''
+    held = (index['mode'] == ISOTHERMAL) & (index['outcome'] != EARLY)
+    runs = index[held]
+    times = (runs['value'] - runs['hold_ms']) / 1000
+    return times, runs['outcome'] == FROZEN
+
+
+def bootstrap_weights(n, resamples=RESAMPLES, rng=None):
+    '''
+    How many times each of n repeats is drawn in each resample, shape
+    (resamples, n). Weighting rather than indexing keeps the data sorted
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    return rng.multinomial(n, np.full(n, 1 / n), size=resamples)
+
+
+def interval(samples, confidence=CONFIDENCE):
+    '''Percentile interval over the first axis of bootstrap samples'''
+    tail = (1 - confidence) / 2 * 100
+    return np.nanpercentile(samples, (tail, 100 - tail), axis=0)
+
+
+def kaplan_meier(times, events, weights=None):
+    '''
+    Kaplan-Meier estimate of the fraction still liquid.
+    times: Lag or censoring time of each repeat
+    events: True if the repeat froze, False if censored
+    weights: Count of each repeat, shape (..., n), e.g. bootstrap_weights
+    Returns the sorted times and the survival just after each, shape (..., n)
+
+    Sorting puts freezes before censoring at tied times. A repeat then removes
+    w/R of the survivors, R being the weight still at risk including itself;
+    the product over tied repeats equals the usual (1 - d/n) at that time.
+    '''
+    order = np.lexsort((~events, times))
+    times = times[order]
+    events = events[order]
+    if weights is None:
+        weights = np.ones(len(times))
+    weights = np.asarray(weights, dtype=float)[..., order]
+    at_risk = np.cumsum(weights[..., ::-1], axis=-1)[..., ::-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        factor = 1 - np.where(events, weights, 0) / at_risk
+    return times, np.cumprod(np.nan_to_num(factor, nan=1.0), axis=-1)
+
+
+def survival_at(grid, times, survival):
+    '''Step function value of kaplan_meier output at each time in grid'''
+    i = np.searchsorted(times, grid, side='right') - 1
+    padded = np.concatenate([np.ones(survival.shape[:-1] + (1,)), survival],
+                            axis=-1)
+    return padded[..., i + 1]
+
+
+def rate_constant(times, events, weights=None):
+    '''
+    Maximum likelihood constant rate (1/s) with censoring: freezes divided by
+    the total time observed liquid. weights as kaplan_meier
+    '''
+    if weights is None:
+        return np.sum(events) / np.sum(times)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (weights @ events.astype(float)) / (weights @ times)
+
+
+def upper_bound(total_time, confidence=CONFIDENCE):
+    '''
+    One sided upper bound on k (1/s) when nothing froze in total_time (s):
+    the k at which no freeze has probability 1 - confidence, 3/total_time at
+    95%
+    '''
+    return -np.log(1 - confidence) / total_time
+
+
+def rate_constants(index, resamples=RESAMPLES, rng=None):
+    '''
+    Fit k at each isothermal temperature. Returns a structured array with the
+    temperature, counts of each outcome, k and its confidence interval (1/s).
+    Where none froze k is nan and the interval is [0, upper_bound]: the
+    bootstrap would give k = 0 with no width at all
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    iso = index[index['mode'] == ISOTHERMAL]
+    temperatures = np.unique(iso['setpoint'])
+    result = np.zeros(len(temperatures), dtype=[('T', 'f4'),
+                                                ('repeats', 'i4'),
+                                                ('frozen', 'i4'),
+                                                ('liquid', 'i4'),
+                                                ('early', 'i4'),
+                                                ('k', 'f8'),
+                                                ('k_low', 'f8'),
+                                                ('k_high', 'f8'),
+                                                ('median_s', 'f8')])
+    result['T'] = temperatures
+    group = np.searchsorted(temperatures, iso['setpoint'])
+    for outcome, name in ((FROZEN, 'frozen'), (LIQUID, 'liquid'),
+                          (EARLY, 'early')):
+        result[name] = np.bincount(group, iso['outcome'] == outcome,
+                                   len(temperatures))
+    result['repeats'] = np.bincount(group, minlength=len(temperatures))
+
+    for i, T in enumerate(temperatures): # Loop over temperatures only
+        times, events = lag_times(iso[group == i])
+        if len(times) == 0:
+            result['k'][i] = result['k_low'][i] = result['k_high'][i] = np.nan
+            result['median_s'][i] = np.nan
+            continue
+        if not np.any(events):
+            result['k'][i] = np.nan
+            result['k_low'][i] = 0
+            result['k_high'][i] = upper_bound(np.sum(times))
+            result['median_s'][i] = np.nan
+            continue
+        result['k'][i] = rate_constant(times, events)
+        weights = bootstrap_weights(len(times), resamples, rng)
+        result['k_low'][i], result['k_high'][i] = interval(
+            rate_constant(times, events, weights))
+        sorted_times, survival = kaplan_meier(times, events)
+        below = np.flatnonzero(survival <= 0.5)
+        result['median_s'][i] = sorted_times[below[0]] if len(below) else np.nan
+    return result
+
+
+def fit_rates(rates):
+    '''
+    Weighted least squares fit of ln k = a + b T, weighting each temperature by
+    its number of freezes, so those with only an upper bound are left out.
+    Returns (a, b); k(T) = exp(a + b T) (1/s)
+    '''
+    use = (rates['frozen'] > 0) & np.isfinite(rates['k']) & (rates['k'] > 0)
+    if np.sum(use) < 2:
+        return np.nan, np.nan
+    b, a = np.polyfit(rates['T'][use], np.log(rates['k'][use]), 1,
+                      w=np.sqrt(rates['frozen'][use]))
+    return a, b
+
+
+def frozen_fraction(index, grid, resamples=RESAMPLES, rng=None):
+    '''
+    Fraction of linear repeats frozen at each temperature in grid (deg C), per
+    cooling rate. early_ repeats froze before the ramp started and are only
+    counted. A liquid repeat is unfrozen down to where its ramp ended, and
+    below the warmest such end the fraction is unknown (NaN).
+    Returns {rate (deg C/min): (fraction, low, high, repeats, early)}, the
+    first three shaped like grid, repeats and early counts
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    grid = np.asarray(grid, dtype=float)
+    linear = index[index['mode'] == LINEAR]
+    fractions = {}
+    for rate in np.unique(linear['setpoint']): # Loop over rates only
+        runs = linear[linear['setpoint'] == rate]
+        early = np.sum(runs['outcome'] == EARLY)
+        runs = runs[runs['outcome'] != EARLY]
+        if len(runs) == 0:
+            nan = np.full(len(grid), np.nan)
+            fractions[float(rate)] = (nan, nan, nan, 0, early)
+            continue
+        freezing = np.where(runs['outcome'] == FROZEN, runs['value'], -np.inf)
+        frozen = (freezing[:, None] >= grid[None, :]).astype(float)
+        fraction = frozen.mean(axis=0)
+        weights = bootstrap_weights(len(runs), resamples, rng)
+        low, high = interval(weights @ frozen / len(runs))
+        liquid = runs[runs['outcome'] == LIQUID]
+        if len(liquid): # Ramp from 0 deg C at hold_ms to value (ms)
+            ended = rate / MS_PER_MIN * (liquid['value'] - liquid['hold_ms'])
+            unknown = grid < np.max(np.nan_to_num(ended, nan=0))
+            for a in (fraction, low, high):
+                a[unknown] = np.nan
+        fractions[float(rate)] = (fraction, low, high, len(runs), early)
+    return fractions
+
+
+def median_temperature(grid, fraction):
+    '''
+    Temperature where half are frozen, interpolated on a descending grid
+    between the points either side of the first reaching a half. NaN if fewer
+    than half are known to be frozen by its end
+    '''
+    reached = np.flatnonzero(fraction >= 0.5) # NaN never is
+    if len(reached) == 0:
+        return np.nan
+    i = reached[0]
+    if i == 0 or not np.isfinite(fraction[i - 1]):
+        return grid[i]
+    return np.interp(0.5, fraction[i - 1:i + 1], grid[i - 1:i + 1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('data', help='directory of repeat files')
+    parser.add_argument('--store', help='store directory')
+    parser.add_argument('--resamples', type=int, default=RESAMPLES)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    store = RunStore(args.data, args.store)
+    store.ingest()
+    rng = np.random.default_rng(args.seed)
+
+    rates = rate_constants(store.index, args.resamples, rng)
+    if len(rates):
+        print('Isothermal      T  repeats frozen liquid early  '
+              'k (1/s) [{:.0%} CI]         median lag (s)'.format(CONFIDENCE))
+        for r in rates:
+            if r['frozen']:
+                k = '{:.2e} [{:.2e}, {:.2e}]'.format(r['k'], r['k_low'],
+                                                   r['k_high'])
+            else: # Not fitted
+                k = '{:<29}'.format('< {:.2e}'.format(r['k_high']))
+            print('           {:6.1f} {:8d} {:6d} {:6d} {:5d}  {} {:8.1f}'
+                  .format(r['T'], r['repeats'], r['frozen'], r['liquid'],
+                          r['early'], k, r['median_s']))
+        a, b = fit_rates(rates)
+        if np.isfinite(b):
+            print('ln k = {:.3f} + {:.3f} T'.format(a, b))
+
+    grid = np.arange(0, -30.05, -0.1)
+    fractions = frozen_fraction(store.index, grid, args.resamples, rng)
+    if fractions:
+        print('Linear  rate (C/min) repeats early  T50 (C) [{:.0%} CI]'.format(
+            CONFIDENCE))
+        for rate, (fraction, low, high, repeats, early) in sorted(
+                fractions.items()):
+            print('        {:10g} {:8d} {:5d} {:8.1f} [{:.1f}, {:.1f}]'.format(
+                rate, repeats, early, median_temperature(grid, fraction),
+                median_temperature(grid, low), median_temperature(grid, high)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+'''
+Columnar store of ALTA repeats, for fast host side analysis.
+
+Every repeat is a CSV file named after its outcome (see pyboard/ALTA.py), e.g.
+23_isothermal-15.0_frozen_34200.csv. Parsing thousands of them as text for
+every analysis is slow, so ingest() parses each new or changed file once into:
+- traces.f4: One float32 memory mapped array of every sample, with columns
+  t (ms), T (deg C), calibrate/inner (deg C), ldr and status (a STATUSES code)
+- index.npy: One row per repeat, with its metadata from the filename and the
+  start/stop rows of its samples in traces
+- files.json: mtime and size of each ingested file, to spot changes
+
+The store lives in .alta_store inside the data directory, and covers any
+subdirectories (e.g. one per cell). Opening it only reads the index:
+
+    store = RunStore('data/')
+    store.ingest() # Only parses files added or changed since last time
+    store.ingest(['1/23_isothermal-15.0_frozen_34200.csv']) # Only this one
+    frozen = store.select(mode='isothermal', setpoint=-15, outcome='frozen')
+    for run in frozen:
+        t, T = store.trace(run)[:, 0], store.trace(run)[:, 1]
+
+    python ALTA_store.py data/
+'''
+
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+FILENAME = re.compile(r'(\d+)_(isothermal|linear|profile)_?([-+.\deE]+)_'
+                      r'(early|frozen|liquid)_([-+.\deE]+)\.csv$')
+MODES = ('isothermal', 'linear', 'profile')
+OUTCOMES = ('early', 'frozen', 'liquid')
+STATUSES = ('', 'Cool', 'Hold', 'Froz', 'Warm', 'Fast', 'Heat', 'Wait', 'Ramp')
+COLUMNS = ('t', 'T', 'calibrate', 'ldr', 'status')
+MS_PER_MIN = 1000 * 60
+
+INDEX_DTYPE = np.dtype([('repeat', 'i4'),
+                        ('mode', 'u1'), # MODES code
+                        ('setpoint', 'f4'), # deg C, or deg C/min if linear
+                        ('outcome', 'u1'), # OUTCOMES code
+                        ('value', 'f4'), # Freeze time (ms) or temperature
+                        ('hold_ms', 'f4'), # Start of the hold or ramp
+                        ('file', 'i4'), # Position in files
+                        ('start', 'i8'), # First row in traces
+                        ('stop', 'i8')]) # Row after the last
+
+
+def parse_filename(name):
+    '''
+    Metadata of a repeat from its filename, None if it isn't one. Linear rates
+    are written in deg C/ms and returned in deg C/min
+    '''
+    match = FILENAME.match(os.path.basename(name))
+    if match is None:
+        return None
+    repeat, mode, setpoint, outcome, value = match.groups()
+    setpoint = float(setpoint)
+    if mode == 'linear':
+        setpoint = round(setpoint * MS_PER_MIN, 6)
+    return {'repeat': int(repeat),
+            'mode': mode,
+            'setpoint': setpoint,
+            'outcome': outcome,
+            'value': float(value)}
+
+
+def read_trace(path):
+    '''Samples of a repeat file as a float32 array with COLUMNS'''
+    codes = {status: i for i, status in enumerate(STATUSES)}
+    rows = []
+    with open(path) as f:
+        for line in f:
+            fields = line.strip().split(',')
+            if len(fields) < 4:
+                continue
+            try:
+                row = [float(x) for x in fields[:4]]
+            except ValueError: # Header or a partly written line
+                continue
+            row.append(codes.get(fields[4], 0) if len(fields) > 4 else 0)
+            rows.append(row)
+    return np.array(rows, dtype=np.float32).reshape(-1, len(COLUMNS))
+
+
+def hold_start(trace, mode):
+    '''
+    Time the hold (isothermal), ramp (linear, from 0 deg C) or the first
+    hold or ramp (profile) started, NaN if it never did
+    '''
+    if mode == 'linear':
+        held = np.flatnonzero(trace[:, 1] < 0)
+    else:
+        held = np.flatnonzero((trace[:, 4] == STATUSES.index('Hold')) |
+                              (trace[:, 4] == STATUSES.index('Ramp')))
+    return trace[held[0], 0] if len(held) else np.nan
+
+
+class RunStore():
+    STORE = '.alta_store'
+
+    def __init__(self, data, store=None):
+        '''
+        data: Directory of repeat files, searched recursively
+        store: Directory for the store, data/.alta_store if None
+        '''
+        self.data = data
+        if store is None:
+            store = os.path.join(data, self.STORE)
+        self.store = store
+        self.files = {} # Relative path: [mtime, size]
+        self.names = [] # Relative paths, indexed by the index file column
+        self.positions = {} # Relative path: its position in names
+        self.index = np.zeros(0, INDEX_DTYPE)
+        self.rows = 0 # Rows used in traces, including orphaned ones
+        self._traces = None
+        self.load()
+
+    def path(self, name):
+        return os.path.join(self.store, name)
+
+    def load(self):
+        if not os.path.exists(self.path('files.json')):
+            return
+        with open(self.path('files.json')) as f:
+            state = json.load(f)
+        self.files = state['files']
+        self.names = state['names']
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.rows = state['rows']
+        self.index = np.load(self.path('index.npy'))
+        self._traces = None
+
+    def save(self):
+        '''Write the index, then files.json, each replacing the old at once'''
+        os.makedirs(self.store, exist_ok=True)
+        with open(self.path('index.tmp'), 'wb') as f:
+            np.save(f, self.index)
+        os.replace(self.path('index.tmp'), self.path('index.npy'))
+        with open(self.path('files.tmp'), 'w') as f:
+            json.dump({'files': self.files,
+                       'names': self.names,
+                       'rows': self.rows}, f)
+        os.replace(self.path('files.tmp'), self.path('files.json'))
+
+    @property
+    def traces(self):
+        '''Memory map of every sample, rows start:stop of the index'''
+        if self._traces is None:
+            if self.rows == 0:
+                return np.zeros((0, len(COLUMNS)), np.float32)
+            self._traces = np.memmap(self.path('traces.f4'), np.float32, 'r',
+                                     shape=(self.rows, len(COLUMNS)))
+        return self._traces
+
+    def scan(self):
+        '''Repeat files under data, as {relative path: [mtime, size]}'''
+        found = {}
+        for root, dirs, files in os.walk(self.data):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if parse_filename(name) is None:
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                found[os.path.relpath(path, self.data)] = [stat.st_mtime,
+                                                           stat.st_size]
+        return found
+
+    def stat(self, names):
+        '''Those of names (relative paths) which are repeat files, as scan'''
+        found = {}
+        for name in names:
+            path = os.path.join(self.data, name)
+            if parse_filename(name) is None or not os.path.exists(path):
+                continue
+            stat = os.stat(path)
+            found[name] = [stat.st_mtime, stat.st_size]
+        return found
+
+    def ingest(self, names=None):
+        '''
+        Add new and changed repeat files to the store, and drop removed ones.
+        names: Only look at these files (relative paths), e.g. one just
+            written, rather than scanning the whole data directory
+        Returns (added, removed) counts
+        '''
+        if names is None:
+            found = self.scan()
+            stored = self.files
+        else:
+            found = self.stat(names)
+            stored = {name: self.files[name] for name in names
+                      if name in self.files}
+        stale = {name for name, stat in stored.items()
+                 if found.get(name) != stat}
+        new = sorted(name for name, stat in found.items()
+                     if self.files.get(name) != stat)
+        if not stale and not new:
+            return 0, 0
+
+        keep = ~np.isin(self.index['file'],
+                        [self.positions[name] for name in stale])
+        index = [self.index[keep]]
+        for name in stale:
+            del self.files[name]
+
+        self._traces = None # Release the map before appending
+        os.makedirs(self.store, exist_ok=True)
+        with open(self.path('traces.f4'), 'ab') as f:
+            f.truncate(self.rows * len(COLUMNS) * 4) # Drop any partial write
+            for name in new:
+                meta = parse_filename(name)
+                trace = read_trace(os.path.join(self.data, name))
+                row = np.zeros(1, INDEX_DTYPE)
+                row['repeat'] = meta['repeat']
+                row['mode'] = MODES.index(meta['mode'])
+                row['setpoint'] = meta['setpoint']
+                row['outcome'] = OUTCOMES.index(meta['outcome'])
+                row['value'] = meta['value']
+                row['hold_ms'] = hold_start(trace, meta['mode'])
+                position = self.positions.get(name)
+                if position is None:
+                    position = self.positions[name] = len(self.names)
+                    self.names.append(name)
+                row['file'] = position
+                row['start'] = self.rows
+                self.rows += len(trace)
+                row['stop'] = self.rows
+                f.write(trace.tobytes())
+                self.files[name] = found[name]
+                index.append(row)
+        self.index = np.concatenate(index)
+        if any(name not in found for name in stale): # Removed
+            self.drop_names()
+        if self.orphaned() > self.rows // 2:
+            self.compact()
+        self.save()
+        return len(new), len(stale)
+
+    def drop_names(self):
+        '''Forget the names of files no longer stored, renumbering the rest'''
+        kept = [name for name in self.names if name in self.files]
+        renumber = np.zeros(len(self.names), self.index['file'].dtype)
+        for i, name in enumerate(kept):
+            renumber[self.positions[name]] = i
+        self.index['file'] = renumber[self.index['file']]
+        self.names = kept
+        self.positions = {name: i for i, name in enumerate(kept)}
+
+    def orphaned(self):
+        '''Rows of traces no longer in the index, from changed files'''
+        return self.rows - int(np.sum(self.index['stop'] - self.index['start']))
+
+    def compact(self):
+        '''Rewrite traces without orphaned rows'''
+        traces = self.traces
+        with open(self.path('traces.tmp'), 'wb') as f:
+            start = 0
+            for run in self.index:
+                f.write(np.asarray(traces[run['start']:run['stop']]).tobytes())
+                run['stop'] = start + run['stop'] - run['start']
+                run['start'] = start
+                start = run['stop']
+        self._traces = None
+        del traces
+        os.replace(self.path('traces.tmp'), self.path('traces.f4'))
+        self.rows = int(start)
+
+    def select(self, mode=None, setpoint=None, outcome=None, directory=None):
+        '''Index rows matching all the given metadata'''
+        keep = np.ones(len(self.index), dtype=bool)
+        if mode is not None:
+            keep &= self.index['mode'] == MODES.index(mode)
+        if setpoint is not None:
+            keep &= np.isclose(self.index['setpoint'], setpoint)
+        if outcome is not None:
+            keep &= self.index['outcome'] == OUTCOMES.index(outcome)
+        if directory is not None:
+            in_dir = [os.path.dirname(name) == directory for name in self.names]
+            keep &= np.array(in_dir, dtype=bool)[self.index['file']]
+        return self.index[keep]
+
+    def trace(self, run):
+        '''Samples of an index row, a view into the memory map'''
+        return self.traces[run['start']:run['stop']]
+
+    def name(self, run):
+        return self.names[run['file']]
+
+    def summary(self):
+        '''Count of repeats by mode, setpoint and outcome'''
+        counts = {}
+        for run in self.index:
+            key = (MODES[run['mode']], float(run['setpoint']),
+                   OUTCOMES[run['outcome']])
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('data', help='directory of repeat files')
+    parser.add_argument('--store', help='store directory')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = RunStore(args.data, args.store)
+    added, removed = store.ingest()
+    print('ingested {} new, {} removed in {:.2f} s'.format(
+        added, removed, time.perf_counter() - start))
+    print('{} repeats, {} samples'.format(len(store.index), store.rows))
+    for (mode, setpoint, outcome), n in sorted(store.summary().items()):
+        print('{:10} {:8g} {:6} {:5d}'.format(mode, setpoint, outcome, n))
+
+
+if __name__ == '__main__':
+    main()
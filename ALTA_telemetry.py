@@ -0,0 +1,205 @@
+'''
+Receive ALTA's binary telemetry (pyboard/telemetry.py) on the host.
+
+Decodes the frames as they arrive, checking each CRC and resynchronising on
+the sync bytes after corruption, and counts the frames lost from the
+sequence numbers. Each repeat, bracketed by START and END frames, is written
+out as the CSV file ALTA itself writes to the SD card, and ingested into the
+ALTA_store.RunStore of the output directory, so it can be analysed while the
+campaign is still running.
+
+    python ALTA_telemetry.py /dev/ttyACM0 --out live_data/
+
+Anything readable works as the port, e.g. one end of a pty pair or a file
+of recorded telemetry.
+'''
+
+import argparse
+import os
+import select
+import struct
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'pyboard'))
+
+from binascii import crc32
+from telemetry import (END, FRAME_SIZE, HEADER, MODES, OUTCOMES, SAMPLE,
+                       START, STATUSES, SYNC)
+
+MS_PER_MIN = 1000 * 60
+
+
+class Decoder():
+    '''Turns a byte stream into frames, counting errors and gaps'''
+    def __init__(self):
+        self.buf = bytearray()
+        self.last_seq = None
+        self.frames = 0
+        self.lost = 0 # Frames missing from the sequence
+        self.crc_errors = 0
+        self.skipped = 0 # Bytes discarded while looking for sync
+
+    def feed(self, data):
+        '''Add received bytes, returns the complete frames as tuples of
+        (seq, type, status, t, a, b, code)'''
+        self.buf += data
+        frames = []
+        buf = self.buf
+        i = 0
+        while len(buf) - i >= FRAME_SIZE:
+            if buf[i:i + 2] != SYNC:
+                j = buf.find(SYNC, i + 1)
+                if j < 0:
+                    j = len(buf) - 1 # Keep a possible first sync byte
+                self.skipped += j - i
+                i = j
+                continue
+            frame = bytes(buf[i:i + FRAME_SIZE])
+            crc, = struct.unpack_from('<I', frame, FRAME_SIZE - 4)
+            if crc32(frame[:-4]) != crc:
+                self.crc_errors += 1
+                self.skipped += 1
+                i += 1 # Sync bytes inside the data, look further on
+                continue
+            fields = struct.unpack_from(HEADER, frame)[1:]
+            self.track(fields[0])
+            frames.append(fields)
+            i += FRAME_SIZE
+        del buf[:i]
+        return frames
+
+    def track(self, seq):
+        if self.last_seq is not None:
+            self.lost += (seq - self.last_seq - 1) & 0xFFFF
+        self.last_seq = seq
+        self.frames += 1
+
+    def summary(self):
+        return 'frames {} lost {} crc errors {} bytes skipped {}'.format(
+            self.frames, self.lost, self.crc_errors, self.skipped)
+
+
+def start_setpoint(a, whole):
+    '''
+    The setpoint ALTA started a repeat with, from a START frame: the shortest
+    decimal which packs to the same float32 as a, an int if whole
+    '''
+    packed = struct.pack('<f', a)
+    for digits in range(1, 10):
+        setpoint = float('{:.{}g}'.format(a, digits))
+        if struct.pack('<f', setpoint) == packed:
+            break
+    return int(setpoint) if whole else setpoint
+
+
+def repeat_filename(repeat, mode, setpoint, outcome, value):
+    '''
+    The name ALTA gives a repeat file on the SD card (ALTA.end_repeat),
+    setpoint as from start_setpoint
+    '''
+    if mode == 'linear':
+        setpoint = setpoint / MS_PER_MIN # ALTA writes deg C/ms
+    if outcome == 'frozen' and mode == 'isothermal' or outcome == 'liquid':
+        value = int(value) # Time (ms)
+    else:
+        value = round(value, 2) # Temperature
+    return '{}_{}{}_{}_{}.csv'.format(repeat, mode, setpoint, outcome, value)
+
+
+class RepeatWriter():
+    '''Writes the repeats in a stream of frames as CSV files in out'''
+    def __init__(self, out, store=True):
+        '''store: ingest each repeat into the RunStore of out'''
+        self.out = out
+        os.makedirs(out, exist_ok=True)
+        self.repeat = None # (repeat, mode, setpoint) of the current one
+        self.rows = []
+        self.written = []
+        self.store = None
+        if store:
+            from ALTA_store import RunStore
+            self.store = RunStore(out)
+
+    def frame(self, seq, kind, status, t, a, b, code):
+        if kind == START:
+            self.repeat = (t, MODES[code], start_setpoint(a, status))
+            self.rows = []
+        elif kind == SAMPLE and self.repeat is not None:
+            row = [t, round(a, 2), round(b, 2), code, STATUSES[status]]
+            self.rows.append(','.join(str(x) for x in row) + '\n')
+        elif kind == END and self.repeat is not None and self.repeat[0] == t:
+            name = repeat_filename(*self.repeat, OUTCOMES[code], a)
+            with open(os.path.join(self.out, name), 'w') as f:
+                f.writelines(self.rows)
+            self.written.append(name)
+            self.repeat = None
+            if self.store is not None:
+                self.store.ingest([name])
+            return name
+        return None
+
+
+def open_port(path):
+    '''Open a serial port or file for reading raw bytes'''
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOCTTY', 0))
+    if os.isatty(fd):
+        import tty
+        tty.setraw(fd)
+    return fd
+
+
+def receive(fd, writer, decoder, idle_s=None, report_s=10):
+    '''
+    Read and decode until the port closes, or nothing arrives for idle_s
+    (a serial port never closes, so by default that runs until interrupted)
+    '''
+    last_data = last_report = time.monotonic()
+    while True:
+        data = None
+        if select.select([fd], [], [], 1)[0]:
+            try:
+                data = os.read(fd, 4096)
+            except OSError: # pty closed by the other end
+                data = b''
+            if not data:
+                break
+        now = time.monotonic()
+        if data:
+            last_data = now
+            for frame in decoder.feed(data):
+                name = writer.frame(*frame)
+                if name is not None:
+                    print(name)
+        elif idle_s is not None and now - last_data > idle_s:
+            break
+        if now - last_report > report_s:
+            print(decoder.summary())
+            last_report = now
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('port', help='serial port, pty or recorded file')
+    parser.add_argument('--out', default='telemetry_data',
+                        help='directory for the repeat files and store')
+    parser.add_argument('--no-store', action='store_true',
+                        help="don't ingest repeats into the store")
+    args = parser.parse_args()
+
+    decoder = Decoder()
+    writer = RepeatWriter(args.out, not args.no_store)
+    fd = open_port(args.port)
+    try:
+        receive(fd, writer, decoder)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(fd)
+    print(decoder.summary())
+    print('{} repeats written to {}'.format(len(writer.written), args.out))
+
+
+if __name__ == '__main__':
+    main()
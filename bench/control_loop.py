@@ -0,0 +1,451 @@
+'''
+Benchmark suite for the control loop, under CPython or MicroPython's Unix
+port.
+
+Runs the parts of each 200 ms tick, and whole ticks of an isothermal repeat,
+against the simulated rig: the real MAX31865 driver on the simulated SPI bus,
+I2cLcd on the recording fake I2C bus from simulator/pyb.py, and PI_Controller.
+For each benchmark it reports, per iteration:
+1. us: mean time (the best of RUNS runs) and the longest single iteration
+2. heap: bytes allocated. Under MicroPython the growth of gc.mem_alloc()
+with the collector off. CPython frees most objects as soon as they are
+dropped, so there it is the peak of the memory traced by tracemalloc, which
+catches the same new objects
+3. spi, i2c: transactions on the buses
+
+The tick benchmarks hold the simulated rig still over each measured tick
+(Rig.hold), so the time and heap are ALTA's own, not the thermal model's.
+
+The ZERO_HEAP benchmarks, ALTA's zero allocation mode, are checked tick by
+tick under MicroPython. Where floats are not objects on the heap, as on the
+pyBoard, they must allocate nothing at all: build the Unix port the same way
+(32 bit, MICROPY_OBJ_REPR_C, single precision floats, see
+.github/workflows/bench.yml) and pass --repr-c, which fails if floats still
+allocate. On the default 64 bit build every float result is a new object, so
+there no tick may allocate more than ZERO_ALLOC_FLOATS floats: the float
+arithmetic of the sensors, LDR detector and block model, and nothing else.
+
+The results are compared with the baselines stored for the runtime (cpython,
+micropython, or micropython_repr_c where floats are not allocated) in
+bench/baselines.json. More bus transactions than the baseline, more than
+HEAP_TOLERANCE more heap, or more than TIME_TOLERANCE more time (each with a
+small slack) is a regression, and the run exits with status 1. Times depend
+on the machine, so store baselines on the machine which runs the suite; on
+shared machines, such as CI runners, pass --advisory-time to report slower
+times without failing. --require-baselines fails benchmarks with no baseline.
+
+    python bench/control_loop.py            # Compare with the baselines
+    python bench/control_loop.py tick pi    # Only these benchmarks
+    python bench/control_loop.py --save     # Store the results as baselines
+    python bench/control_loop.py --advisory-time --require-baselines
+    micropython bench/control_loop.py
+    micropython bench/control_loop.py --repr-c tick_zero_alloc
+'''
+
+import gc
+import io
+import json
+import sys
+import time
+
+ROOT = '/'.join(__file__.split('/')[:-2]) or '.' # Run from the repository
+for path in ('/pyboard', '/simulator'):
+    if ROOT + path not in sys.path:
+        sys.path.insert(0, ROOT + path)
+
+from clock import clock
+from pyb import I2C
+from rig import Rig
+from ALTA import ALTA
+from datalog import BufferedLog, DirectLog
+from pi_controller import PI_Controller
+from pyb_i2c_lcd import I2cLcd
+from runtime import Runtime
+
+for module in list(sys.modules.values()): # As ALTA_sim.use_virtual_time
+    if ('/pyboard/' in (getattr(module, '__file__', None) or '') and
+            hasattr(module, 'time')):
+        module.time = clock
+
+BASELINES = ROOT + '/bench/baselines.json'
+ITERATIONS = 300 # Per run, a minute of ticks
+RUNS = 3
+SEED = 1
+SETPOINT = -15
+TIME_TOLERANCE = 0.5 # Fraction slower than the baseline which is a regression
+TIME_SLACK = 5 # (us) Allowed on top, for the fastest benchmarks
+HEAP_TOLERANCE = 0.1
+HEAP_SLACK = 16 # (bytes) Allowed on top, for small baselines
+ZERO_HEAP = ('tick_zero_alloc', 'tick_runtime')
+ZERO_ALLOC_FLOATS = 24 # Float results a ZERO_HEAP tick may allocate (22 cooling)
+
+try: # MicroPython
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError: # CPython
+    ticks_us = lambda: int(time.perf_counter() * 1000000)
+    ticks_diff = lambda end, start: end - start
+
+try: # CPython
+    import tracemalloc
+except ImportError: # MicroPython
+    tracemalloc = None
+
+try:
+    import tempfile
+    DATA = tempfile.mkdtemp()
+except ImportError: # MicroPython
+    tempfile = None
+    DATA = '/tmp'
+
+SAMPLE = (64200, -15.1, -14.2, 2394, 'Hold')
+
+
+class Setup():
+    '''
+    A rig with ALTA on it, the real drivers and I2cLcd. step() is the work
+    being measured, idle() runs between iterations unmeasured, e.g. waiting
+    for the next tick
+    '''
+    ALTA_KWARGS = {'buffered_log': True}
+
+    def __init__(self):
+        clock.reset()
+        self.rig = Rig(SEED, drivers=True)
+        self.i2c = I2C(1, I2C.MASTER)
+        self.rig.lcd = I2cLcd(self.i2c, 0x3F, 2, 16)
+        self.alta = self.rig.make_alta(**self.ALTA_KWARGS)
+        self.buses = (self.rig.ptd.spi, self.rig.calibrate.spi)
+        self.files = []
+
+    def reset_counts(self):
+        for bus in self.buses:
+            bus.reset_counts()
+        self.i2c.reset_counts()
+
+    def spi(self):
+        return sum(bus.transactions for bus in self.buses)
+
+    def open(self, name, mode):
+        f = open(DATA + '/' + name, mode)
+        self.files.append(f)
+        return f
+
+    def idle(self):
+        self.alta.ticker.wait()
+
+    def close(self):
+        self.alta.ticker.deinit()
+        for f in self.files:
+            f.close()
+
+
+class Tick(Setup):
+    '''
+    One tick of an isothermal repeat, cooling then holding at SETPOINT, with
+    the rig held still until the next
+    '''
+    def __init__(self):
+        Setup.__init__(self)
+        self.steps = self.alta.isothermal_steps(DATA, SETPOINT, 1)
+        self.alta.ticker.reset()
+        self.rig.hold()
+
+    def step(self):
+        next(self.steps)
+
+    def idle(self):
+        self.rig.hold(False)
+        Setup.idle(self)
+        self.rig.hold()
+
+    def close(self):
+        self.rig.hold(False)
+        self.steps.close() # Closes running.csv
+        Setup.close(self)
+
+
+class ZeroAllocTick(Tick):
+    '''One tick as Tick, in ALTA's zero allocation mode'''
+    ALTA_KWARGS = {'zero_alloc': True}
+
+
+class RuntimeTick(ZeroAllocTick):
+    '''
+    One tick as ZeroAllocTick, of the control task of a Runtime: the sample
+    queued as telemetry, the LCD and SD card left to the other tasks, whose
+    work is done in idle()
+    '''
+    def __init__(self):
+        ZeroAllocTick.__init__(self)
+        self.runtime = Runtime(self.alta, io.StringIO(), io.StringIO())
+        self.alta.telemetry = self.runtime.telemetry
+        self.alta.background_io = True
+
+    def idle(self):
+        telemetry = self.runtime.telemetry
+        line = telemetry.get_nowait()
+        while line is not None: # As send_telemetry
+            bytes(line.buf[:line.n]).decode()
+            line = telemetry.get_nowait()
+        self.alta.screen.refresh()
+        self.alta.log.service()
+        ZeroAllocTick.idle(self)
+
+
+class ReadInputs(Setup):
+    '''Both PTDs over SPI and the LDR burst'''
+    def step(self):
+        self.alta.read_inputs()
+
+
+class ScreenPut(Setup):
+    '''Format the status row, and refresh the LCD if it is due'''
+    def __init__(self):
+        Setup.__init__(self)
+        self.t = 0
+
+    def step(self):
+        self.alta.screen_put('{} {:5.1f} {:5d}'.format('Hold', SAMPLE[1],
+                                                       self.t // 1000), row=1)
+        self.alta.screen.refresh()
+
+    def idle(self):
+        Setup.idle(self)
+        self.t += ALTA.DELAY_MS
+
+
+class Csvify(Setup):
+    def step(self):
+        self.alta.csvify(*SAMPLE)
+
+
+class Print(Setup):
+    '''Echoing a sample to the REPL, into a sink rather than the terminal'''
+    def __init__(self):
+        Setup.__init__(self)
+        self.line = self.alta.csvify(*SAMPLE)
+        self.sink = self.open('print.txt', 'w')
+
+    def step(self):
+        print(self.line, end='', file=self.sink)
+
+
+class DirectWrite(Setup):
+    '''DirectLog: f.write of every sample inside the tick'''
+    def __init__(self):
+        Setup.__init__(self)
+        self.line = self.alta.csvify(*SAMPLE)
+        self.log = DirectLog(echo=False)
+        self.log.attach(self.open('direct.csv', DirectLog.MODE))
+
+    def step(self):
+        self.log.write(self.line)
+        self.log.service()
+
+
+class BufferedWrite(Setup):
+    '''BufferedLog: copy into the ring buffer, write whole blocks'''
+    def __init__(self):
+        Setup.__init__(self)
+        self.line = self.alta.csvify(*SAMPLE)
+        self.log = BufferedLog(ticker=self.alta.ticker)
+        self.log.attach(self.open('buffered.csv', BufferedLog.MODE))
+
+    def step(self):
+        self.log.write(self.line)
+        self.log.service()
+
+
+class Pi(Setup):
+    '''PI_Controller.proportion, on the block temperature read in idle()'''
+    def __init__(self):
+        Setup.__init__(self)
+        self.pid = PI_Controller(ALTA.K_C, ALTA.TAU_I, ALTA.DELAY_S,
+                                 SETPOINT, 40)
+        self.T = self.alta.ptd.read()
+
+    def step(self):
+        self.pid.proportion(self.T)
+
+    def idle(self):
+        Setup.idle(self)
+        self.T = self.alta.ptd.read()
+
+
+BENCHMARKS = (('tick', Tick),
+              ('tick_zero_alloc', ZeroAllocTick),
+              ('tick_runtime', RuntimeTick),
+              ('read_inputs', ReadInputs),
+              ('screen_put', ScreenPut),
+              ('csvify', Csvify),
+              ('print', Print),
+              ('f_write', DirectWrite),
+              ('buffered_write', BufferedWrite),
+              ('pi', Pi))
+
+
+def time_run(setup):
+    '''(mean, max) us per iteration'''
+    total = 0
+    longest = 0
+    for _ in range(ITERATIONS):
+        start = ticks_us()
+        setup.step()
+        us = ticks_diff(ticks_us(), start)
+        setup.idle()
+        total += us
+        if us > longest:
+            longest = us
+    return total / ITERATIONS, longest
+
+
+def heap_run(setup):
+    '''
+    Bytes allocated, the most in one iteration, and bus transactions (spi,
+    i2c) per iteration
+    '''
+    heap = most = spi = i2c = 0
+    for _ in range(ITERATIONS):
+        gc.collect()
+        setup.reset_counts()
+        if tracemalloc is None:
+            gc.disable()
+            start = gc.mem_alloc()
+            setup.step()
+            allocated = gc.mem_alloc() - start
+            gc.enable()
+        else:
+            tracemalloc.start()
+            start = tracemalloc.get_traced_memory()[0]
+            setup.step()
+            allocated = tracemalloc.get_traced_memory()[1] - start
+            tracemalloc.stop()
+        heap += allocated
+        most = max(most, allocated)
+        spi += setup.spi()
+        i2c += setup.i2c.transactions
+        setup.idle()
+    return heap / ITERATIONS, most, spi / ITERATIONS, i2c / ITERATIONS
+
+
+def measure(make):
+    '''Results of the benchmark made by make()'''
+    times = []
+    for _ in range(RUNS):
+        setup = make()
+        times.append(time_run(setup))
+        setup.close()
+    setup = make()
+    heap, most, spi, i2c = heap_run(setup)
+    setup.close()
+    us, longest = min(times)
+    return {'us': round(us, 1), 'max_us': longest, 'heap': round(heap, 1),
+            'max_heap': most, 'spi': round(spi, 2), 'i2c': round(i2c, 2)}
+
+
+def float_bytes():
+    '''
+    Bytes a float result allocates under MicroPython, 0 where floats are not
+    objects on the heap. None under CPython, where ticks are not checked
+    '''
+    if tracemalloc is not None:
+        return None
+    x = float(SEED)
+    gc.collect()
+    gc.disable()
+    start = gc.mem_alloc()
+    x = x * 1.5
+    grew = gc.mem_alloc() - start
+    gc.enable()
+    return grew
+
+
+def regressions(result, baseline):
+    '''What got worse than the baseline, as strings, and the time if slower'''
+    worse = []
+    for key in ('spi', 'i2c'):
+        if result[key] > baseline[key]:
+            worse.append('{} {} > {}'.format(key, result[key], baseline[key]))
+    if result['heap'] > baseline['heap'] * (1 + HEAP_TOLERANCE) + HEAP_SLACK:
+        worse.append('heap {} > {}'.format(result['heap'], baseline['heap']))
+    slower = None
+    if result['us'] > baseline['us'] * (1 + TIME_TOLERANCE) + TIME_SLACK:
+        slower = 'us {:.1f} > {:.1f}'.format(result['us'], baseline['us'])
+    return worse, slower
+
+
+def load_baselines():
+    try:
+        with open(BASELINES) as f:
+            return json.load(f)
+    except OSError: # None stored yet
+        return {}
+
+
+def main():
+    save = '--save' in sys.argv
+    advisory_time = '--advisory-time' in sys.argv
+    require = '--require-baselines' in sys.argv
+    names = [arg for arg in sys.argv[1:] if not arg.startswith('-')]
+    implementation = sys.implementation.name
+    size = float_bytes()
+    budget = None if size is None else ZERO_ALLOC_FLOATS * size
+    runtime = implementation + ('_repr_c' if size == 0 else '')
+    baselines = load_baselines()
+    stored = baselines.get(runtime, {})
+
+    print('{} {}, {} iterations'.format(runtime,
+                                        sys.version.split()[0], ITERATIONS))
+    if '--repr-c' in sys.argv and size != 0:
+        print('floats are allocated, build with MICROPY_OBJ_REPR_C')
+        sys.exit(1)
+    if budget == 0:
+        print('floats are not allocated, checking', ', '.join(ZERO_HEAP),
+              'allocate nothing')
+    elif budget is not None:
+        print('floats allocate {} bytes, checking no tick of {} allocates '
+              'more than {} floats'.format(size, ', '.join(ZERO_HEAP),
+                                           ZERO_ALLOC_FLOATS))
+    print('{:<16}{:>9}{:>9}{:>9}{:>7}{:>7}'.format('', 'us', 'max us',
+                                                   'heap', 'spi', 'i2c'))
+    failed = []
+    for name, make in BENCHMARKS:
+        if names and name not in names:
+            continue
+        result = measure(make)
+        worse, slower = [], None
+        if not save and name in stored:
+            worse, slower = regressions(result, stored[name])
+        if slower is not None and not advisory_time:
+            worse.append(slower)
+        if require and not save and name not in stored:
+            worse.append('no baseline')
+        if budget is not None and name in ZERO_HEAP and \
+                result['max_heap'] > budget:
+            worse.append('tick heap {} > {}'.format(result['max_heap'],
+                                                    budget))
+        print('{:<16}{:>9.1f}{:>9}{:>9.1f}{:>7.2f}{:>7.2f}  {}'.format(
+            name, result['us'], result['max_us'], result['heap'],
+            result['spi'], result['i2c'],
+            'REGRESSION ' + ', '.join(worse) if worse else
+            'slower ' + slower if slower is not None else
+            '' if name in stored or save else 'no baseline'))
+        if worse:
+            failed.append(name)
+        stored[name] = result if save or name not in stored else stored[name]
+
+    if tempfile is not None:
+        import shutil
+        shutil.rmtree(DATA)
+    if save:
+        baselines[runtime] = stored
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+        print('saved baselines to', BASELINES)
+    elif failed:
+        print('regressions in', ', '.join(failed))
+        sys.exit(1)
+
+
+main()
@@ -0,0 +1,82 @@
+'''
+Micro-benchmark of the I2C traffic needed to update the LCD.
+
+Runs I2cLcd against the recording fake I2C bus from simulator/pyb.py and
+prints the number of transactions and bytes sent to write one 16 character
+row, using:
+1. LcdApi.putstr, which sends each character as its own transaction
+2. I2cLcd.putstr, which sends the whole string in one transaction
+3. I2cLcd.write_row, which also includes the cursor move
+
+For reference, before the transfers were batched every nibble edge was its
+own transaction: 4 per character or command.
+
+    python bench/lcd_i2c.py
+'''
+
+import sys
+import time
+
+ROOT = '/'.join(__file__.split('/')[:-2]) or '.' # Run from the repository
+for path in ('/pyboard', '/simulator'):
+    if ROOT + path not in sys.path:
+        sys.path.insert(0, ROOT + path)
+
+from pyb import I2C
+from lcd_api import LcdApi
+from pyb_i2c_lcd import I2cLcd
+
+ROW = 'Hold -15.0   42 '
+REPEATS = 1000
+
+try: # MicroPython
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError: # CPython
+    ticks_us = lambda: int(time.perf_counter() * 1000000)
+    ticks_diff = lambda end, start: end - start
+
+
+def measure(name, i2c, write):
+    '''Print the I2C traffic and time for one call of write()'''
+    i2c.reset_counts()
+    i2c.record = True
+    write()
+    sent = bytes(i2c.sent)
+    i2c.record = False
+
+    i2c.reset_counts()
+    start = ticks_us()
+    for _ in range(REPEATS):
+        write()
+    us = ticks_diff(ticks_us(), start) / REPEATS
+    print('{:<18}{:>4} transactions {:>4} bytes {:>8.1f} us'.format(
+        name, i2c.transactions // REPEATS, i2c.bytes_sent // REPEATS, us))
+    return sent
+
+
+def main():
+    i2c = I2C(1, I2C.MASTER)
+    lcd = I2cLcd(i2c, 0x3F, 2, 16)
+
+    def per_char():
+        lcd.move_to(0, 1)
+        LcdApi.putstr(lcd, ROW)
+
+    def bulk():
+        lcd.move_to(0, 1)
+        lcd.putstr(ROW)
+
+    def row():
+        lcd.write_row(1, ROW)
+
+    print('Writing one {} character row'.format(len(ROW)))
+    slow = measure('LcdApi.putstr', i2c, per_char)
+    fast = measure('I2cLcd.putstr', i2c, bulk)
+    measure('I2cLcd.write_row', i2c, row)
+    if slow != fast:
+        print('ERROR: I2cLcd.putstr sent different bytes to LcdApi.putstr')
+        sys.exit(1)
+
+
+main()
@@ -52,28 +52,52 @@ Each file contains the following columns, separated by commas:
     2.1 Internal temperature (deg C) for calibration
 3. LDR value (Arb units)
 4. ALTA status (cool, hold, heat)
+
+With ALTA(..., journal=True) the repeats are appended to one journal.csv in
+the data directory instead, see journal.py.
 '''
 
+import gc
 import os
-import time
 from pyb import SPI, Pin, millis, Timer
 
+from approach import ApproachMetrics, Fopdt
+from datalog import BufferedLog, DirectLog
+from journal import Journal
+from lcd_screen import LcdScreen
+from ldr import LdrDetector
+from linebuf import LineBuffer
 from pi_controller import PI_Controller
+from profiles import (Profile, cool, hold, ramp, wait_for_freeze, melt, COOL,
+                      RAMP)
+from profiler import (Profiler, TICK, MELT, PTD, CALIBRATE, LDR, SCREEN_PUT,
+                      CSVIFY, LOG, PI, LCD, SD, GC)
+from schedule import Schedule, new_plan
+from ticker import Ticker
 
 
 class ALTA():
     LDR_THRESHOLD = 150 # 150 less than the clear LDR value
     MAXIMUM_WAIT = 1000 * 60 * 2.5 # (ms)
     # PWM_FIT_COEFFS is a polynomial to approximate the temperature at any
-    # given PWM value. This is for isothermal experiments to approx the offset
+    # given PWM value. This is for isothermal experiments to approx the offset.
+    # A calibration table from the config file replaces it, see target_pwm
     PWM_FIT_COEFFS = (32.913, -1.623, 0.014) # magic numbers
     DELAY_MS = 200 # (ms), time between readings
     DELAY_S = DELAY_MS / 1000 # (s)
     MELT_TEMPERATURE = 15 # (deg C) Temperature to hold at while sample melts
     MELT_TIME = 1000 * 60 # (ms) Wait 1 minute
+    # Adaptive melt: end once the LDR is clear and the block has been above
+    # MELT_STABLE_TEMPERATURE for MELT_STABLE_TIME, but never after MELT_MAX_TIME
+    MELT_STABLE_TEMPERATURE = 10 # (deg C)
+    MELT_STABLE_TIME = 1000 * 10 # (ms)
+    MELT_MAX_TIME = 1000 * 60 * 5 # (ms) Safety cap from the start of the melt
+    RAMP_END = -25 # (deg C) Linear ramps end here
+    LCD_REFRESH_MS = 1000 # (ms) Minimum time between LCD updates
 
     K_C = -10 #  Proportional constant for PI control
     TAU_I = 100 #  Integrational time constant for PI control
+    # Tuned gains from the config file replace these, see autotune.py
     
     def __init__(self,
                  ptd,
@@ -83,7 +107,17 @@ class ALTA():
                  lcd,
                  fans_pin,
                  relay_1,
-                 relay_2):
+                 relay_2,
+                 ticker=None,
+                 buffered_log=False,
+                 adaptive_melt=False,
+                 model_approach=False,
+                 settings=None,
+                 link=None,
+                 journal=False,
+                 checkpoint=None,
+                 profiler=None,
+                 zero_alloc=False):
         '''
         ptd: platinum resistance thermometer (ptd) embedded in ALTA (MAX31865)
         calibrate: ptd which can be placed inside sample for calibration
@@ -93,18 +127,81 @@ class ALTA():
         fans_pin: GPIO pin for switching fans on and off
         relay_1: GPIO pin for switching relay 1
         relay_2: GPIO pin for switching relay 2
+        ticker: Ticker setting the loop rate, one is made if None
+        buffered_log: Buffer the run data in RAM and write it to the SD card
+            between ticks, rather than printing and writing every sample
+        adaptive_melt: End each melt once the sample is clear and the block
+            is stable, rather than after the fixed MELT_TIME
+        model_approach: Back off full cooling when a model of the block
+            predicts it will reach the setpoint (see approach.py), rather
+            than at a fixed overshoot
+        settings: Dict from config.load, e.g. with tuned PI gains
+        link: TelemetryLink to send each sample to, e.g. over USB
+        journal: Append the repeats to journal.csv in the data directory
+            (journal.py), rather than writing a file for each
+        checkpoint: Checkpoint to save campaigns to, so resume_steps() can
+            carry them on after a reset (checkpoint.py)
+        profiler: Profiler to time the sections of each tick (profiler.py)
+        zero_alloc: Run the experiment loops without allocating: samples and
+            the LCD row are formatted in place (linebuf.py) from the integer
+            temperatures, the log is buffered, and the heap is collected
+            only at phase boundaries
         '''
         self.ptd = ptd # MAX31865 
         self.calibrate = calibrate # MAX31865
         self.pwm_channel = pwm_channel # Timer channel instance
         self.ldr_pin = ldr_pin # Analogue read instance
+        self.ldr = LdrDetector(ldr_pin, self.LDR_THRESHOLD) # Freeze detection
         self.lcd = lcd # pyb_lcd_i2c instance
+        self.zero_alloc = zero_alloc
+        self.screen = LcdScreen(lcd, self.LCD_REFRESH_MS, # Only sends changes
+                                whole_rows=zero_alloc)
         self.fans_pin = fans_pin # GPIO 
         self.relay_1 = relay_1 # GPIO
         self.relay_2 = relay_2 # GPIO
+        if ticker is None:
+            ticker = Ticker(self.DELAY_MS)
+        self.ticker = ticker # Fixed rate loop timing
+        if buffered_log or zero_alloc:
+            self.log = BufferedLog(ticker=ticker)
+        else:
+            self.log = DirectLog()
         
+        self.outcome = True # Result of the last repeat, see run()
+        self.adaptive_melt = adaptive_melt
+        self.melt_ms = 0 # Duration of the last melt
+        if settings is None:
+            settings = {}
+        self.pi_table = sorted(settings.get('pi', [])) # [T, K_c, tau_I]
+        self.pwm_table = settings.get('pwm') # Feed-forward PWM lookup
+        self.model_approach = model_approach
+        self.fopdt = Fopdt(**settings.get('fopdt', {})) # Block model
+        self.background_io = False # LCD and SD serviced by other tasks
+        self.telemetry = None # Queue for each sample, see runtime.py
+        self.link = link # Binary telemetry, see telemetry.py
+        self.use_journal = journal
+        self.journal = None # Journal of the current data directory
+        self.checkpoint = checkpoint
+        self.repeat = 0 # Repeat being run by campaign_steps
+        self.done = 0 # Repeats it has finished
+        self.paused = False # Set to wait between repeats
+        self.waiting = False # Waiting, as paused
+        self.schedule = None # Schedule of the adaptive campaign being run
+        if profiler is None:
+            profiler = Profiler(enabled=False)
+        self.profiler = profiler
+        self.T = None # Inputs from the last update_inputs()
+        self.T_calibrate = None
+        self.T_milli = None # The temperatures as ints (milli deg C)
+        self.T_calibrate_milli = None
+        self.ldr_value = None
+        self.line = LineBuffer() # Sample, formatted in place if zero_alloc
+        self.status_line = LineBuffer()
+        self.status_bytes = {} # Each status as bytes, for LineBuffer.text
+
         self.switch_off()
         self.screen_put("LET'S FREEZE") # Welcome message
+        self.screen.refresh(force=True)
 
     def switch_off(self):
         '''Turn off all outputs, switch relay to cooling'''
@@ -113,16 +210,146 @@ class ALTA():
         self.relay_cool() # Current direction to cool
 
     def screen_put(self, message='', row=0):
-        '''Display a message on the LCD screen'''
-        self.lcd.move_to(0, row)
-        self.lcd.putstr('{:^16}'.format(message)) # Always centred
+        '''
+        Display a message on the LCD screen, always centred. It is sent on the
+        next self.screen.refresh()
+        '''
+        self.screen.put(message, row)
+
+    def record(self, *args):
+        '''
+        Log a sample (t, T, calibrate, ldr[, status]), and send it as
+        telemetry if there is a queue or link
+        '''
+        profiler = self.profiler
+        start = profiler.start()
+        line = self.csvify(*args)
+        start = profiler.lap(CSVIFY, start)
+        self.log.write(line)
+        profiler.stop(LOG, start)
+        if self.telemetry is not None:
+            self.telemetry.put(line)
+        if self.link is not None:
+            self.link.sample(*args)
+
+    def record_sample(self, t, status=None):
+        '''
+        Record the inputs of the last update_inputs() at time t, as record(),
+        formatting them in place from the integer temperatures if zero_alloc
+        '''
+        T = self.T
+        calibrate = self.T_calibrate
+        ldr = self.ldr_value
+        if not self.zero_alloc:
+            if status is None:
+                self.record(t, T, calibrate, ldr)
+            else:
+                self.record(t, T, calibrate, ldr, status)
+            return
+        profiler = self.profiler
+        start = profiler.start()
+        line = self.line
+        line.clear()
+        line.int(t)
+        line.comma()
+        line.milli(self.T_milli)
+        line.comma()
+        line.milli(self.T_calibrate_milli)
+        line.comma()
+        line.int(ldr)
+        if status is not None:
+            line.comma()
+            line.text(self.status_text(status))
+        line.newline()
+        start = profiler.lap(CSVIFY, start)
+        self.log.write_from(line.buf, line.n)
+        profiler.stop(LOG, start)
+        if self.telemetry is not None:
+            self.telemetry.put_from(line.buf, line.n)
+        if self.link is not None:
+            self.link.sample(t, T, calibrate, ldr, status or '')
+
+    def status_text(self, status):
+        '''status as bytes, encoded once'''
+        text = self.status_bytes.get(status)
+        if text is None:
+            text = status.encode()
+            self.status_bytes[status] = text
+        return text
+
+    def show_status(self, status, t):
+        '''
+        Put the status, the temperature of the last update_inputs() and the
+        seconds into the repeat on the second row of the LCD, in place if
+        zero_alloc
+        '''
+        profiler = self.profiler
+        start = profiler.start()
+        if not self.zero_alloc:
+            self.screen_put('{} {:5.1f} {:5d}'.format(status, self.T,
+                                                      t//1000), # ms to s
+                            row=1)
+        else:
+            line = self.status_line
+            line.clear()
+            line.text(self.status_text(status))
+            line.byte(32)
+            line.milli(self.T_milli, 5)
+            line.byte(32)
+            line.int(t // 1000, 5)
+            self.screen.put_line(line, 1)
+        profiler.stop(SCREEN_PUT, start)
+
+    def collect(self):
+        '''
+        Collect the garbage now, at a phase boundary, with zero_alloc. The
+        loops then allocate nothing, so no collection falls inside a tick
+        '''
+        if self.zero_alloc:
+            start = self.profiler.start()
+            gc.collect()
+            self.profiler.stop(GC, start)
+
+    def service(self):
+        '''
+        Refresh the LCD and write buffered data to the SD card, after each
+        tick's work. Skipped if other tasks do this (see runtime.py)
+        '''
+        if not self.background_io:
+            profiler = self.profiler
+            start = profiler.start()
+            self.screen.refresh()
+            start = profiler.lap(LCD, start)
+            self.log.service()
+            profiler.stop(SD, start)
+            if self.link is not None:
+                self.link.service()
+            profiler.heap()
 
     def read_inputs(self):
         '''Read all ALTA inputs, return them as (temp, calibrate, ldr) tuple'''
-        temp = self.ptd.read()
-        calibrate = self.calibrate.read()
-        ldr = self.ldr_pin.read()
-        return temp, calibrate, ldr
+        self.update_inputs()
+        return self.T, self.T_calibrate, self.ldr_value
+
+    def update_inputs(self):
+        '''
+        Read all ALTA inputs into self.T, self.T_calibrate (deg C, to 0.1),
+        self.T_milli, self.T_calibrate_milli (milli deg C, as ints) and
+        self.ldr_value, without building a tuple
+        '''
+        profiler = self.profiler
+        start = profiler.start()
+        ptd = self.ptd
+        self.T_milli = ptd.read_milli()
+        start = profiler.lap(PTD, start)
+        calibrate = self.calibrate
+        self.T_calibrate_milli = calibrate.read_milli()
+        start = profiler.lap(CALIBRATE, start)
+        ldr = self.ldr.read() # Median of a burst of samples
+        profiler.stop(LDR, start)
+        self.T = ptd.temperature
+        self.T_calibrate = calibrate.temperature
+        self.ldr_value = ldr
 
     def relay_cool(self):
         '''Set current in cooling direction'''
@@ -145,11 +372,24 @@ class ALTA():
 
     def target_pwm(self, limit):
         '''
-        Uses an empirically calculated polynomial fit to find the approximate
-        PWM necessary to maintain the limit temperature
+        Approximate PWM necessary to maintain the limit temperature, from
+        the calibration table (see pwm_calibration.py) if there is one, or
+        else an empirically calculated polynomial fit
         '''
-        return sum([coeff * (limit**i)
-                    for i, coeff in enumerate(self.PWM_FIT_COEFFS)])
+        table = self.pwm_table
+        if table is None:
+            pwm = 0
+            for coeff in reversed(self.PWM_FIT_COEFFS): # Horner's method
+                pwm = pwm * limit + coeff
+            return pwm
+        pwms = table['pwm']
+        x = (limit - table['T0']) / table['step']
+        if x <= 0:
+            return pwms[0]
+        i = int(x)
+        if i >= len(pwms) - 1:
+            return pwms[-1]
+        return pwms[i] + (x - i) * (pwms[i + 1] - pwms[i])
 
     def overshoot(self, limit):
         '''
@@ -176,43 +416,219 @@ class ALTA():
         else:
             self.fans_pin.high()
 
-    def timer(self):
-        '''Yields time in ms since timer was started'''
-        start = millis()
+    def pi_gains(self, limit):
+        '''
+        (K_c, tau_I) for a target temperature, interpolated between the
+        tuned gains in pi_table, or K_C and TAU_I if there are none
+        '''
+        if not self.pi_table:
+            return self.K_C, self.TAU_I
+        return self.interpolate_gain(limit, 1), self.interpolate_gain(limit, 2)
+
+    def set_gains(self, pid, limit):
+        '''Set the gains of pid for limit, as pi_gains without a tuple'''
+        if not self.pi_table:
+            pid.K_c = self.K_C
+            pid.tau_I = self.TAU_I
+        else:
+            pid.K_c = self.interpolate_gain(limit, 1)
+            pid.tau_I = self.interpolate_gain(limit, 2)
+
+    def interpolate_gain(self, limit, column):
+        '''Column 1 (K_c) or 2 (tau_I) of pi_table, interpolated at limit'''
+        table = self.pi_table
+        if limit <= table[0][0]:
+            return table[0][column]
+        for i in range(1, len(table)):
+            if limit <= table[i][0]:
+                T0 = table[i - 1][0]
+                x = (limit - T0) / (table[i][0] - T0)
+                return table[i - 1][column] + x * (table[i][column] -
+                                                   table[i - 1][column])
+        return table[-1][column]
+
+    def timer(self, start_ms=0):
+        '''
+        Yields time in ms since timer was started, plus start_ms. Counted in
+        ticks, so it is exact and safe over roll-overs
+        '''
+        start = self.ticker.count
         while True:
-            yield millis() - start # Not protected against roll-overs
+            yield start_ms + (self.ticker.count - start) * self.ticker.period_ms
 
     def csvify(self, *args):
         '''Convert all args to a string delimited by commas'''
         return ','.join([str(arg) for arg in args])+'\n'
 
+    def reached_setpoint(self, T, limit, overshoot=0):
+        '''
+        True when the full power approach should end: once the block model
+        predicts limit, or the block is overshoot past it
+        '''
+        if self.model_approach:
+            return self.fopdt.should_switch(T, limit)
+        return T < limit - overshoot
+
+    def log_approach(self, filepath, repeat, metrics):
+        '''Fit the block model and append the approach to approach.csv'''
+        fitted = self.fopdt.fit() # Even if not in use, to be ready
+        with open(filepath + '/approach.csv', 'a') as f:
+            f.write(self.csvify(repeat,
+                                metrics.reached_at,
+                                round(metrics.overshoot, 2),
+                                'model' if self.model_approach else 'fixed',
+                                round(self.fopdt.tau, 1) if fitted else '',
+                                round(self.fopdt.dead, 2) if fitted else '',
+                                round(self.fopdt.T_inf, 1) if fitted else ''))
+
     def get_repeat_number(self, filepath):
         '''Find the number of the most recent repeat in the filepath'''
-        files = [f for f in os.listdir(filepath) if 'running' not in f]
+        if self.use_journal:
+            return self.open_journal(filepath).last_repeat()
+        files = [f for f in os.listdir(filepath)
+                 if 'running' not in f and f.split('_')[0].isdigit()]
         if files == []:
             return 0
         return max([int(file.split('_')[0]) for file in files])
 
-    def melt(self, timer):
+    def open_journal(self, filepath):
+        '''The Journal of filepath, kept while the directory is in use'''
+        if self.journal is None or self.journal.filepath != filepath:
+            self.journal = Journal(filepath)
+        return self.journal
+
+    def repeat_file(self, filepath, repeat, mode, setpoint, resume=None):
+        '''
+        Open the file for a repeat's samples: running.csv or the journal.
+        With resume, to carry on writing a repeat cut short by a reset
+        '''
+        if resume is not None:
+            path = self.repeat_path(filepath)
+            self.end_line(path)
+            if self.use_journal:
+                self.open_journal(filepath).start = resume['offset']
+            return open(path, self.log.MODE.replace('w', 'a'))
+        if self.use_journal:
+            return self.open_journal(filepath).begin(repeat, mode, setpoint,
+                                                     self.log.MODE)
+        return open(filepath + '/running.csv', self.log.MODE)
+
+    def repeat_path(self, filepath):
+        '''Path of the file the running repeat is written to'''
+        if self.use_journal:
+            return self.open_journal(filepath).path
+        return filepath + '/running.csv'
+
+    def end_line(self, path):
+        '''
+        Drop a line cut short by a reset from the end of path, returns the
+        time of the last sample before it, None if there is none
+        '''
+        try:
+            size = os.stat(path)[6]
+        except OSError:
+            return None
+        with open(path, 'rb') as f:
+            f.seek(max(0, size - 256))
+            tail = f.read()
+        cut = len(tail) - 1 - tail.rfind(b'\n') # Bytes after the last line
+        if cut and not self.use_journal:
+            with open(path, 'rb') as f: # No truncate on FAT, copy the rest
+                data = f.read(size - cut)
+            with open(path, 'wb') as f:
+                f.write(data)
+        elif cut:
+            with open(path, 'ab') as f: # Left as a line of its own
+                f.write(b'\n')
+        lines = tail[:len(tail) - cut].split(b'\n')
+        if len(lines) < 2 or not lines[-2][:1].isdigit():
+            return None
+        return int(lines[-2].split(b',')[0])
+
+    def save_checkpoint(self, repeat, phase, t, T, integral=0, hold_ms=None,
+                        segment=0):
+        '''Save the campaign's state, if it is being checkpointed'''
+        if self.checkpoint is None:
+            return
+        offset = self.journal.start if self.use_journal and self.journal \
+                 else None
+        self.checkpoint.save(repeat, phase, t, T, integral, hold_ms, offset,
+                             segment)
+
+    def end_repeat(self, filepath, repeat, mode, setpoint, outcome, value):
+        '''
+        Record the outcome of a repeat: rename running.csv to hold it, or
+        write the journal footer. outcome 'error' discards the repeat
+        '''
+        if self.link is not None and outcome != 'error':
+            self.link.end(repeat, outcome, value)
+        if self.use_journal:
+            self.open_journal(filepath).end(repeat, outcome, value)
+            return
+        if outcome == 'error':
+            os.remove(filepath + '/running.csv')
+            return
+        filename = '/{}_{}{}_{}_{}.csv'.format(repeat, mode, setpoint,
+                                               outcome, value)
+        print(filename)
+        os.rename(filepath+'/running.csv', filepath+filename)
+
+    def run(self, steps):
+        '''
+        Run the steps of a repeat (e.g. isothermal_steps) at the loop rate.
+        Returns self.outcome, True if ready for the next repeat
+        '''
+        self.ticker.reset()
+        for _ in steps:
+            self.ticker.wait()
+        print(self.ticker.summary()) # Loop timing for this repeat
+        print(self.log.summary())
+        return self.outcome
+
+    def melt_steps(self, timer, filepath=None, repeat=0):
         '''
         Heat the sample to a target temperature, then hold at that temp
-        for a specified amount of time.
+        for a specified amount of time. Yields once per tick.
+        With adaptive_melt it ends as soon as the sample is clear again and
+        the block is stable, if the LDR has a baseline measured on the liquid
+        sample: after a reset it has none, and the melt takes MELT_TIME. The
+        duration is appended to filepath/melt.csv
         '''
         status = 'Heat'
         self.relay_heat()
         self.set_pwm(100)
+        self.collect()
 
         t = next(timer)
+        melt_start = t
         wait_end = t + self.MELT_TIME
         heat_flag = True
+        stable_since = None # Time the sample was first clear and stable
+        reason = 'fixed'
+        adaptive = self.adaptive_melt and self.ldr.calibrated()
+        profiler = self.profiler
         while t < wait_end:
             t = next(timer)
-            T, _, _ = self.read_inputs()
+            tick_start = profiler.start()
+            self.update_inputs()
+            T = self.T
 
-            self.screen_put('{} {:5.1f} {:5d}'.format(status,
-                                                      T,
-                                                      t//1000), # ms to s
-                            row=1)
+            if adaptive:
+                if (not heat_flag and self.ldr.clear()
+                        and T > self.MELT_STABLE_TEMPERATURE):
+                    if stable_since is None:
+                        stable_since = t
+                    elif t - stable_since >= self.MELT_STABLE_TIME:
+                        reason = 'clear'
+                        break
+                else:
+                    stable_since = None
+                if t - melt_start >= self.MELT_MAX_TIME:
+                    reason = 'cap'
+                    break
+                wait_end = t + self.DELAY_MS # Wait for the sample instead
+
+            self.show_status(status, t)
 
             if T < self.MELT_TEMPERATURE and heat_flag:
                 wait_end += self.DELAY_MS
@@ -221,86 +637,365 @@ class ALTA():
                 status = 'Wait'
                 self.set_pwm(0)
                 self.relay_cool() # safer to keep in this configuration
-            
-            time.sleep_ms(self.DELAY_MS)
+
+            self.service()
+            profiler.stop(MELT, tick_start)
+            yield
+
+        self.set_pwm(0)
+        self.relay_cool()
+        self.melt_ms = t - melt_start
+        print('melt {} ms ({})'.format(self.melt_ms, reason))
+        if filepath is not None:
+            with open(filepath + '/melt.csv', 'a') as f:
+                f.write(self.csvify(repeat, self.melt_ms, reason))
+            self.profiler.save(filepath, repeat)
         
 
     def isothermal(self, filepath, limit, repeat=0):
         '''
         Cool to the temperature denoted by limit as quickly as possible,
-        then hold at that temperature.
+        then hold at that temperature. Returns False if something went wrong
         '''
-        self.screen_put('Isothermal {}'.format(repeat))
+        return self.run(self.isothermal_steps(filepath, limit, repeat))
 
-        timer = self.timer()
-        offset = self.target_pwm(limit)
-        overshoot = self.overshoot(limit)
+    def isothermal_steps(self, filepath, limit, repeat=0, resume=None):
+        '''
+        Generator for one isothermal repeat, yielding once per tick. Sets
+        self.outcome when done. resume: checkpoint of a repeat cut short by
+        a reset, to carry on from (see resume_steps)
+        '''
+        return self.profile_steps(filepath, self.isothermal_profile(limit),
+                                  repeat, resume)
 
-        pid = PI_Controller(self.K_C, self.TAU_I, self.DELAY_S, limit, offset)
+    def isothermal_profile(self, limit):
+        '''
+        Profile of an isothermal repeat: cool to limit as quickly as
+        possible, then hold there until the sample freezes, or MAXIMUM_WAIT
+        from the start
+        '''
+        return Profile([cool(limit, self.overshoot(limit)), wait_for_freeze(),
+                        hold(limit, self.MAXIMUM_WAIT), melt()],
+                       'isothermal', limit, 'Isothermal', result='t',
+                       delay_ms=self.DELAY_MS)
 
-        hold_flag = False
-        frozen_flag = False
-        status = 'Cool' # cool, hold or heat
+    def profile_steps(self, filepath, profile, repeat=0, resume=None):
+        '''
+        Generator for one repeat of profile (profiles.py), yielding once per
+        tick, the control loop of every experiment. Sets self.outcome when
+        done. resume: checkpoint of a repeat cut short by a reset, to carry
+        on from (see resume_steps). Closed mid repeat, it writes what it has
+        and ends the repeat as 'error'
+        '''
+        self.screen_put('{} {}'.format(profile.title, repeat))
+        if self.link is not None:
+            self.link.start(repeat, profile.mode, profile.setpoint)
+        profiler = self.profiler
+        profiler.reset()
+
+        rows = profile.rows
+        delay = profile.delay_ms
+        t = 0 if resume is None else resume['t'] # Time (ms)
+        timer = self.timer(t)
+        pid = PI_Controller(self.K_C, self.TAU_I, self.DELAY_S, 0) # See enter
+        hold_start = None # When the first cool ended
+        frozen = False
+        abandoned = False
 
+        i = 0 # Row of the profile being run
+        if resume is not None:
+            i = resume.get('segment', 0 if resume['phase'] == 'cool' else 1)
         self.relay_cool()
-        self.set_pwm(100) # Full power
-        
-        with open(filepath + '/running.csv', 'w') as f:
-            t = 0 # Time (ms)
-            T, calibrate, ldr = self.read_inputs() # Temperature, temperature, light dependent resistor
-            clear_intensity = ldr
+        row = self.enter(profile, i, pid)
+        kind = row[0]
+        status = row[5]
+        if kind != COOL: # Starting, or carrying on, under control
+            if resume is not None:
+                hold_start = resume['hold_ms']
+                pid.I = resume['integral']
+            self.set_pwm(pid.offset)
+
+        with self.repeat_file(filepath, repeat, profile.mode,
+                              profile.file_setpoint, resume) as f:
+            self.log.attach(f)
+            self.ldr.reset() # Start measuring the clear baseline
+            self.update_inputs()
+            T = self.T
+            self.fopdt.start(t, T)
+            approach = ApproachMetrics()
+            self.collect() # Before cooling
 
-            while t < self.MAXIMUM_WAIT and not frozen_flag:
+            while True:
+                while kind != COOL and t // delay >= row[2]: # Row is over
+                    i += 1
+                    if i == len(rows):
+                        break
+                    row = self.enter(profile, i, pid)
+                    kind = row[0]
+                    status = row[5]
+                if i == len(rows) or t // delay >= profile.end:
+                    break # The program has run out
                 t = next(timer)
-                T, ambient, ldr = self.read_inputs()
+                tick_start = profiler.start()
+                self.update_inputs()
+                T = self.T
 
-                self.screen_put('{} {:5.1f} {:5d}'.format(status,
-                                                          T,
-                                                          t//1000), # ms to s
-                                row=1)
+                self.show_status(status, t)
 
-                data = self.csvify(t, T, ambient, ldr, status)
-                print(data, end='')
-                _ = f.write(data)
+                self.record_sample(t, status)
 
-                if ldr < clear_intensity - self.LDR_THRESHOLD:
-                    frozen_flag = True
-                    status = 'Froz'
+                if self.ldr.frozen:
+                    frozen = True
+                    t += self.ldr.onset_ms # Freeze instant, within the tick
                     break # Sample is frozen
-                
-                if not hold_flag: # Haven't reached target temperature yet
-                    if T < limit - overshoot:
-                        status = 'Hold'
-                        hold_start = t
-                        hold_flag = True
+
+                if kind == COOL:
+                    approach.update(t, T, row[3])
+                    if hold_start is None: # Fit the block to the first cool
+                        self.fopdt.add(t, T)
+                    if self.reached_setpoint(T, row[3], row[6]):
+                        if hold_start is None:
+                            hold_start = t
+                        i += 1
+                        if i == len(rows):
+                            break
+                        row = self.enter(profile, i, pid)
+                        kind = row[0]
+                        status = row[5]
+                        if kind != COOL and self.model_approach:
+                            self.set_pwm(pid.offset) # Lands the block there
+                        self.log.flush()
+                        self.save_checkpoint(repeat, 'cool' if kind == COOL
+                                             else 'hold', t, T, pid.I,
+                                             hold_start, i)
                 else:
+                    if kind == RAMP:
+                        setpoint = row[3] + row[4] * (t // delay - row[1])
+                        pid.limit = setpoint
+                        if self.pi_table:
+                            self.set_gains(pid, setpoint)
+                    approach.update(t, T, pid.limit)
+                    start = profiler.start()
                     pwm = pid.proportion(T)
+                    profiler.stop(PI, start)
                     self.set_pwm(pwm)
-                    
-                time.sleep_ms(self.DELAY_MS)# Sleep is bad but can't see an alternative
-            else:
-                status = 'Warm'
+                if self.checkpoint is not None and self.checkpoint.due(t):
+                    self.save_checkpoint(repeat, 'cool' if kind == COOL else
+                                         'hold', t, T, pid.I, hold_start, i)
+
+                self.service()
+                profiler.stop(TICK, tick_start)
+                try:
+                    yield
+                except GeneratorExit: # Closed, e.g. stopped from the host
+                    abandoned = True
+                    break
+            self.log.flush()
+
+        if abandoned: # Marked as gone wrong, rather than left unfinished
+            self.set_pwm(0)
+            self.end_repeat(filepath, repeat, profile.mode,
+                            profile.file_setpoint, 'error', 'closed')
+            return
 
         self.set_pwm(0)
-        
-        filename = '/{}_isothermal{}_'.format(repeat, limit) # base filename
+        self.collect() # After the freeze
+        self.log_approach(filepath, repeat, approach)
+        mode, setpoint = profile.mode, profile.file_setpoint
+
         if T > 0:
             #  LED has faded meaning false freezes are detected
-            os.remove(filepath+'running.csv')
-            return False # Gone wrong
-        if not hold_flag: #  Sample froze before reaching hold temperature
-            filename += 'early_{}'.format(T)
-        elif not frozen_flag: # Sample did not freeze within the max wait time
-            filename += 'liquid_{}'.format(t)
+            self.end_repeat(filepath, repeat, mode, setpoint, 'error', T)
+            profiler.save(filepath, repeat)
+            self.outcome = False # Gone wrong
+            return
+        if i < profile.watch: #  Sample froze before it was being watched
+            outcome, value = 'early', T
+        elif not frozen: # Sample did not freeze within the program
+            outcome, value = 'liquid', t
+        elif profile.result == 't':
+            outcome, value = 'frozen', int(t)
         else:
-            filename += 'frozen_{}'.format(t)
-                                         
-        filename += '.csv'
-        print(filename)
-        os.rename(filepath+'/running.csv', filepath+filename)
+            outcome, value = 'frozen', T
+        self.end_repeat(filepath, repeat, mode, setpoint, outcome, value)
+        if self.schedule is not None: # Counted before the checkpoint
+            self.schedule.record(outcome, value, hold_start)
+        self.save_checkpoint(repeat, 'melt', t, T)
+
+        if profile.melt:
+            yield from self.melt_steps(timer, filepath, repeat)
+        else:
+            profiler.save(filepath, repeat)
+        self.outcome = True # Ready for the next repeat
+
+    def enter(self, profile, i, pid):
+        '''
+        Start row i of profile, returns it: full power for a cool, or the
+        setpoint, feed-forward PWM and gains of pid for a hold or ramp
+        '''
+        row = profile.rows[i]
+        if row[0] == COOL:
+            self.set_pwm(100) # Full power
+        else:
+            T = row[3]
+            pid.limit = T
+            pid.offset = self.target_pwm(T)
+            self.set_gains(pid, T)
+        return row
+
+    def make_profile(self, mode, setpoint):
+        '''
+        Profile of a campaign: 'isothermal' at setpoint (deg C), 'linear' at
+        setpoint (deg C/min), 'profile' with setpoint its segments, or
+        'adaptive' with setpoint its plan (schedule.py), isothermal at the
+        setpoint being run
+        '''
+        if mode == 'isothermal':
+            return self.isothermal_profile(setpoint)
+        if mode == 'adaptive':
+            return self.isothermal_profile(Schedule(setpoint).setpoint())
+        if mode == 'linear':
+            return self.linear_profile(setpoint)
+        return Profile(setpoint, delay_ms=self.DELAY_MS)
+
+    def campaign_steps(self, mode, filepath, setpoint, last=None):
+        '''
+        Generator running repeats of mode ('isothermal', 'linear', 'profile'
+        or 'adaptive', see make_profile) until one goes wrong, or repeat
+        number last is done. An adaptive campaign also ends when its schedule
+        is finished. Waits between repeats while self.paused. Checkpointed,
+        if ALTA has a Checkpoint, until it ends or is closed
+        '''
+        if mode == 'adaptive':
+            self.schedule = Schedule(setpoint)
+            profile = None # Chosen for each repeat
+        else:
+            self.schedule = None
+            profile = self.make_profile(mode, setpoint) # Compiled once
+        self.repeat = self.get_repeat_number(filepath)
+        self.done = 0
+        self.outcome = True
+        if self.checkpoint is not None:
+            self.checkpoint.start(mode, setpoint, filepath, last)
+        try:
+            while self.outcome and (last is None or self.repeat < last):
+                if self.paused:
+                    self.switch_off()
+                    self.screen_put('Paused', 1)
+                while self.paused:
+                    self.waiting = True
+                    self.service()
+                    yield
+                self.waiting = False
+                if self.schedule is not None:
+                    if self.schedule_repeat(filepath) is None:
+                        break # Every setpoint is done
+                    profile = self.make_profile(mode, setpoint)
+                self.repeat += 1
+                yield from self.profile_steps(filepath, profile, self.repeat)
+                self.done += 1
+        finally:
+            self.waiting = False
+            self.schedule = None
+            if self.checkpoint is not None:
+                self.checkpoint.clear()
+
+    def schedule_repeat(self, filepath):
+        '''
+        Choose the setpoint of the next repeat of an adaptive campaign, and
+        append the decision to schedule.csv. None when the campaign is done
+        '''
+        schedule = self.schedule
+        limit = schedule.choose()
+        with open(filepath + '/schedule.csv', 'a') as f:
+            if limit is None:
+                f.write(self.csvify(self.repeat, 'done'))
+            else:
+                f.write(self.csvify(self.repeat + 1, *schedule.decision(
+                    schedule.plan['current'])))
+        if limit is None:
+            print(schedule.summary())
+            self.screen_put('Campaign done', 1)
+        return limit
+
+    def resume_steps(self):
+        '''
+        Generator carrying on the campaign in the checkpoint after a reset,
+        None if there isn't one. See checkpoint.py
+        '''
+        if self.checkpoint is None:
+            return None
+        state = self.checkpoint.load()
+        if not state:
+            return None
+        return self.recover_steps(state)
 
-        self.melt(timer, status)
-        return True # Ready for the next isothermal experiment
+    def recover_steps(self, state):
+        '''
+        Carry on the repeat cut short in state, or discard it and melt the
+        sample, then the rest of the campaign
+        '''
+        mode, setpoint = state['mode'], state['setpoint']
+        filepath, repeat = state['filepath'], state['repeat']
+        checkpoint = self.checkpoint
+        checkpoint.start(mode, setpoint, filepath, state['last'])
+        self.repeat = repeat
+        self.schedule = Schedule(setpoint) if mode == 'adaptive' else None
+        down_s = checkpoint.down_s(state)
+        T = self.ptd.read()
+        lost = 0 # Samples
+        if state['phase'] == 'melt': # Repeat recorded, melt again
+            action = 'melt'
+        else:
+            last_t = self.end_line(self.repeat_path(filepath))
+            if last_t is None:
+                last_t = -self.DELAY_MS
+            if checkpoint.can_resume(state, T):
+                action = 'resume'
+                state['t'] += down_s * 1000 # Keep the repeat's time true
+                lost = max(0, (state['t'] - last_t) // self.DELAY_MS - 1)
+            else:
+                action = 'discard'
+                lost = last_t // self.DELAY_MS + 1
+                if self.use_journal:
+                    self.open_journal(filepath).start = state['offset']
+                self.end_repeat(filepath, repeat, mode, setpoint, 'error',
+                                'reset')
+        print('recovered repeat {} ({}) down {} s: {}, {} samples lost'.format(
+            repeat, state['phase'], 'unknown' if down_s is None else down_s,
+            action, lost))
+        with open(filepath + '/recovery.csv', 'a') as f:
+            f.write(self.csvify(repeat, state['phase'],
+                                '' if down_s is None else down_s, action,
+                                lost))
+
+        self.outcome = True
+        if action == 'resume':
+            yield from self.profile_steps(filepath,
+                                          self.make_profile(mode, setpoint),
+                                          repeat, state)
+        else:
+            self.screen_put('Recovering {}'.format(repeat))
+            yield from self.melt_steps(self.timer()) # Sample may be frozen
+        if self.outcome:
+            yield from self.campaign_steps(mode, filepath, setpoint,
+                                           state['last'])
+        else:
+            self.schedule = None
+            checkpoint.clear()
+
+    def isothermal_campaign(self, filepath, limit, last=None):
+        '''Generator running isothermal repeats until one goes wrong'''
+        return self.campaign_steps('isothermal', filepath, limit, last)
+
+    def adaptive_campaign(self, filepath, setpoints, target=0.5, last=None):
+        '''
+        Generator running isothermal repeats over setpoints (deg C), each
+        chosen by a Schedule, until the nucleation rate at every setpoint is
+        known to within target (schedule.py)
+        '''
+        return self.campaign_steps('adaptive', filepath,
+                                   new_plan(setpoints, target), last)
 
     def isothermal_experiment(self, filepath, limit):
         repeat = self.get_repeat_number(filepath)
@@ -312,69 +1007,35 @@ class ALTA():
             
     
     def linear_cool(self, filepath, rate=-1, repeat=0):
-        def target_temp(t):
-            # Y = mx + c
-            return rate * t + fast_cool
-        self.screen_put('Linear Cool {}'.format(repeat))
-        rate /= 1000 * 60 #  degC/ms
-        T, _, ldr = self.read_inputs()
-
-        clear_intensity = ldr
-
-        fast_cool = 0 #  Fast cool to this temperature
-        offset = self.target_pwm(fast_cool) # PWM for 0 degrees
-
-        timer = self.timer()
-        t = 0
-        pid = PI_Controller(self.K_C, self.TAU_I, self.DELAY_S, fast_cool, offset)
-
-        fast_cool_flag = False
-        status = 'Fast'
-        self.set_pwm(100) # Full power
-        with open(filepath+'/running.csv', 'w') as f:
-            while T > -25:
-                t = next(timer)
-                T, T_inner, ldr = self.read_inputs()
-                if fast_cool_flag:
-                    target_T = target_temp(t)
-                    pid.limit = target_T
-                    pwm = pid.proportion(T)
-                    self.set_pwm(pwm)
-                else:
-                    if T < fast_cool:
-                        status = 'Cool'
-                        fast_cool_flag = True
-                self.screen_put('{} {:5d} {:5.1f}'.format(status,
-                                                          t//1000,
-                                                          T), 1)
-
-                if ldr < clear_intensity - self.LDR_THRESHOLD:
-                    status = 'Froz'
-                    break
-                    
-                data = self.csvify(t, T, T_inner, ldr)
-                _ = f.write(data)
-                print(data, end='')
+        '''
+        Cool to 0 deg C as quickly as possible, then cool at rate deg C/min
+        until the sample freezes. Returns False if something went wrong
+        '''
+        return self.run(self.linear_steps(filepath, rate, repeat))
 
-                time.sleep_ms(200)
-                
-        self.set_pwm(0)
+    def linear_steps(self, filepath, rate=-1, repeat=0, resume=None):
+        '''
+        Generator for one linear cooling repeat, yielding once per tick. Sets
+        self.outcome when done. resume: checkpoint of a repeat cut short by
+        a reset, to carry on from (see resume_steps)
+        '''
+        return self.profile_steps(filepath, self.linear_profile(rate), repeat,
+                                  resume)
 
-        filename = '/{}_linear{}_'.format(repeat, rate) # base filename
-        if T > 0:
-            #  LED has faded meaning false freezes are detected
-            return False # Gone wrong
-        if status != 'Froz': # Sample did not freeze within the ramp
-            filename += 'liquid_{}'.format(t)
-        else:
-            filename += 'frozen_{}'.format(T)
-                                         
-        filename += '.csv'
-        print(filename)
-        os.rename(filepath+'/running.csv', filepath+filename)
+    def linear_profile(self, rate=-1):
+        '''
+        Profile of a linear repeat: cool to 0 deg C as quickly as possible,
+        then at rate deg C/min from 0 deg C at the start, until RAMP_END
+        '''
+        return Profile([cool(0, status='Fast'),
+                        ramp(rate, self.RAMP_END, status='Cool'), melt()],
+                       'linear', rate, 'Linear Cool',
+                       file_setpoint=rate / (1000 * 60), # deg C/ms
+                       delay_ms=self.DELAY_MS)
 
-        self.melt(timer, status)
-        return True # Ready for the next isothermal experiment
+    def linear_campaign(self, filepath, rate=-1, last=None):
+        '''Generator running linear repeats until one goes wrong'''
+        return self.campaign_steps('linear', filepath, rate, last)
 
     def linear_experiment(self, filepath, rate=-1):
         '''Repeatedly linearly cool/thaw at rate degrees/min'''
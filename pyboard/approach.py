@@ -0,0 +1,144 @@
+'''
+Model based approach to the setpoint at full cooling power.
+
+The block is modelled as first order plus dead time (FOPDT) at full power:
+after a dead time it relaxes exponentially, with time constant tau, towards
+T_inf, the temperature full power would eventually reach. Whatever ALTA does
+now only shows after the dead time, so the time optimal approach is full
+power until the temperature predicted one dead time ahead reaches the
+setpoint:
+    T_inf + (T - T_inf) exp(-dead / tau) <= limit
+then the feed-forward PWM for the setpoint (ALTA.target_pwm), which holds the
+block where it lands, with PI correcting what is left.
+
+The model is identified during every approach. The full power cooling curve is
+fitted with a least squares line dT/dt = (T_inf - T) / tau, and the dead time
+is the delay before the block starts falling, less what the first order curve
+accounts for. Each fit is blended into the model, so it follows changes in
+the rig, and ALTA(settings=...) can start from saved values:
+
+    {"fopdt": {"tau": 42.0, "dead": 1.0, "T_inf": -32.0}}
+'''
+
+import math
+
+
+class Fopdt():
+    TAU = 45.0 # (s) Defaults, until the first approach has been fitted
+    DEAD = 1.0 # (s)
+    T_INF = -30.0 # (deg C)
+    BLEND = 0.3 # Weight of each new fit
+    DIFF_TICKS = 5 # Readings spanned by each dT/dt estimate
+    DEAD_BAND = 0.3 # (deg C) Drop which shows the block has started cooling
+    MIN_SPAN = 2.0 # (deg C) Range of T needed for a fit
+
+    def __init__(self, tau=TAU, dead=DEAD, T_inf=T_INF):
+        self.tau = tau
+        self.dead = dead
+        self.T_inf = T_inf
+        self.fits = 0
+        # Ring of the last DIFF_TICKS readings, reused so add doesn't allocate
+        self.recent_t = [0] * self.DIFF_TICKS
+        self.recent_T = [0.0] * self.DIFF_TICKS
+        self.update_decay()
+        self.start(0, 0)
+
+    def update_decay(self):
+        self.decay = math.exp(-self.dead / self.tau)
+
+    def settings(self):
+        '''Model for the config file'''
+        return {'tau': self.tau, 'dead': self.dead, 'T_inf': self.T_inf}
+
+    def predict(self, T):
+        '''Temperature one dead time from now, if full power continues'''
+        return self.T_inf + (T - self.T_inf) * self.decay
+
+    def should_switch(self, T, limit):
+        '''True once full power would carry the block to limit'''
+        return self.predict(T) <= limit
+
+    def start(self, t, T):
+        '''Full power cooling started at t (ms) from temperature T'''
+        self.t0 = t
+        self.T0 = T
+        self.moving_at = None # Time the block was seen to start falling
+        self.readings = 0 # Put in the ring since then
+        self.n = 0
+        self.sum_T = self.sum_D = self.sum_TT = self.sum_TD = 0.0
+        self.low = self.high = T
+
+    def add(self, t, T):
+        '''A reading at full power'''
+        if self.moving_at is None:
+            if T > self.T0 - self.DEAD_BAND:
+                return
+            self.moving_at = t
+        i = self.readings % self.DIFF_TICKS
+        t_a = self.recent_t[i] # Reading DIFF_TICKS ago, once there is one
+        T_a = self.recent_T[i]
+        self.recent_t[i] = t
+        self.recent_T[i] = T
+        self.readings += 1
+        if self.readings <= self.DIFF_TICKS:
+            return
+        D = (T - T_a) / ((t - t_a) / 1000) # (deg C/s)
+        T_mid = (T + T_a) / 2
+        self.n += 1
+        self.sum_T += T_mid
+        self.sum_D += D
+        self.sum_TT += T_mid * T_mid
+        self.sum_TD += T_mid * D
+        self.low = min(self.low, T)
+        self.high = max(self.high, T)
+
+    def fit(self):
+        '''
+        Fit this approach and blend it into the model. Returns True if the
+        approach gave a usable fit
+        '''
+        n = self.n
+        if n < 2 * self.DIFF_TICKS or self.high - self.low < self.MIN_SPAN:
+            return False
+        var = self.sum_TT - self.sum_T * self.sum_T / n
+        cov = self.sum_TD - self.sum_T * self.sum_D / n
+        if var <= 0:
+            return False
+        slope = cov / var # -1/tau
+        intercept = (self.sum_D - slope * self.sum_T) / n # T_inf/tau
+        if slope >= 0:
+            return False
+        tau = -1 / slope
+        T_inf = -intercept / slope
+        if not 1 < tau < 10000 or T_inf >= self.T0:
+            return False
+        # Delay to the first DEAD_BAND of drop, less the first order's share
+        fraction = self.DEAD_BAND / (self.T0 - T_inf)
+        first_order = -tau * math.log(1 - fraction) if fraction < 1 else 0
+        dead = max(0, (self.moving_at - self.t0) / 1000 - first_order)
+
+        w = self.BLEND if self.fits else 1 # The first fit replaces defaults
+        self.tau += w * (tau - self.tau)
+        self.T_inf += w * (T_inf - self.T_inf)
+        self.dead += w * (dead - self.dead)
+        self.fits += 1
+        self.update_decay()
+        return True
+
+
+class ApproachMetrics():
+    '''Time to reach the setpoint, and the overshoot past it, of a repeat'''
+    BAND = 0.2 # (deg C) Reached once within this of the setpoint
+    WINDOW = 1000 * 60 # (ms) Overshoot measured over this after reaching it
+
+    def __init__(self):
+        self.reached_at = None
+        self.overshoot = 0
+
+    def update(self, t, T, target):
+        '''Reading T at t (ms) while cooling towards target'''
+        if self.reached_at is None:
+            if T <= target + self.BAND:
+                self.reached_at = t
+        elif t - self.reached_at <= self.WINDOW:
+            self.overshoot = max(self.overshoot, target - T)
@@ -0,0 +1,210 @@
+'''
+PI gains for ALTA from a relay feedback experiment (Astrom-Hagglund).
+
+At each target temperature the block is cooled to the target, then the PWM
+is switched between offset + d and offset - d whenever the temperature
+crosses target -/+ HYSTERESIS. The block settles into an oscillation whose
+period Pu and amplitude a give the ultimate gain of the loop,
+    Ku = 4 d / (pi sqrt(a^2 - HYSTERESIS^2))
+from which the Tyreus-Luyben rules give PI gains with little overshoot:
+    K_c = -Ku / 3.2 (negative, as more PWM cools), tau_I = 2.2 Pu
+
+Before and after, a step test runs the isothermal approach (full cooling from
+MELT_TEMPERATURE, then PI) and reports the overshoot and settling time. The
+gains are saved to the config file, where ALTA(settings=...) loads them:
+
+    tuner = Autotune(alta)
+    tuner.tune((-10, -15, -20), 'alta.json')
+'''
+
+import math
+
+import config
+from pi_controller import PI_Controller
+
+
+class StepMetrics():
+    '''Overshoot and settling time of the hold after an isothermal approach'''
+    BAND = 0.2 # (deg C) Settled once within this of the target
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.hold_start = None
+        self.lowest = None
+        self.settled_at = None # Last time outside the band
+
+    def update(self, t, T):
+        if self.hold_start is None:
+            return
+        if self.lowest is None or T < self.lowest:
+            self.lowest = T
+        if abs(T - self.limit) > self.BAND:
+            self.settled_at = t
+
+    def overshoot(self):
+        '''How far the block went below the target (deg C)'''
+        if self.lowest is None:
+            return None
+        return max(0, self.limit - self.lowest)
+
+    def settling_ms(self):
+        '''Time from the start of the hold to staying within BAND'''
+        if self.hold_start is None:
+            return None
+        if self.settled_at is None:
+            return 0
+        return self.settled_at - self.hold_start
+
+    def summary(self):
+        if self.hold_start is None:
+            return 'did not reach the hold'
+        return 'overshoot {:.1f} deg C settling {:.1f} s'.format(
+            self.overshoot(), self.settling_ms() / 1000)
+
+
+class Autotune():
+    RELAY_AMPLITUDE = 20 # (%) PWM either side of the offset
+    HYSTERESIS = 0.1 # (deg C) Noise band around the target
+    CYCLES = 4 # Oscillations measured, after the first is discarded
+    RELAY_MAX_TIME = 1000 * 60 * 20 # (ms) Give up on a target after this
+    STEP_TIME = 1000 * 60 * 4 # (ms) Length of each step test
+
+    def __init__(self, alta):
+        self.alta = alta
+        self.results = [] # (T, K_c, tau_I, before, after) for each target
+
+    def heat_steps(self, timer):
+        '''Heat the block to MELT_TEMPERATURE, the start of every repeat'''
+        alta = self.alta
+        alta.relay_heat()
+        alta.set_pwm(100)
+        while alta.ptd.read() < alta.MELT_TEMPERATURE:
+            next(timer)
+            yield
+        alta.set_pwm(0)
+        alta.relay_cool()
+
+    def step_test_steps(self, limit, gains, metrics):
+        '''Run the isothermal approach with gains (K_c, tau_I) into metrics'''
+        alta = self.alta
+        timer = alta.timer()
+        yield from self.heat_steps(timer)
+        pid = PI_Controller(gains[0], gains[1], alta.DELAY_S, limit,
+                            alta.target_pwm(limit))
+        overshoot = alta.overshoot(limit)
+        alta.relay_cool()
+        alta.set_pwm(100)
+        t = next(timer)
+        end = t + self.STEP_TIME
+        while t < end:
+            t = next(timer)
+            T = alta.ptd.read()
+            if metrics.hold_start is None:
+                if T < limit - overshoot:
+                    metrics.hold_start = t
+            else:
+                alta.set_pwm(pid.proportion(T))
+            metrics.update(t, T)
+            alta.screen_put('Step {:5.1f} {:4d}'.format(T, t // 1000), 1)
+            alta.service()
+            yield
+        alta.set_pwm(0)
+
+    def relay_steps(self, target, result):
+        '''
+        Relay feedback experiment at target. Appends (Pu (s), a (deg C), d)
+        to result, or nothing if it didn't oscillate in RELAY_MAX_TIME
+        '''
+        alta = self.alta
+        timer = alta.timer()
+        offset = alta.target_pwm(target)
+        d = min(self.RELAY_AMPLITUDE, offset, 100 - offset)
+        alta.relay_cool()
+        alta.set_pwm(100)
+        t = next(timer)
+        end = t + self.RELAY_MAX_TIME
+        T = alta.ptd.read()
+        while T > target and t < end: # Cool to the target first
+            t = next(timer)
+            T = alta.ptd.read()
+            yield
+
+        cooling = True # PWM high
+        alta.set_pwm(offset + d)
+        extreme = T
+        highs, lows, starts = [], [], [] # Peaks, troughs, cooling start times
+        while len(starts) < self.CYCLES + 2 and t < end:
+            t = next(timer)
+            T = alta.ptd.read()
+            if cooling:
+                extreme = max(extreme, T)
+                if T < target - self.HYSTERESIS:
+                    highs.append(extreme)
+                    cooling = False
+                    alta.set_pwm(offset - d)
+                    extreme = T
+            else:
+                extreme = min(extreme, T)
+                if T > target + self.HYSTERESIS:
+                    lows.append(extreme)
+                    starts.append(t)
+                    cooling = True
+                    alta.set_pwm(offset + d)
+                    extreme = T
+            alta.screen_put('Tune {:5.1f} {:2d}'.format(T, len(starts)), 1)
+            alta.service()
+            yield
+        alta.set_pwm(0)
+
+        if len(starts) < self.CYCLES + 2:
+            return
+        starts = starts[-self.CYCLES - 1:]
+        period = (starts[-1] - starts[0]) / self.CYCLES / 1000
+        n = self.CYCLES
+        amplitude = (sum(highs[-n:]) / n - sum(lows[-n:]) / n) / 2
+        result.append((period, amplitude, d))
+
+    def gains(self, period, amplitude, d):
+        '''Tyreus-Luyben PI gains (K_c, tau_I) from the relay oscillation'''
+        a = max(amplitude, 1.1 * self.HYSTERESIS)
+        Ku = 4 * d / (math.pi * math.sqrt(a * a - self.HYSTERESIS ** 2))
+        return -Ku / 3.2, 2.2 * period
+
+    def tune_steps(self, targets, config_path=None):
+        '''
+        Tune at each target, report the step tests and save the gains to
+        config_path. Yields once per tick
+        '''
+        alta = self.alta
+        table = [row for row in alta.pi_table if row[0] not in targets]
+        for target in targets:
+            alta.screen_put('Autotune {}'.format(target))
+            before = StepMetrics(target)
+            yield from self.step_test_steps(target, alta.pi_gains(target),
+                                            before)
+            result = []
+            yield from self.relay_steps(target, result)
+            if not result:
+                print('autotune {}: no oscillation'.format(target))
+                continue
+            K_c, tau_I = self.gains(*result[0])
+            after = StepMetrics(target)
+            yield from self.step_test_steps(target, (K_c, tau_I), after)
+            print('autotune {}: Pu {:.0f} s a {:.2f} deg C -> K_c {:.2f} '
+                  'tau_I {:.0f} s'.format(target, result[0][0], result[0][1],
+                                          K_c, tau_I))
+            print('  before: ' + before.summary())
+            print('  after: ' + after.summary())
+            self.results.append((target, K_c, tau_I, before, after))
+            table.append([target, K_c, tau_I])
+
+        alta.pi_table = sorted(table)
+        if config_path is not None:
+            config.update(config_path, pi=alta.pi_table)
+        alta.switch_off()
+        alta.outcome = True
+
+    def tune(self, targets, config_path=None):
+        '''Blocking tune_steps, returns the (T, K_c, tau_I) table'''
+        self.alta.run(self.tune_steps(targets, config_path))
+        return self.alta.pi_table
@@ -0,0 +1,177 @@
+'''
+Run several ALTA cells from one pyBoard.
+
+Each cell is an ALTA instance with its own PTD, PWM channel, relay pair,
+LDR and fans pin. Rather than each blocking the board with its own loop, every cell runs
+a generator of its experiment (e.g. alta.isothermal_campaign) which does one
+tick's work per step. The scheduler steps every cell once per tick of a
+shared Ticker. The cells share the SPI buses, the LCD and the SD card:
+- SPI reads are sequential, so each PTD just needs its own chip select.
+- Each cell draws into its own LcdScreen framebuffer (lcd=None), and the
+scheduler shows each cell on the LCD in turn.
+- Each cell writes its own data directory through a BufferedLog, which only
+writes a block to the card when there is time before the next tick.
+
+    scheduler = CellScheduler(lcd)
+    ticker = scheduler.ticker
+    cell_1 = ALTA(ptd_1, inner_1, ch_1, ldr_1, None, fans_1, r1_1, r2_1,
+                  ticker=ticker, buffered_log=True)
+    ...
+    scheduler.add(cell_1, cell_1.isothermal_campaign('data1/', -15))
+    scheduler.add(cell_2, cell_2.linear_campaign('data2/', -1))
+    scheduler.run()
+
+Each ALTA switches its fans off whenever its PWM is 0 (melting, finished),
+so cells wired to one fans pin must not be given the pin itself: give each
+its own handle from SharedFans, and the fans stay on while any cell is
+cooling.
+
+    fans = SharedFans(fans_pin)
+    cell_1 = ALTA(ptd_1, inner_1, ch_1, ldr_1, None, fans.cell(), r1_1, ...)
+    cell_2 = ALTA(ptd_2, inner_2, ch_2, ldr_2, None, fans.cell(), r1_2, ...)
+'''
+
+import time
+
+from lcd_screen import LcdScreen
+from ticker import Ticker
+
+
+class Cell():
+    '''One ALTA and its experiment, with the time taken by each step'''
+    def __init__(self, alta, steps, name):
+        self.alta = alta
+        self.steps = steps
+        self.name = name
+        self.running = True
+        self.reset_timing()
+
+    def reset_timing(self):
+        self.ticks = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def step(self):
+        '''Do one tick of the experiment, timing it'''
+        start = time.ticks_us()
+        try:
+            next(self.steps)
+        except StopIteration:
+            self.running = False
+        t = time.ticks_diff(time.ticks_us(), start)
+        self.ticks += 1
+        self.total_us += t
+        if t > self.max_us:
+            self.max_us = t
+
+    def summary(self):
+        mean = self.total_us / self.ticks if self.ticks else 0
+        return 'cell {} ticks {} step mean {:.0f} max {} us'.format(
+            self.name, self.ticks, mean, self.max_us)
+
+
+class SharedFans():
+    '''One fans pin shared by several cells, high while any cell needs it'''
+    def __init__(self, pin):
+        self.pin = pin
+        self.on = 0 # Cells with their fans on
+        pin.low()
+
+    def cell(self):
+        '''A handle for one cell, to pass to ALTA as its fans_pin'''
+        return CellFans(self)
+
+    def switch(self, change):
+        self.on += change
+        if self.on:
+            self.pin.high()
+        else:
+            self.pin.low()
+
+
+class CellFans():
+    '''One cell's view of SharedFans, with the low() and high() of a Pin'''
+    def __init__(self, shared):
+        self.shared = shared
+        self.on = False
+
+    def high(self):
+        if not self.on:
+            self.on = True
+            self.shared.switch(1)
+
+    def low(self):
+        if self.on:
+            self.on = False
+            self.shared.switch(-1)
+
+    def value(self):
+        return 1 if self.on else 0
+
+
+class CellScheduler():
+    ROTATE_MS = 3000 # (ms) Time each cell is shown on the LCD
+    SUMMARY_TICKS = 3000 # Print the loop timing this often (10 minutes)
+
+    def __init__(self, lcd, period_ms=200, ticker=None):
+        '''
+        lcd: LCD shared by all the cells
+        period_ms: Time between ticks
+        ticker: Ticker to use, one is made if None
+        '''
+        if ticker is None:
+            ticker = Ticker(period_ms)
+        self.ticker = ticker
+        self.screen = LcdScreen(lcd)
+        self.cells = []
+        self.shown = 0 # Index of the cell on the LCD
+        self.shown_since = time.ticks_ms()
+
+    def add(self, alta, steps, name=None):
+        '''
+        alta: ALTA instance, made with lcd=None and this scheduler's ticker
+        steps: Generator of its experiment, e.g. alta.isothermal_campaign(...)
+        '''
+        if name is None:
+            name = str(len(self.cells) + 1)
+        cell = Cell(alta, steps, name)
+        self.cells.append(cell)
+        return cell
+
+    def show(self):
+        '''Copy the framebuffer of the current cell to the LCD'''
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self.shown_since) >= self.ROTATE_MS:
+            self.shown = (self.shown + 1) % len(self.cells)
+            self.shown_since = now
+        cell = self.cells[self.shown]
+        self.screen.frame[:] = cell.alta.screen.frame
+        self.screen.frame[0] = ord(cell.name[0]) # Label the cell
+        self.screen.refresh()
+
+    def summary(self):
+        lines = [self.ticker.summary()]
+        for cell in self.cells:
+            lines.append(cell.summary())
+        return '\n'.join(lines)
+
+    def reset_timing(self):
+        self.ticker.reset()
+        for cell in self.cells:
+            cell.reset_timing()
+
+    def run(self):
+        '''Step every cell once per tick until they have all finished'''
+        self.reset_timing()
+        running = True
+        while running:
+            running = False
+            for cell in self.cells:
+                if cell.running:
+                    cell.step()
+                    running = running or cell.running
+            self.show()
+            if self.ticker.ticks % self.SUMMARY_TICKS == 0:
+                print(self.summary())
+            self.ticker.wait()
+        print(self.summary())
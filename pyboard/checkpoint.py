@@ -0,0 +1,115 @@
+'''
+Checkpoints of a running campaign, so it carries on by itself after a reset.
+
+A campaign (ALTA.isothermal_campaign, linear_campaign, or one started over
+USB with protocol.py) saves its state to a small JSON file on the SD card at
+every phase change and every PERIOD_MS:
+
+    {"mode": "isothermal", "setpoint": -15, "filepath": "data/",
+     "last": null, "repeat": 12, "phase": "hold", "t": 64200,
+     "T": -15.1, "integral": -3.6, "hold_ms": 48200, "offset": null,
+     "segment": 1, "time": 702132005}
+
+phase is 'cool' (full power approach), 'hold' (PI control at the setpoint
+or down the ramp) or 'melt' (repeat recorded, melting), and segment the row
+of the profile being run (profiles.py). For a 'profile' campaign setpoint is
+the list of its segments, and for an 'adaptive' one its plan, with the counts
+at each temperature (schedule.py). time is from the RTC, so with a backup
+battery the time the board was down is known. Without one the RTC starts
+again from its epoch after a power cut, earlier than the save, and the time
+down is unknown.
+
+On boot ALTA.resume_steps() reads it. A repeat cut short is carried on, with
+its time and PI integral restored, if the board is known to have been down
+less than RESUME_MAX_S and the block hasn't drifted more than RESUME_BAND
+from where it was held. Otherwise the partial repeat is discarded, the sample
+melted and the repeat run again. Either way the campaign then continues, and
+the recovery is appended to recovery.csv, with the time down left blank if
+it is unknown. The file is removed when a campaign ends or is stopped.
+
+    checkpoint = Checkpoint('checkpoint.json')
+    alta = ALTA(..., checkpoint=checkpoint)
+    alta.run(alta.resume_steps() or alta.isothermal_campaign('data/', -15))
+'''
+
+import os
+import time
+
+import config
+
+
+class Checkpoint():
+    PERIOD_MS = 1000 * 10 # (ms) Saved this often within a phase
+    RESUME_MAX_S = 30 # (s) Carry on a repeat if down for less than this
+    RESUME_BAND = 5.0 # (deg C) and the block is still this close to T
+
+    def __init__(self, path='checkpoint.json'):
+        self.path = path
+        self.campaign = None # (mode, setpoint, filepath, last) being run
+        self.saved_t = None # t of the last save in this repeat
+        self.saves = 0
+
+    def start(self, mode, setpoint, filepath, last=None):
+        '''A campaign is starting, last: its final repeat, None if open'''
+        self.campaign = (mode, setpoint, filepath, last)
+        self.saved_t = None
+
+    def due(self, t):
+        '''True if a checkpoint is PERIOD_MS old at t (ms into the repeat)'''
+        return (self.campaign is not None and
+                (self.saved_t is None or t - self.saved_t >= self.PERIOD_MS
+                 or t < self.saved_t))
+
+    def save(self, repeat, phase, t, T, integral=0, hold_ms=None,
+             offset=None, segment=0):
+        '''Save the state of the campaign, if one is running'''
+        if self.campaign is None:
+            return
+        mode, setpoint, filepath, last = self.campaign
+        config.save(self.path, {'mode': mode,
+                                'setpoint': setpoint,
+                                'filepath': filepath,
+                                'last': last,
+                                'repeat': repeat,
+                                'phase': phase,
+                                't': t,
+                                'T': T,
+                                'integral': integral,
+                                'hold_ms': hold_ms,
+                                'offset': offset,
+                                'segment': segment,
+                                'time': time.time()})
+        self.saved_t = t
+        self.saves += 1
+
+    def load(self):
+        '''The last state saved, {} if no campaign was running'''
+        return config.load(self.path)
+
+    def down_s(self, state):
+        '''
+        Seconds since state was saved, None if unknown: the RTC reads earlier
+        than the save, having been reset with no backup battery
+        '''
+        down_s = time.time() - state['time']
+        if down_s < 0:
+            return None
+        return down_s
+
+    def can_resume(self, state, T):
+        '''True if the repeat cut short in state can be carried on at T'''
+        down_s = self.down_s(state)
+        if (state['phase'] == 'melt' or down_s is None or
+                down_s > self.RESUME_MAX_S):
+            return False
+        return state['phase'] == 'cool' or abs(T - state['T']) <= \
+            self.RESUME_BAND
+
+    def clear(self):
+        '''The campaign has ended, nothing to resume'''
+        self.campaign = None
+        for path in (self.path, self.path + '.tmp'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
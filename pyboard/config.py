@@ -0,0 +1,44 @@
+'''
+Settings kept in a JSON file on the SD card, e.g. the PI gains found by
+autotune.py, so they survive a reboot:
+
+    settings = config.load('alta.json') # {} if there is no file yet
+    config.update('alta.json', pi=[[-15, -8.2, 120.0]])
+'''
+
+import json
+import os
+
+
+def load(path):
+    '''Settings from path, {} if it doesn't exist or can't be read'''
+    for name in (path, path + '.tmp'): # .tmp if reset part way through save
+        try:
+            with open(name) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return {}
+
+
+def save(path, settings):
+    '''
+    Write settings to path. They are written to a temporary file first, so a
+    reset part way through leaves the old file
+    '''
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(settings, f)
+    try:
+        os.remove(path) # FAT can't rename over an existing file
+    except OSError:
+        pass
+    os.rename(tmp, path)
+
+
+def update(path, **values):
+    '''Change some settings, keeping the rest, returns them all'''
+    settings = load(path)
+    settings.update(values)
+    save(path, settings)
+    return settings
@@ -0,0 +1,163 @@
+'''
+Writers for the run data of each repeat.
+
+DirectLog is the original behaviour: each sample is printed to the REPL and
+written straight to the file inside the control loop.
+
+BufferedLog appends samples to a preallocated RAM ring buffer and writes them
+to the SD card in 512 byte, block aligned chunks between control ticks. Small
+writes are slow on FAT, and a write which stalls now delays the buffer rather
+than the control loop.
+
+Both are used the same way by ALTA:
+
+    log.attach(f) # Start of repeat, f is the open running.csv or journal
+    log.write(data) # Every tick
+    log.service() # After the tick's work, before waiting for the next tick
+    log.flush() # Phase boundaries, and before the file is closed and renamed
+'''
+
+import time
+
+
+class DirectLog():
+    MODE = 'w' # File mode for the data file
+
+    def __init__(self, echo=True):
+        '''echo: print each sample to the REPL'''
+        self.echo = echo
+        self.f = None
+
+    def attach(self, f):
+        self.f = f
+
+    def write(self, data):
+        if self.echo:
+            print(data, end='')
+        _ = self.f.write(data)
+
+    def service(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def summary(self):
+        return 'log direct'
+
+
+class BufferedLog():
+    MODE = 'wb'
+    BLOCK = 512 # (bytes) SD card sector size
+
+    def __init__(self, blocks=8, ticker=None, echo=False):
+        '''
+        blocks: Size of the ring buffer in SD blocks
+        ticker: Ticker of the control loop, if given flushes are deferred
+            while a tick is already due
+        echo: print each sample to the REPL
+        '''
+        self.size = blocks * self.BLOCK
+        self.buf = bytearray(self.size)
+        self.mv = memoryview(self.buf)
+        self.blocks = [self.mv[i:i + self.BLOCK] # Whole block writes
+                       for i in range(0, self.size, self.BLOCK)]
+        self.ticker = ticker
+        self.echo = echo
+        self.f = None
+        self.attach(None)
+
+    def attach(self, f):
+        '''
+        Start logging to f, clearing the counters. Writes are aligned to
+        blocks of the file from its current position, e.g. the end of a
+        journal opened for appending
+        '''
+        self.f = f
+        position = f.tell() if f is not None else 0
+        self.head = position % self.BLOCK # Bytes written into the buffer
+        self.tail = self.head # Bytes written to the file
+        self.dropped = 0 # Samples lost because the buffer was full
+        self.late = 0 # Flushes which ran past the next tick
+        self.max_write_ms = 0 # Longest single write to the card
+
+    def pending(self):
+        '''Bytes waiting to be written to the file'''
+        return self.head - self.tail
+
+    def write(self, data):
+        '''Copy a sample into the ring buffer'''
+        if self.echo:
+            print(data, end='')
+        if isinstance(data, str):
+            data = data.encode()
+        n = len(data)
+        if self.head - self.tail + n > self.size:
+            self.dropped += 1
+            return
+        start = self.head % self.size
+        end = start + n
+        if end <= self.size:
+            self.buf[start:end] = data
+        else: # Wrap around the end of the buffer
+            first = self.size - start
+            self.buf[start:] = data[:first]
+            self.buf[:n - first] = data[first:]
+        self.head += n
+
+    def write_from(self, data, n):
+        '''
+        Copy the first n bytes of data into the ring buffer, byte by byte so
+        nothing is allocated, e.g. a LineBuffer
+        '''
+        if self.echo:
+            print(bytes(data[:n]).decode(), end='')
+        if self.head - self.tail + n > self.size:
+            self.dropped += 1
+            return
+        buf = self.buf
+        size = self.size
+        head = self.head
+        for i in range(n):
+            buf[(head + i) % size] = data[i]
+        self.head = head + n
+
+    def _write_chunk(self):
+        '''Write up to the next block boundary of the file'''
+        start = self.tail % self.size
+        n = min(self.BLOCK - self.tail % self.BLOCK, self.pending())
+        t = time.ticks_ms()
+        if n == self.BLOCK:
+            _ = self.f.write(self.blocks[start // self.BLOCK])
+        else: # The first write after attach, or a flush
+            _ = self.f.write(self.mv[start:start + n])
+        t = time.ticks_diff(time.ticks_ms(), t)
+        if t > self.max_write_ms:
+            self.max_write_ms = t
+        self.tail += n
+
+    def service(self):
+        '''
+        Write one block to the card if a whole one is buffered. Writing waits
+        if the next tick is already due, unless the buffer is nearly full.
+        '''
+        if self.pending() < self.BLOCK:
+            return
+        if self.ticker is not None:
+            if self.ticker.pending and self.pending() < self.size // 2:
+                return # Catch up between later ticks
+            self._write_chunk()
+            if self.ticker.pending:
+                self.late += 1
+        else:
+            self._write_chunk()
+
+    def flush(self):
+        '''Write everything buffered to the card'''
+        while self.pending():
+            self._write_chunk()
+        self.f.flush()
+
+    def summary(self):
+        return 'log dropped {} late {} max write {} ms'.format(
+            self.dropped, self.late, self.max_write_ms)
@@ -0,0 +1,123 @@
+'''
+One append-only journal per data directory, instead of a file per repeat.
+
+Each repeat is written to running.csv and renamed to a name holding its
+outcome, and finding the next repeat number lists and parses the whole
+directory. Both get slower as the card fills, and FAT directories of
+thousands of files are slow to list and copy. With ALTA(..., journal=True)
+every repeat is appended to journal.csv instead, between a header and a
+footer line:
+
+    #start,12,isothermal,-15
+    0,19.9,20.0,2394,Cool
+    ...
+    #end,12,frozen,81842
+
+The footer holds what the filename did, so ALTA_journal.py can explode the
+journal back into the usual 12_isothermal-15_frozen_81842.csv files. A
+repeat which went wrong, or was abandoned by closing ALTA's steps (e.g. a
+stop from the host), ends with outcome 'error'. One cut short by a reset has
+no footer, and may end in a partial line, which begin() ends before the next
+header.
+
+journal.idx indexes the finished repeats with a fixed size record each
+(repeat, offset, length), so the last repeat number is one read at the end
+of the index, and repeat N one read at a known position.
+'''
+
+import os
+import struct
+
+JOURNAL = 'journal.csv'
+INDEX = 'journal.idx'
+RECORD = '<III' # Repeat, offset and length of its lines in the journal
+RECORD_SIZE = struct.calcsize(RECORD)
+
+
+class Journal():
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.path = filepath + '/' + JOURNAL
+        self.index_path = filepath + '/' + INDEX
+        self.start = None # Offset of the repeat being written
+
+    def size(self, path):
+        try:
+            return os.stat(path)[6]
+        except OSError:
+            return 0
+
+    def records(self):
+        return self.size(self.index_path) // RECORD_SIZE
+
+    def record(self, i):
+        '''(repeat, offset, length) of the i-th finished repeat'''
+        with open(self.index_path, 'rb') as f:
+            f.seek(i * RECORD_SIZE)
+            return struct.unpack(RECORD, f.read(RECORD_SIZE))
+
+    def last_repeat(self):
+        '''Number of the last finished repeat, 0 if none'''
+        n = self.records()
+        if n == 0:
+            return 0
+        return self.record(n - 1)[0]
+
+    def find(self, repeat):
+        '''(offset, length) of repeat in the journal, None if not there'''
+        n = self.records()
+        if n == 0:
+            return None
+        first = self.record(0)[0]
+        i = repeat - first # Numbered consecutively unless a reset intervened
+        if 0 <= i < n:
+            record = self.record(i)
+            if record[0] == repeat:
+                return record[1:]
+        low, high = 0, n # Otherwise bisect, repeats only increase
+        while low < high:
+            middle = (low + high) // 2
+            record = self.record(middle)
+            if record[0] < repeat:
+                low = middle + 1
+            elif record[0] > repeat:
+                high = middle
+            else:
+                return record[1:]
+        return None
+
+    def read(self, repeat):
+        '''The lines of repeat, header and footer included, as bytes'''
+        found = self.find(repeat)
+        if found is None:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(found[0])
+            return f.read(found[1])
+
+    def begin(self, repeat, mode, setpoint, file_mode='a'):
+        '''
+        Write the header of a repeat, on a line of its own, returns the
+        journal open for its samples, e.g. as the file for ALTA's log
+        '''
+        size = self.size(self.path)
+        header = '#start,{},{},{}\n'.format(repeat, mode, setpoint)
+        if size:
+            with open(self.path, 'rb') as f:
+                f.seek(size - 1)
+                if f.read(1) != b'\n': # A repeat cut off mid line
+                    header = '\n' + header
+                    size += 1
+        self.start = size
+        f = open(self.path, file_mode.replace('w', 'a'))
+        f.write(header if 'b' not in file_mode else header.encode())
+        return f
+
+    def end(self, repeat, outcome, value):
+        '''Write the footer of the repeat begun last, and index it'''
+        with open(self.path, 'a') as f:
+            f.write('#end,{},{},{}\n'.format(repeat, outcome, value))
+        length = self.size(self.path) - self.start
+        with open(self.index_path, 'ab') as f:
+            f.write(struct.pack(RECORD, repeat, self.start, length))
+        self.start = None
@@ -0,0 +1,137 @@
+'''
+Shadow framebuffer for the LCD, so only characters which change are sent.
+
+Messages are put into a RAM copy of the screen, which costs no I2C traffic.
+refresh() then compares it with what is already on the LCD and writes only
+the changed characters, moving the cursor only when it is not already in the
+right place. Refreshes are rate limited independently of the control loop,
+so it can be called every tick.
+
+    screen = LcdScreen(lcd, refresh_ms=1000)
+    screen.put('Hold -15.0 42', row=1)
+    screen.refresh()
+
+With lcd=None it is only a framebuffer, e.g. for one of several ALTA cells
+sharing an LCD (see cells.py).
+
+put_line() and whole_rows=True don't allocate, for the zero allocation loop:
+a row already formatted into a LineBuffer is centred straight into the
+framebuffer, and each changed row is rewritten whole from it.
+'''
+
+import time
+
+
+class LcdScreen():
+    def __init__(self, lcd, refresh_ms=1000, num_lines=2, num_columns=16,
+                 whole_rows=False):
+        '''
+        lcd: LcdApi instance (e.g. I2cLcd), or None
+        refresh_ms: Minimum time between refreshes of the LCD
+        num_lines, num_columns: Screen size if there is no lcd
+        whole_rows: Rewrite changed rows whole with lcd.write_row, which
+            doesn't allocate, rather than sending only the changed characters
+        '''
+        self.lcd = lcd
+        if lcd is not None:
+            num_lines = lcd.num_lines
+            num_columns = lcd.num_columns
+        self.num_lines = num_lines
+        self.num_columns = num_columns
+        self.refresh_ms = refresh_ms
+        self.row_format = '{:^%d}' % self.num_columns # Centred
+        size = self.num_lines * self.num_columns
+        self.frame = bytearray(b' ' * size) # What should be shown
+        self.shown = bytearray(b' ' * size) # What is on the LCD
+        frame = memoryview(self.frame)
+        self.rows = [frame[i:i + self.num_columns]
+                     for i in range(0, size, self.num_columns)]
+        self.whole_rows = whole_rows
+        self.last_refresh = None
+        self.chars_sent = 0
+        self.moves_sent = 0
+
+    def put(self, message='', row=0):
+        '''Centre message on a row of the framebuffer'''
+        text = self.row_format.format(message)[:self.num_columns]
+        start = row * self.num_columns
+        self.frame[start:start + self.num_columns] = text.encode()
+
+    def put_line(self, line, row=0):
+        '''Centre the text in LineBuffer line on a row, as put'''
+        columns = self.num_columns
+        n = min(line.n, columns)
+        start = row * columns
+        left = (columns - n) // 2
+        frame = self.frame
+        buf = line.buf
+        for x in range(columns):
+            i = x - left
+            frame[start + x] = buf[i] if 0 <= i < n else 32
+
+    def clear(self):
+        for i in range(len(self.frame)):
+            self.frame[i] = 32 # Space
+
+    def refresh(self, force=False):
+        '''Send changed characters, at most once every refresh_ms'''
+        if self.lcd is None:
+            return
+        now = time.ticks_ms()
+        if not force and self.last_refresh is not None:
+            if time.ticks_diff(now, self.last_refresh) < self.refresh_ms:
+                return
+        self.last_refresh = now
+        if self.whole_rows:
+            self._send_rows()
+            return
+
+        frame = self.frame
+        shown = self.shown
+        columns = self.num_columns
+        for row in range(self.num_lines):
+            offset = row * columns
+            x = 0
+            while x < columns:
+                if frame[offset + x] == shown[offset + x]:
+                    x += 1
+                    continue
+                end = x + 1 # Find the end of this run of changes
+                while end < columns:
+                    if frame[offset + end] != shown[offset + end]:
+                        end += 1
+                    elif (end + 1 < columns and
+                          frame[offset + end + 1] != shown[offset + end + 1]):
+                        end += 2 # Resending one char is cheaper than a move
+                    else:
+                        break
+                self._send(x, row, end)
+                x = end
+
+    def _send_rows(self):
+        '''Rewrite each row with a change, whole'''
+        frame = self.frame
+        shown = self.shown
+        columns = self.num_columns
+        for row in range(self.num_lines):
+            offset = row * columns
+            changed = False
+            for x in range(offset, offset + columns):
+                if frame[x] != shown[x]:
+                    shown[x] = frame[x]
+                    changed = True
+            if changed:
+                self.lcd.write_row(row, self.rows[row])
+                self.moves_sent += 1
+                self.chars_sent += columns
+
+    def _send(self, x, row, end):
+        '''Write columns x to end - 1 of row to the LCD'''
+        lcd = self.lcd
+        if lcd.cursor_x != x or lcd.cursor_y != row:
+            lcd.move_to(x, row)
+            self.moves_sent += 1
+        start = row * self.num_columns
+        lcd.putstr(self.frame[start + x:start + end].decode())
+        self.shown[start + x:start + end] = self.frame[start + x:start + end]
+        self.chars_sent += end - x
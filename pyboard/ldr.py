@@ -0,0 +1,127 @@
+'''
+Oversampled LDR front end with change-point freeze detection.
+
+A single ADC reading compared with a single clear reading is noisy, and one
+bad reading can end a repeat early. Instead each tick:
+1. A burst of samples is captured with ADC.read_timed into a reusable buffer.
+2. The median of the burst is the tick's reading, rejecting spikes.
+3. A one sided CUSUM accumulates how far the readings have dropped below the
+clear baseline, less an allowance (DRIFT) for noise:
+    S = max(0, S + (baseline - reading) - DRIFT)
+The sample is frozen when S exceeds LIMIT. Until then the baseline follows
+slow changes in the LED with an exponential moving average.
+
+The freeze instant is estimated to better than a tick: it is where the
+readings crossed (baseline - threshold), interpolated between ticks, or
+located within the burst if the crossing happened while it was sampled.
+'''
+
+from array import array
+import time
+from pyb import Timer
+
+
+class LdrDetector():
+    BURST = 16 # Samples per tick
+    SAMPLE_FREQ = 4000 # (Hz) A burst takes 4 ms
+    TIMER_ID = 6 # Paces read_timed, only otherwise used by the DAC
+    BASELINE_TICKS = 5 # Ticks averaged for the initial clear baseline
+    BASELINE_ALPHA = 0.01 # EMA weight for baseline tracking
+
+    def __init__(self, adc, threshold=150, timer_id=TIMER_ID):
+        '''
+        adc: pyb.ADC on the LDR voltage divider
+        threshold: Drop in ADC counts between a clear and frozen sample
+        timer_id: Timer to pace the burst
+        '''
+        self.adc = adc
+        self.threshold = threshold
+        self.drift = threshold // 2 # Per tick allowance in the CUSUM
+        self.limit = 2 * threshold # CUSUM alarm level
+        self.buf = array('H', [0] * self.BURST)
+        self.sorted = array('H', [0] * self.BURST)
+        self.timer = Timer(timer_id, freq=self.SAMPLE_FREQ)
+        self.sample_ms = 1000 / self.SAMPLE_FREQ
+        self.reset()
+
+    def reset(self):
+        '''Forget the baseline, at the start of each repeat'''
+        self.baseline = 0
+        self.baseline_count = 0
+        self.cusum = 0
+        self.frozen = False
+        self.value = 0 # Median of the last burst
+        self.burst_ms = 0 # ticks_ms at the start of the last burst
+        self.above_ms = None # Last reading above the crossing level
+        self.above_value = 0
+        self.crossing_ms = None # Estimated time the level was crossed
+        self.onset_ms = 0 # Freeze instant relative to the last burst (ms)
+
+    def _median(self):
+        '''Median of the burst, using the preallocated sort buffer'''
+        s = self.sorted
+        n = self.BURST
+        for i in range(n): # Insertion sort
+            v = self.buf[i]
+            j = i
+            while j > 0 and s[j - 1] > v:
+                s[j] = s[j - 1]
+                j -= 1
+            s[j] = v
+        return (s[(n - 1) // 2] + s[n // 2]) // 2
+
+    def read(self):
+        '''Capture a burst, update the detector and return the reading'''
+        self.burst_ms = time.ticks_ms()
+        self.adc.read_timed(self.buf, self.timer)
+        value = self._median()
+        self.value = value
+
+        if self.baseline_count < self.BASELINE_TICKS: # Still calibrating
+            self.baseline_count += 1
+            self.baseline += (value - self.baseline) / self.baseline_count
+            return value
+
+        self.cusum = max(0, self.cusum + (self.baseline - value) - self.drift)
+        if self.cusum == 0:
+            self.baseline += (value - self.baseline) * self.BASELINE_ALPHA
+
+        level = self.baseline - self.threshold
+        if value >= level:
+            self.above_ms = self.burst_ms
+            self.above_value = value
+            self.crossing_ms = None
+        elif self.crossing_ms is None: # First reading below the level
+            self.crossing_ms = self._crossing(level)
+
+        if self.cusum > self.limit and not self.frozen:
+            self.frozen = True
+            crossing = self.crossing_ms
+            if crossing is None: # Dropped, but not below the level
+                crossing = self.burst_ms
+            self.onset_ms = time.ticks_diff(int(crossing), self.burst_ms) + \
+                            crossing % 1
+        return value
+
+    def calibrated(self):
+        '''True once the clear baseline has been measured, since reset()'''
+        return self.baseline_count >= self.BASELINE_TICKS
+
+    def clear(self):
+        '''True if the last reading is back within DRIFT of the clear baseline'''
+        return self.baseline_count > 0 and \
+               self.value >= self.baseline - self.drift
+
+    def _crossing(self, level):
+        '''Estimate when the readings crossed level (ticks_ms, fractional)'''
+        for i in range(self.BURST): # Within this burst?
+            if self.buf[i] < level:
+                break
+        if i > 0:
+            return self.burst_ms + i * self.sample_ms
+        if self.above_ms is None:
+            return self.burst_ms
+        # Interpolate between the last reading above and this one
+        gap = time.ticks_diff(self.burst_ms, self.above_ms)
+        fraction = (self.above_value - level) / (self.above_value - self.value)
+        return self.above_ms + fraction * gap
@@ -0,0 +1,106 @@
+'''
+Text formatted in place into a preallocated bytearray, for the zero
+allocation loop (ALTA(..., zero_alloc=True)).
+
+str.format and str() build a new string every tick, and on a pyBoard with a
+small heap the garbage soon triggers a collection in the middle of a tick.
+LineBuffer writes the same ASCII text digit by digit into a buffer allocated
+once:
+
+    line = LineBuffer(48)
+    line.clear()
+    line.int(64200)
+    line.comma()
+    line.milli(-15063)
+    line.newline()
+    log.write_from(line.buf, line.n) # b'64200,-15.1\n'
+
+milli() writes an integer temperature in milli deg C (MAX31865.read_milli)
+to one decimal place, rounded as MAX31865.read, so it comes out as str() of
+the rounded float. fixed() does the same for a float, -0.0 included.
+'''
+
+import math
+
+
+class LineBuffer():
+    def __init__(self, size=64):
+        self.buf = bytearray(size)
+        self.n = 0 # Bytes written
+
+    def clear(self):
+        self.n = 0
+
+    def byte(self, c):
+        self.buf[self.n] = c
+        self.n += 1
+
+    def comma(self):
+        self.byte(44)
+
+    def newline(self):
+        self.byte(10)
+
+    def spaces(self, count):
+        for _ in range(count):
+            self.byte(32)
+
+    def text(self, b):
+        '''Copy bytes b, e.g. a status from ALTA.status_bytes'''
+        for i in range(len(b)):
+            self.byte(b[i])
+
+    def digits(self, value):
+        '''Write the non negative int value'''
+        count = 1
+        v = value
+        while v >= 10:
+            v //= 10
+            count += 1
+        i = self.n + count
+        self.n = i
+        while count:
+            i -= 1
+            self.buf[i] = 48 + value % 10
+            value //= 10
+            count -= 1
+
+    def int(self, value, width=0):
+        '''Write int value, right aligned in width as '{:5d}' '''
+        negative = value < 0
+        if negative:
+            value = -value
+        count = 1
+        v = value
+        while v >= 10:
+            v //= 10
+            count += 1
+        self.spaces(width - count - negative)
+        if negative:
+            self.byte(45)
+        self.digits(value)
+
+    def milli(self, value, width=0):
+        '''Write value / 1000 to one decimal place, right aligned as fixed'''
+        tenths = (value + 50) // 100
+        self._tenths(-tenths if tenths < 0 else tenths, tenths < 0, width)
+
+    def fixed(self, value, width=0):
+        '''Write value to one decimal place, right aligned as '{:5.1f}' '''
+        tenths = round(value * 10)
+        negative = tenths < 0 or math.copysign(1, value) < 0
+        self._tenths(-tenths if tenths < 0 else tenths, negative, width)
+
+    def _tenths(self, tenths, negative, width):
+        '''Write the non negative int tenths / 10, after a minus if negative'''
+        whole = tenths // 10
+        count = 3 # Units, point and tenths
+        while whole >= 10:
+            whole //= 10
+            count += 1
+        self.spaces(width - count - negative)
+        if negative:
+            self.byte(45)
+        self.digits(tenths // 10)
+        self.byte(46)
+        self.byte(48 + tenths % 10)
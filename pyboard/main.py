@@ -5,17 +5,26 @@ from MAX31865 import MAX31865
 from MAX31855 import MAX31855
 from pyb_i2c_lcd import I2cLcd
 from ALTA import ALTA
+import config
 
 ##  INITIALISE PLATINUM RESISTANCE THERMOMETER (MAX31865)
+# The MAX31865 runs at up to 5 MHz, so both PTDs can be read back to back in
+# well under a millisecond.
+PTD_BAUDRATE = 1000000
+# If the DRDY pins of the MAX31865s are wired, give them here so the chips are
+# only read when a new conversion is ready, e.g. Pin('X4') and Pin('Y4')
+drdy_PTD = None
+drdy_inner = None
+
 spi_PTD = SPI(1, # pyBoard hardware SPI 1 (X5, X6, X7, X8)
               mode=SPI.MASTER,
-              baudrate=100000,
+              baudrate=PTD_BAUDRATE,
               polarity=0,
               phase=1,
               firstbit=SPI.MSB)
 cs_PTD = Pin('X5', mode=Pin.OUT_PP) # Chip select pin
 
-ptd = MAX31865(spi_PTD, cs_PTD)
+ptd = MAX31865(spi_PTD, cs_PTD, drdy_pin=drdy_PTD)
 
 
 ## INITIALISE K TYPE THERMOCOUPLE (MAX31855)
@@ -38,13 +47,13 @@ k = MAX31855(spi_K, cs_K)
 # chamber.
 spi_inner = SPI(2, # pyBoard hardware SPI 1 (X5, X6, X7, X8)
               mode=SPI.MASTER,
-              baudrate=100000,
+              baudrate=PTD_BAUDRATE,
               polarity=0,
               phase=1,
               firstbit=SPI.MSB)
 cs_inner = Pin('Y5', mode=Pin.OUT_PP) # Chip select pin
 
-inner = MAX31865(spi_inner, cs_inner)
+inner = MAX31865(spi_inner, cs_inner, drdy_pin=drdy_inner)
 
 ## SETUP LDR
 # Light dependent resistor
@@ -72,6 +81,11 @@ lcd = I2cLcd(i2c, lcd_address, 2, 16)
 relay_1 = Pin('X11', mode=Pin.OUT_PP)
 relay_2 = Pin('X12', mode=Pin.OUT_PP)
 
+## LOAD SETTINGS
+# Tuned PI gains etc. saved on the SD card, see autotune.py
+CONFIG_FILE = 'alta.json'
+settings = config.load(CONFIG_FILE)
+
 ## SETUP STATE MACHINE
 alta = ALTA(ptd,
             inner,
@@ -80,11 +94,135 @@ alta = ALTA(ptd,
             lcd,
             fans_pin,
             relay_1,
-            relay_2)
+            relay_2,
+            model_approach=False, # True to stop full cooling using approach.py
+            journal=False, # True to append repeats to data/journal.csv
+            settings=settings)
 
 filepath = 'data/'
 
 # WRITE ANY CODE YOU WANT TO EXECUTE ON TURNING THE PYBOARD ON HERE
 
 #alta.linear_experiment(filepath)
-  
+
+## PWM CALIBRATION
+# Measure the PWM which holds each temperature and save it in CONFIG_FILE,
+# takes about an hour. Run it before autotuning
+'''
+from pwm_calibration import PwmCalibration
+PwmCalibration(alta).calibrate(CONFIG_FILE)
+'''
+
+## AUTOTUNE
+# Find PI gains for these temperatures and save them in CONFIG_FILE, takes
+# about 10 minutes per temperature
+'''
+from autotune import Autotune
+Autotune(alta).tune((-10, -15, -20, -25), CONFIG_FILE)
+'''
+
+## RESUME AFTER A RESET
+# Checkpoint the campaign to the SD card, so that after a power cut or reset
+# it carries on by itself: the repeat cut short is resumed if the board was
+# down briefly, otherwise discarded and run again. Recoveries are logged to
+# data/recovery.csv
+'''
+from checkpoint import Checkpoint
+alta = ALTA(ptd, inner, ch, ldr_pin, lcd, fans_pin, relay_1, relay_2,
+            buffered_log=True, settings=settings,
+            checkpoint=Checkpoint('checkpoint.json'))
+alta.run(alta.resume_steps() or alta.isothermal_campaign(filepath, -15))
+'''
+
+## PROFILING
+# Time each part of every tick. Each repeat's timings are appended to
+# data/profile.csv, or at the REPL run alta.profiler.report()
+'''
+from profiler import Profiler
+alta = ALTA(ptd, inner, ch, ldr_pin, lcd, fans_pin, relay_1, relay_2,
+            settings=settings, profiler=Profiler())
+'''
+
+## TEMPERATURE PROFILE
+# Any program of cools, holds and ramps, here a hold at -10 deg C then a
+# ramp down to a hold at -20 deg C, repeated until stopped
+'''
+from profiles import cool, hold, ramp, wait_for_freeze, melt
+alta.run(alta.campaign_steps('profile', filepath,
+                             [cool(-10), wait_for_freeze(), hold(-10, 60000),
+                              ramp(-0.5, -20), hold(-20, 120000), melt()]))
+'''
+
+## ADAPTIVE CAMPAIGN
+# Isothermal repeats at several temperatures, each repeat at the one nearest
+# its target, until the nucleation rate at each is known to within a factor
+# of 1.5 (95% confidence). Decisions are logged to data/schedule.csv
+'''
+alta.run(alta.adaptive_campaign(filepath, [-13, -14, -15], target=0.5))
+'''
+
+## ZERO ALLOCATION LOOP
+# Format samples and the LCD into preallocated buffers, so the heap is only
+# collected between phases, never in the middle of control
+'''
+alta = ALTA(ptd, inner, ch, ldr_pin, lcd, fans_pin, relay_1, relay_2,
+            settings=settings, zero_alloc=True)
+'''
+
+## ASYNCIO RUNTIME
+# Runs the control loop, LCD, SD card, USB telemetry and commands as separate
+# uasyncio tasks. Send 'stop' or 'status' over USB.
+'''
+from runtime import Runtime
+alta = ALTA(ptd, inner, ch, ldr_pin, lcd, fans_pin, relay_1, relay_2,
+            buffered_log=True)
+Runtime(alta).run(alta.isothermal_campaign(filepath, -15))
+'''
+
+## HEADLESS
+# Wait for commands from ALTA_cli.py over USB, e.g.
+#     python ALTA_cli.py /dev/ttyACM0 start isothermal -15
+#     python ALTA_cli.py /dev/ttyACM0 pull data --out data/
+'''
+import pyb
+from protocol import CommandServer
+from checkpoint import Checkpoint
+alta = ALTA(ptd, inner, ch, ldr_pin, lcd, fans_pin, relay_1, relay_2,
+            buffered_log=True, settings=settings,
+            checkpoint=Checkpoint('checkpoint.json'))
+server = CommandServer(alta, pyb.USB_VCP(), filepath)
+server.recover() # Carry on a campaign cut short by a reset
+server.serve()
+'''
+
+## BINARY TELEMETRY
+# Send every sample over USB as compact CRC checked frames instead of
+# printing it. On the computer, run
+#     python ALTA_telemetry.py /dev/ttyACM0 --out live_data/
+# to rebuild the repeat files and store as they finish
+'''
+import pyb
+from telemetry import TelemetryLink
+alta = ALTA(ptd, inner, ch, ldr_pin, lcd, fans_pin, relay_1, relay_2,
+            buffered_log=True, link=TelemetryLink(pyb.USB_VCP()))
+'''
+
+## SEVERAL CELLS
+# To run more than one cell from this pyBoard, give each its own PTDs (on the
+# same SPI buses with their own chip selects), PWM channel, relays, LDR and
+# fans pin, and step them all from a CellScheduler. They share the LCD and SD
+# card. If the cells' fans are wired to one pin, pass each cell
+# fans.cell() from fans = SharedFans(fans_pin) instead, so one cell melting
+# doesn't switch them off while another is cooling (see cells.py).
+'''
+from cells import CellScheduler
+scheduler = CellScheduler(lcd)
+fans_pin_2 = Pin('Y6', mode=Pin.OUT_PP)
+cell_1 = ALTA(ptd, inner, ch, ldr_pin, None, fans_pin, relay_1, relay_2,
+              ticker=scheduler.ticker, buffered_log=True)
+cell_2 = ALTA(ptd_2, inner_2, ch_2, ldr_pin_2, None, fans_pin_2, relay_3,
+              relay_4, ticker=scheduler.ticker, buffered_log=True)
+scheduler.add(cell_1, cell_1.isothermal_campaign('data1/', -15))
+scheduler.add(cell_2, cell_2.linear_campaign('data2/', -1))
+scheduler.run()
+'''
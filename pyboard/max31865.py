@@ -1,7 +1,71 @@
+import math
+from array import array
+
 from machine import SPI, Pin
-import ustruct
+
+# Callendar-Van Dusen coefficients for a platinum RTD (IEC 60751)
+CVD_A = 3.9083e-3
+CVD_B = -5.775e-7
+CVD_C = -4.183e-12
+CVD_T_MIN = -200 # (deg C) The equation holds down to here
+TABLE_SHIFT = 7 # Table entry every 2**TABLE_SHIFT RTD codes
+
+_tables = {} # Shared by the sensors, by (RefR, R0)
+
+
+def cvd_resistance(T, R0=100.0):
+   '''Resistance (Ohms) of the RTD at T (deg C)'''
+   R = 1 + CVD_A * T + CVD_B * T * T
+   if T < 0:
+      R += CVD_C * (T - 100) * T * T * T
+   return R0 * R
+
+
+def cvd_temperature(R, R0=100.0):
+   '''Temperature (deg C) of the RTD at resistance R, inverting cvd_resistance'''
+   if R <= cvd_resistance(CVD_T_MIN, R0):
+      return CVD_T_MIN
+   # Exact above 0 deg C, the starting point of Newton's method below it
+   T = (-CVD_A + math.sqrt(CVD_A * CVD_A - 4 * CVD_B * (1 - R / R0))) / (
+        2 * CVD_B)
+   if R < R0:
+      for _ in range(4):
+         slope = R0 * (CVD_A + 2 * CVD_B * T + CVD_C * (
+                       4 * T * T * T - 300 * T * T))
+         T -= (cvd_resistance(T, R0) - R) / slope
+   return T
+
+
+def cvd_table(RefR, R0):
+   '''
+   Temperature (milli deg C) at every 2**TABLE_SHIFT of the 15 bit RTD code,
+   for interpolating between. Built once, 257 entries
+   '''
+   table = _tables.get((RefR, R0))
+   if table is None:
+      step = 1 << TABLE_SHIFT
+      table = array('i', [round(1000 * cvd_temperature(code * RefR / 32768,
+                                                       R0))
+                          for code in range(0, 32768 + step, step)])
+      _tables[(RefR, R0)] = table
+   return table
+
 
 class MAX31865():
+   '''
+   Driver for the MAX31865 RTD-to-digital converter.
+
+   Reads reuse preallocated buffers and a single send_recv transfer, so they
+   don't allocate. If the chip's DRDY pin is wired (drdy_pin) it triggers an
+   interrupt when a new conversion is ready, and read() only talks to the chip
+   when there is new data. Faults are recorded in self.fault rather than
+   printed, see the FAULT_ constants.
+
+   The RTD code is converted to a temperature with integer maths only, by
+   interpolating a table of the Callendar-Van Dusen equation (cvd_table),
+   which is accurate to 2 milli deg C. read_milli() gives the temperature as
+   an int in milli deg C, read() to 0.1 deg C.
+   '''
 
    ### Register constants, see data sheet for info.
    # Read Addresses
@@ -29,7 +93,21 @@ class MAX31865():
    MAX31865_CONFIG_AUTO        = 0x40
    MAX31865_CONFIG_BIAS_ON     = 0x80
 
-   def __init__(self, spi, cs_pin, wires=2):
+   # Fault Status Register
+   FAULT_HIGH_THRESHOLD = 0x80 # RTD above the high fault threshold
+   FAULT_LOW_THRESHOLD  = 0x40 # RTD below the low fault threshold
+   FAULT_REFIN_HIGH     = 0x20 # REFIN- > 0.85 x VBIAS
+   FAULT_REFIN_LOW      = 0x10 # REFIN- < 0.85 x VBIAS, FORCE- open
+   FAULT_RTDIN_LOW      = 0x08 # RTDIN- < 0.85 x VBIAS, FORCE- open
+   FAULT_VOLTAGE        = 0x04 # Over/under voltage
+
+   def __init__(self, spi, cs_pin, wires=2, drdy_pin=None):
+      '''
+      spi: SPI bus, mode 1 or 3, up to 5 MHz
+      cs_pin: Chip select pin
+      wires: 2, 3 or 4 wire RTD
+      drdy_pin: Pin connected to DRDY, optional
+      '''
       self.cs_pin = cs_pin
       self.cs_pin(True) # Set high immediately
       self.spi = spi
@@ -41,36 +119,88 @@ class MAX31865():
                 self.MAX31865_CONFIG_CLEAR_FAULT +
                 self.MAX31865_CONFIG_50HZ_FILTER)
       if (self.wires == 3):
-          config += MAX31865_CONFIG_3WIRE
+          config += self.MAX31865_CONFIG_3WIRE
+      self.config = config
+
+      # Preallocated transfer buffers: address byte then the data
+      self.config_buf = bytearray(2)
+      self.config_buf[0] = self.MAX31865_REG_WRITE_CONFIG
+      self.config_buf[1] = config
+      self.rtd_tx = bytearray(3)
+      self.rtd_tx[0] = self.MAX31865_REG_READ_RTD_MSB
+      self.rtd_rx = bytearray(3)
+      self.fault_tx = bytearray(2)
+      self.fault_tx[0] = self.MAX31865_REG_READ_FAULT
+      self.fault_rx = bytearray(2)
 
-      buf = bytearray(2)
-      buf[0] = self.MAX31865_REG_WRITE_CONFIG  # config write address
-      buf[1] = config
       self.cs_pin(False) # Select chip
-      _ = self.spi.send(buf) # write config
+      _ = self.spi.send(self.config_buf) # write config
       self.cs_pin(True)
 
       self.RefR = 400.0 # Ohms, this is R7 on the board
       self.R0  = 100.0 # Ohms, Using a PT100
 
-   def _RawToTemp(self, raw):
-      '''
-      In our temperature range the resistance is very linear.
-      Using the IEC 751 standard, alpha is 0.00385, y intercept = 100
-      '''
-      RTD = (raw * self.RefR) / (32768) # 32768=2^15
-      m = 0.385 # Ohms/degC
-      return (1/m) * (RTD - 100), RTD
+      self.table = cvd_table(self.RefR, self.R0)
 
-   def read(self):
-      raw = bytearray(2)
+      self.fault = 0 # Fault status register from the last read, 0 if none
+      self.faults = 0 # Number of reads with the fault bit set
+      self.milli = None # Last temperature read (milli deg C)
+      self.temperature = None # Last temperature read (deg C), to 0.1
+      self.ready = True # New conversion available
+      self.drdy_pin = drdy_pin
+      if drdy_pin is not None:
+         drdy_pin.irq(handler=self._drdy_irq, trigger=Pin.IRQ_FALLING)
+
+   def _drdy_irq(self, pin):
+      '''DRDY falls when a conversion completes, must not allocate'''
+      self.ready = True
+
+   def raw_to_milli(self, raw):
+      '''Temperature (milli deg C) of the 15 bit RTD code raw'''
+      i = raw >> TABLE_SHIFT
+      below = self.table[i]
+      return below + (((self.table[i + 1] - below) *
+                       (raw & ((1 << TABLE_SHIFT) - 1))) >> TABLE_SHIFT)
+
+   def _transfer(self, tx, rx):
       self.cs_pin(False) # Select chip
-      _ = self.spi.send(bytes([0x01])) # first read address
-      raw = self.spi.recv(2)           # multi-byte transfer
+      self.spi.send_recv(tx, rx)
       self.cs_pin(True)
 
-      raw_int = ustruct.unpack('>H', raw)[0]
-      raw_int >>= 1 # fifteen bit integer is sent
-      temp, RTD = self._RawToTemp(raw_int)
-      temp = float('%.1f'%temp)
-      return temp
+   def read_fault(self):
+      '''Read and clear the fault status register, returns it'''
+      self._transfer(self.fault_tx, self.fault_rx)
+      self.fault = self.fault_rx[1]
+      self.cs_pin(False)
+      _ = self.spi.send(self.config_buf) # Config includes clear fault
+      self.cs_pin(True)
+      return self.fault
+
+   def read_raw(self):
+      '''Read the 15 bit RTD code, checking the fault bit'''
+      self.ready = self.drdy_pin is None
+      self._transfer(self.rtd_tx, self.rtd_rx)
+      raw = (self.rtd_rx[1] << 8) | self.rtd_rx[2]
+      if raw & 1: # Fault bit
+         self.faults += 1
+         self.read_fault()
+      else:
+         self.fault = 0
+      return raw >> 1 # fifteen bit integer is sent
+
+   def read_milli(self):
+      '''
+      Temperature (milli deg C) as an int, also setting self.temperature.
+      With DRDY wired the chip is only read when a new conversion is ready,
+      otherwise the last value is returned.
+      '''
+      if self.ready or self.milli is None:
+         milli = self.raw_to_milli(self.read_raw())
+         self.milli = milli
+         self.temperature = ((milli + 50) // 100) / 10 # Rounded half up
+      return self.milli
+
+   def read(self):
+      '''Temperature (deg C) to 1 decimal place, see read_milli'''
+      self.read_milli()
+      return self.temperature
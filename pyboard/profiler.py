@@ -0,0 +1,190 @@
+'''
+Profiler for the control loop: where each tick's time goes on the board.
+
+ALTA times named sections of each tick with ticks_us: the two PTD reads and
+the LDR burst in read_inputs, formatting and putting the LCD row, csvify,
+writing the sample to the log (print and f.write for DirectLog), the PI
+controller, the LCD refresh, the SD card writes of BufferedLog, and whole
+ticks of the experiment loops and the melt. Each section keeps a count,
+total, min, max and a histogram of BUCKETS, in lists allocated up front, so
+timing a section doesn't allocate.
+
+Once per tick the free heap is sampled, automatic garbage collections are
+counted, and if less than LOW_HEAP is free the heap is collected between
+ticks and timed as the 'gc' section (MicroPython only).
+
+    profiler = Profiler()
+    alta = ALTA(..., profiler=profiler)
+
+At the REPL, during or after a repeat:
+
+    >>> alta.profiler.report()
+    >>> alta.profiler.stats('ptd')
+    {'count': 751, 'mean_us': 212, 'min_us': 204, 'max_us': 377, ...}
+
+The counters are cleared as each repeat starts, and the summary of each
+repeat is appended to profile.csv in its data directory, a line per section
+which ran:
+
+    repeat,section,count,total_us,min_us,max_us,<100,<250,...,>=50000
+
+and a heap line:
+
+    repeat,heap,ticks,min_free,max_free,collections
+
+Without a Profiler ALTA uses a disabled one, whose methods return at once.
+'''
+
+import gc
+import time
+
+SECTIONS = ('tick', 'melt', 'ptd', 'calibrate', 'ldr', 'screen_put',
+            'csvify', 'log', 'pi', 'lcd', 'sd', 'gc')
+(TICK, MELT, PTD, CALIBRATE, LDR, SCREEN_PUT,
+ CSVIFY, LOG, PI, LCD, SD, GC) = range(len(SECTIONS))
+BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000) # (us)
+
+
+class Profiler():
+    LOW_HEAP = 1024 * 8 # (bytes) Collect between ticks below this much free
+
+    def __init__(self, enabled=True, clock=None):
+        '''
+        enabled: False to time nothing
+        clock: Module with ticks_us and ticks_diff, time if not given
+        '''
+        self.enabled = enabled
+        self.clock = time if clock is None else clock
+        self.has_heap = hasattr(gc, 'mem_free') # MicroPython
+        n = len(SECTIONS)
+        self.count = [0] * n
+        self.total = [0] * n
+        self.min = [0] * n
+        self.max = [0] * n
+        self.histogram = [[0] * (len(BUCKETS) + 1) for _ in range(n)]
+        self.reset()
+
+    def reset(self):
+        '''Clear the counters, e.g. as a repeat starts'''
+        for i in range(len(SECTIONS)):
+            self.count[i] = 0
+            self.total[i] = 0
+            self.min[i] = 0
+            self.max[i] = 0
+            histogram = self.histogram[i]
+            for j in range(len(histogram)):
+                histogram[j] = 0
+        self.ticks = 0 # Heap samples
+        self.min_free = None
+        self.max_free = 0
+        self.collections = 0 # Automatic, found by the heap shrinking
+        self.last_alloc = None
+
+    def start(self):
+        '''Start timing a section, pass the result to stop or lap'''
+        if not self.enabled:
+            return 0
+        return self.clock.ticks_us()
+
+    def stop(self, section, start):
+        '''End timing section, started at start'''
+        if not self.enabled:
+            return
+        self.add(section, self.clock.ticks_diff(self.clock.ticks_us(), start))
+
+    def lap(self, section, start):
+        '''End timing section and start the next, returns its start'''
+        if not self.enabled:
+            return 0
+        now = self.clock.ticks_us()
+        self.add(section, self.clock.ticks_diff(now, start))
+        return now
+
+    def add(self, section, us):
+        count = self.count[section]
+        if count == 0 or us < self.min[section]:
+            self.min[section] = us
+        if us > self.max[section]:
+            self.max[section] = us
+        self.count[section] = count + 1
+        self.total[section] += us
+        bucket = 0
+        for edge in BUCKETS:
+            if us < edge:
+                break
+            bucket += 1
+        self.histogram[section][bucket] += 1
+
+    def heap(self):
+        '''
+        Sample the free heap after a tick's work, collecting it if it is
+        low, so collections happen here rather than inside the next tick
+        '''
+        if not self.enabled or not self.has_heap:
+            return
+        alloc = gc.mem_alloc()
+        if self.last_alloc is not None and alloc < self.last_alloc:
+            self.collections += 1
+        free = gc.mem_free()
+        if free < self.LOW_HEAP:
+            start = self.start()
+            gc.collect()
+            self.stop(GC, start)
+            free = gc.mem_free()
+        self.last_alloc = gc.mem_alloc()
+        self.ticks += 1
+        if self.min_free is None or free < self.min_free:
+            self.min_free = free
+        if free > self.max_free:
+            self.max_free = free
+
+    def stats(self, name):
+        '''Counters of the section called name, as a dict'''
+        i = SECTIONS.index(name)
+        count = self.count[i]
+        return {'count': count,
+                'mean_us': self.total[i] // count if count else 0,
+                'min_us': self.min[i],
+                'max_us': self.max[i],
+                'total_us': self.total[i],
+                'histogram': dict(zip(['<{}'.format(edge) for edge in BUCKETS]
+                                      + ['>={}'.format(BUCKETS[-1])],
+                                      self.histogram[i]))}
+
+    def report(self):
+        '''Print a table of the sections which ran, and the heap'''
+        print('{:<11}{:>6}{:>8}{:>7}{:>7}  histogram <{} ... >={} us'.format(
+            'section', 'count', 'mean', 'min', 'max', BUCKETS[0],
+            BUCKETS[-1]))
+        for i, name in enumerate(SECTIONS):
+            count = self.count[i]
+            if count:
+                print('{:<11}{:>6}{:>8}{:>7}{:>7}  {}'.format(
+                    name, count, self.total[i] // count, self.min[i],
+                    self.max[i], ' '.join(str(n) for n in self.histogram[i])))
+        if self.ticks:
+            print('heap free {}-{} bytes, {} automatic collections'.format(
+                self.min_free, self.max_free, self.collections))
+
+    def summary(self):
+        count = self.count[TICK]
+        mean = self.total[TICK] // count if count else 0
+        return 'profile tick mean {} max {} us, gc {} us, {} collections'\
+            .format(mean, self.max[TICK], self.total[GC], self.collections)
+
+    def save(self, filepath, repeat):
+        '''Append the counters to filepath/profile.csv'''
+        if not self.enabled:
+            return
+        with open(filepath + '/profile.csv', 'a') as f:
+            for i, name in enumerate(SECTIONS):
+                if self.count[i]:
+                    f.write('{},{},{},{},{},{},{}\n'.format(
+                        repeat, name, self.count[i], self.total[i],
+                        self.min[i], self.max[i],
+                        ','.join(str(n) for n in self.histogram[i])))
+            if self.ticks:
+                f.write('{},heap,{},{},{},{}\n'.format(
+                    repeat, self.ticks, self.min_free, self.max_free,
+                    self.collections))
+        print(self.summary())
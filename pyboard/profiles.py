@@ -0,0 +1,145 @@
+'''
+Temperature profiles: an experiment repeat written as a list of segments,
+compiled ahead of time and run by one shared control loop
+(ALTA.profile_steps).
+
+A profile is a program of setpoints against time from the start of the
+repeat, like a furnace controller's. The segments are:
+
+    cool(T, overshoot=0)   Full power until the block reaches T (overshoot
+                           past it, or as the block model predicts with
+                           model_approach), then on to the program
+    hold(T, ms)            PI control at T for ms
+    ramp(rate, to)         PI control along a ramp of rate deg C/min from the
+                           last temperature of the program, until it is at to
+    wait_for_freeze()      A freeze before this is an 'early' outcome
+    melt()                 Melt the sample once the outcome is recorded, last
+
+Holds and ramps take time in the program, cools take none: the block catches
+up at full power while the program runs, so a slow cool eats into the next
+segment rather than delaying everything after it. A freeze ends the repeat
+in any segment, and the repeat is 'liquid' when the program runs out.
+
+    profile = Profile([cool(-10), wait_for_freeze(), hold(-10, 60000),
+                       ramp(-0.5, -20), hold(-20, 120000), melt()])
+    alta.run(alta.profile_steps('data/', profile, repeat=1))
+    alta.run(alta.campaign_steps('profile', 'data/', profile.segments))
+
+Segments are plain lists, so a profile can be saved as JSON (see
+checkpoint.py), and their optional values can be left off, e.g.
+[["cool", -15], ["hold", -15, 60000], ["melt"]].
+
+Compiling turns the segments into one row each on the tick timeline:
+(kind, first tick, end tick, setpoint at the first tick, change per tick,
+status, overshoot), which the loop walks through in order. A slow ramp spans
+tens of thousands of ticks, so a setpoint per tick wouldn't fit in the
+pyBoard's RAM; a ramp's setpoint is its start plus its change per tick times
+the ticks into it.
+'''
+
+COOL = 'cool'
+HOLD = 'hold'
+RAMP = 'ramp'
+WAIT = 'wait'
+MELT = 'melt'
+MS_PER_MIN = 1000 * 60
+
+
+def cool(T, overshoot=0, status='Cool'):
+    return [COOL, T, overshoot, status]
+
+
+def hold(T, ms, status='Hold'):
+    return [HOLD, T, ms, status]
+
+
+def ramp(rate, to, status='Ramp'):
+    return [RAMP, rate, to, status]
+
+
+def wait_for_freeze():
+    return [WAIT]
+
+
+def melt():
+    return [MELT]
+
+
+SEGMENTS = {COOL: cool, HOLD: hold, RAMP: ramp, WAIT: wait_for_freeze,
+            MELT: melt}
+
+
+class Profile():
+    def __init__(self, segments, mode='profile', setpoint=None, title='Profile',
+                 result='T', file_setpoint=None, delay_ms=200):
+        '''
+        segments: List of the segments above
+        mode: Experiment name for the repeat files, telemetry and checkpoint
+        setpoint: Number for mode, the coldest temperature if None
+        title: Shown on the LCD as each repeat starts
+        result: Value of a frozen repeat, 't' the time (ms) or 'T' the block
+            temperature
+        file_setpoint: setpoint as written in the repeat files, if different
+        delay_ms: Tick period (ms)
+        '''
+        self.segments = segments
+        self.mode = mode
+        self.title = title
+        self.result = result
+        self.delay_ms = delay_ms
+        self.compile()
+        if setpoint is None:
+            setpoint = self.coldest
+        self.setpoint = setpoint
+        self.file_setpoint = setpoint if file_setpoint is None else \
+                             file_setpoint
+
+    def compile(self):
+        '''
+        Build self.rows from the segments, and self.end, the tick the
+        program runs out
+        '''
+        rows = []
+        tick = 0
+        T = None # Temperature the program is at
+        coldest = None
+        self.watch = 0 # Row from which a freeze is the outcome
+        self.melt = False
+        for segment in self.segments:
+            kind = segment[0]
+            if kind not in SEGMENTS:
+                raise ValueError('segment {}'.format(segment))
+            segment = SEGMENTS[kind](*segment[1:]) # Fill in the defaults
+            if self.melt:
+                raise ValueError('melt must be the last segment')
+            if kind == COOL:
+                T = segment[1]
+                rows.append((COOL, tick, tick, T, 0, segment[3], segment[2]))
+            elif kind == HOLD:
+                T = segment[1]
+                end = tick + int(segment[2] // self.delay_ms)
+                rows.append((HOLD, tick, end, T, 0, segment[3], 0))
+                tick = end
+            elif kind == RAMP:
+                rate, to = segment[1], segment[2]
+                if T is None or rate == 0 or (to - T) * rate < 0:
+                    raise ValueError('ramp {} to {} from {}'.format(rate, to,
+                                                                    T))
+                step = rate * self.delay_ms / MS_PER_MIN # deg C per tick
+                end = tick + int(round((to - T) / step))
+                rows.append((RAMP, tick, end, T, step, segment[3], 0))
+                T = to
+                tick = end
+            elif kind == WAIT:
+                self.watch = len(rows)
+                continue
+            else: # MELT
+                self.melt = True
+                continue
+            if coldest is None or T < coldest:
+                coldest = T
+        if not rows:
+            raise ValueError('no segments to run')
+        self.rows = rows
+        self.end = tick
+        self.coldest = coldest
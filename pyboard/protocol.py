@@ -0,0 +1,356 @@
+'''
+Request/response commands over the USB serial port, for running ALTA
+headless and pulling its data off in bulk (see ALTA_cli.py on the host).
+
+serve() runs the control loop itself: each tick steps the experiment, if one
+is running, then answers requests until the next tick is due. Each request is
+one line, each response one line, "OK <json>" or "ERR <message>", followed
+for some by lines or raw bytes. Anything else ALTA prints on the port (repeat
+file names, summaries) is on lines of its own, which the host skips.
+
+    status                       State, experiment, repeat and temperature
+    start MODE SETPOINT [N] [DIR] Run N repeats (default until one goes
+                                 wrong) of isothermal or linear into DIR
+    stop                         Switch off and end the experiment now
+    pause                        Wait after the current repeat
+    resume                       Carry on with the next repeat
+    ls [DIR [START [COUNT]]]     OK {"dir": d, "start": s, "files": n,
+                                 "bytes": b, "total": t}, then n lines
+                                 "name,size": COUNT (at most LS_PAGE) of the
+                                 t files in name order, from the START-th
+    chunk OFFSET LENGTH          Bytes of the files listed since the last
+                                 ls from 0, as if joined in the listed order
+    get PATH OFFSET LENGTH       Bytes of one file
+    exit                         Return from serve() to the REPL
+
+Stat'ing a file on FAT searches the directory, so thousands of them would
+hold up the control loop for many ticks. ls from 0 reads the names afresh,
+and each request stats only the page it lists: the host lists a large
+directory page by page, then pulls it.
+
+chunk and get answer OK {"offset": o, "length": n, "size": total, "crc":
+crc32} followed by the n bytes (at most CHUNK_MAX). Joining the files lets
+the host pull a campaign of thousands of small files in a few large
+requests, check each one, and resume from any offset.
+
+A reply never holds up the control loop for long: if the host stops reading
+(cable pulled, CLI killed) the port is waited for at most SEND_WAIT_MS per
+request, then the rest of the reply is dropped and the loop carries on. The
+host sees a short answer, times out and asks again.
+
+    server = CommandServer(alta, pyb.USB_VCP(), 'data/')
+    server.serve()
+
+Use BufferedLog (ALTA(..., buffered_log=True)), which doesn't print every
+sample, and don't send binary telemetry (telemetry.py) on the same port.
+'''
+
+import json
+import os
+import select
+import time
+from binascii import crc32
+
+import pyb
+
+
+class CommandServer():
+    CHUNK_MAX = 4096 # (bytes) Largest chunk or get response
+    LS_PAGE = 64 # Most files listed, and stat'ed, per ls request
+    LINE_MAX = 128 # (bytes) Longest request line
+    EXCLUDE = ('running.csv',) # Still being written, not listed
+    SEND_WAIT_MS = 600 # (ms) Longest wait for the port per request, 3 ticks
+
+    def __init__(self, alta, stream, root='data/'):
+        '''
+        alta: ALTA instance to run experiments on
+        stream: Port for requests and responses, e.g. pyb.USB_VCP()
+        root: Default directory for experiments and ls
+        '''
+        self.alta = alta
+        self.stream = stream
+        self.root = root
+        self.buf = bytearray(self.CHUNK_MAX)
+        self.mv = memoryview(self.buf)
+        self.line = bytearray()
+        self.poll_in = select.poll()
+        self.poll_in.register(stream, select.POLLIN)
+        self.poll_out = select.poll()
+        self.poll_out.register(stream, select.POLLOUT)
+
+        self.steps = None # Generator of the running experiment
+        self.experiment = None # (mode, setpoint, directory)
+        self.repeats = None # Repeats asked for, None to run until one fails
+        self.serving = False
+        self.wait_ms = self.SEND_WAIT_MS # Left for the current request
+        self.dropped = 0 # Replies cut short because the host stopped reading
+
+        self.listed = None # Directory of the last ls
+        self.names = [] # Its files
+        self.starts = [0] # Offset of each file in the joined files, and end
+        self.file = None # Open file of the last chunk, and its index
+        self.file_index = None
+
+    def serve(self):
+        '''Run experiments and answer requests until an exit request'''
+        ticker = self.alta.ticker
+        ticker.reset()
+        self.serving = True
+        while self.serving:
+            self.step()
+            while not ticker.pending and self.serving:
+                if not self.service():
+                    pyb.wfi() # Until the next tick or USB interrupt
+            ticker.consume()
+        self.stop()
+        self.close_file()
+
+    def step(self):
+        '''One tick of the experiment, if one is running'''
+        if self.steps is None:
+            self.alta.service()
+            return
+        try:
+            next(self.steps)
+        except StopIteration:
+            self.steps = None
+            self.alta.switch_off()
+
+    def service(self):
+        '''Read what has arrived, answer if it completes a request'''
+        while self.poll_in.poll(0):
+            c = self.stream.read(1)
+            if not c:
+                break
+            if c == b'\n':
+                line = bytes(self.line).decode().strip()
+                self.line = bytearray()
+                self.handle(line)
+                return True
+            if len(self.line) < self.LINE_MAX:
+                self.line += c
+        return False
+
+    def send(self, data):
+        '''
+        Write data, waiting for the port while the request has some of
+        SEND_WAIT_MS left. Returns False if it, or an earlier part of the
+        reply, was dropped
+        '''
+        mv = memoryview(data)
+        while len(mv) and self.wait_ms > 0:
+            n = self.stream.write(mv)
+            if n:
+                mv = mv[n:]
+                continue
+            start = time.ticks_ms()
+            self.poll_out.poll(min(self.wait_ms, 100))
+            self.wait_ms -= max(1, time.ticks_diff(time.ticks_ms(), start))
+            if self.wait_ms <= 0:
+                self.dropped += 1 # The rest of the reply too
+        return not len(mv)
+
+    def ok(self, reply=None):
+        self.send(('OK ' + json.dumps(reply or {}) + '\n').encode())
+
+    def error(self, message):
+        self.send('ERR {}\n'.format(message).encode())
+
+    def handle(self, line):
+        words = line.split()
+        if not words:
+            return
+        self.wait_ms = self.SEND_WAIT_MS
+        handler = getattr(self, 'do_' + words[0], None)
+        if handler is None:
+            self.error('unknown command {}'.format(words[0]))
+            return
+        try:
+            handler(*words[1:])
+        except (OSError, ValueError, TypeError) as e:
+            self.error('{} {}'.format(words[0], e))
+
+    def directory(self, path=None):
+        return (path or self.root).rstrip('/')
+
+    def recover(self):
+        '''
+        Carry on a campaign cut short by a reset, if ALTA has a checkpoint
+        of one (checkpoint.py). Call before serve()
+        '''
+        steps = self.alta.resume_steps()
+        if steps is not None:
+            state = self.alta.checkpoint.load()
+            self.experiment = (state['mode'], state['setpoint'],
+                               state['filepath'])
+            self.steps = steps
+
+    def state(self):
+        if self.steps is None:
+            return 'idle'
+        if self.alta.paused:
+            return 'paused' if self.alta.waiting else 'pausing'
+        return 'running'
+
+    def do_status(self):
+        mode, setpoint, filepath = self.experiment or (None, None, None)
+        self.ok({'state': self.state(),
+                 'mode': mode,
+                 'setpoint': setpoint,
+                 'dir': filepath,
+                 'repeat': self.alta.repeat,
+                 'done': self.alta.done,
+                 'repeats': self.repeats,
+                 'T': self.alta.ptd.read(),
+                 'ticker': self.alta.ticker.summary(),
+                 'dropped': self.dropped})
+
+    def do_start(self, mode, setpoint, repeats=None, path=None):
+        if self.steps is not None:
+            self.error('start {} is {}'.format(self.experiment[0],
+                                               self.state()))
+            return
+        if mode not in ('isothermal', 'linear'):
+            self.error('start mode {}'.format(mode))
+            return
+        setpoint = float(setpoint)
+        self.repeats = None if repeats in (None, '0') else int(repeats)
+        filepath = self.directory(path)
+        try:
+            os.mkdir(filepath)
+        except OSError: # Already there
+            pass
+        self.experiment = (mode, setpoint, filepath)
+        self.alta.paused = False
+        last = None
+        if self.repeats is not None:
+            last = self.alta.get_repeat_number(filepath) + self.repeats
+        self.steps = self.alta.campaign_steps(mode, filepath, setpoint, last)
+        self.ok({'state': 'running', 'dir': filepath})
+
+    def stop(self):
+        if self.steps is not None:
+            self.steps.close() # Ends the repeat, closing running.csv
+            self.steps = None
+        self.alta.switch_off()
+        self.alta.paused = False
+
+    def do_stop(self):
+        self.stop()
+        self.alta.screen_put('Stopped', 1)
+        self.ok({'state': 'idle', 'done': self.alta.done})
+
+    def do_pause(self):
+        if self.steps is None:
+            self.error('pause nothing running')
+            return
+        self.alta.paused = True
+        self.ok({'state': self.state()})
+
+    def do_resume(self):
+        self.alta.paused = False
+        self.ok({'state': self.state()})
+
+    def do_exit(self):
+        self.ok()
+        self.serving = False
+
+    def do_ls(self, path=None, start='0', count=None):
+        '''
+        List a page of a directory, and keep the listing for chunk. From 0
+        the names are read afresh; later pages must follow on from those
+        listed, or repeat them
+        '''
+        path = self.directory(path)
+        start = int(start)
+        count = self.LS_PAGE if count is None else \
+            max(0, min(int(count), self.LS_PAGE))
+        if start == 0:
+            self.close_file()
+            self.listed = path
+            self.names = sorted(name for name in os.listdir(path)
+                                if name not in self.EXCLUDE)
+            self.starts = [0]
+        elif path != self.listed or not 0 < start < len(self.starts):
+            self.error('ls {} from {}, {} listed'.format(
+                path, start, len(self.starts) - 1 if path == self.listed
+                else 0))
+            return
+        end = min(start + count, len(self.names))
+        for name in self.names[len(self.starts) - 1:end]:
+            self.starts.append(self.starts[-1] + os.stat(path + '/' + name)[6])
+        starts = self.starts
+        self.ok({'dir': path, 'start': start, 'files': end - start,
+                 'bytes': starts[end] - starts[start],
+                 'total': len(self.names)})
+        for i in range(start, end):
+            self.send('{},{}\n'.format(self.names[i],
+                                       starts[i + 1] - starts[i]).encode())
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+        self.file_index = None
+
+    def open_file(self, i):
+        '''Open the i-th listed file, keeping it open for the next chunk'''
+        if self.file_index != i:
+            self.close_file()
+            self.file = open(self.listed + '/' + self.names[i], 'rb')
+            self.file_index = i
+        return self.file
+
+    def find(self, offset):
+        '''Index of the listed file containing offset, by bisection'''
+        starts = self.starts
+        low, high = 0, len(starts) - 1
+        while high - low > 1:
+            middle = (low + high) // 2
+            if starts[middle] <= offset:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def send_chunk(self, offset, length, size):
+        '''Reply to chunk or get with the length bytes now in buf'''
+        data = self.mv[:length]
+        self.ok({'offset': offset, 'length': length, 'size': size,
+                 'crc': crc32(data)})
+        self.send(data)
+
+    def do_chunk(self, offset, length):
+        if self.listed is None:
+            self.error('chunk before ls')
+            return
+        offset = int(offset)
+        end = min(offset + min(int(length), self.CHUNK_MAX), self.starts[-1])
+        if offset < 0 or offset > end:
+            self.error('chunk offset {} past the end'.format(offset))
+            return
+        filled = 0
+        position = offset
+        i = self.find(offset)
+        while position < end:
+            while self.starts[i + 1] <= position: # Skip empty files
+                i += 1
+            f = self.open_file(i)
+            f.seek(position - self.starts[i])
+            n = min(end, self.starts[i + 1]) - position
+            if f.readinto(self.mv[filled:filled + n]) != n:
+                self.close_file()
+                self.error('chunk {} changed since ls'.format(self.names[i]))
+                return
+            filled += n
+            position += n
+        self.send_chunk(offset, filled, self.starts[-1])
+
+    def do_get(self, path, offset, length):
+        offset = int(offset)
+        length = min(int(length), self.CHUNK_MAX)
+        size = os.stat(path)[6]
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            n = f.readinto(self.mv[:length]) or 0
+        self.send_chunk(offset, n, size)
@@ -0,0 +1,106 @@
+'''
+Feed-forward PWM calibration: the PWM which holds the block at a temperature.
+
+ALTA starts the PI hold from target_pwm(limit), so the closer that is to the
+PWM the block actually needs, the less the integral term has to wind up in
+every repeat. calibrate() steps the cooling PWM through LEVELS, waits at each
+for the block temperature to settle, and records it. The readings are then
+resampled onto a uniform temperature grid, so ALTA.target_pwm is an O(1)
+lookup, and saved in the config file:
+
+    PwmCalibration(alta).calibrate('alta.json')
+
+The table replaces PWM_FIT_COEFFS when ALTA(settings=...) loads it. Rerun it
+when the heat sinks, fans, Peltiers or room change.
+'''
+
+import config
+
+
+def build_table(points, step):
+    '''
+    Resample (pwm, T) steady state points onto a grid of temperatures step
+    apart. Returns {'T0': coldest T, 'step': step, 'pwm': [pwm at each]}
+    '''
+    points = sorted(points) # Increasing PWM, so falling T
+    monotonic = [points[0]]
+    for pwm, T in points[1:]:
+        if T < monotonic[-1][1]: # Past the most cooling, Joule heating wins
+            monotonic.append((pwm, T))
+    by_T = [(T, pwm) for pwm, T in monotonic[::-1]] # Increasing T
+    T0 = by_T[0][0]
+    n = int((by_T[-1][0] - T0) / step) + 1
+    pwm = []
+    j = 0
+    for i in range(n):
+        T = T0 + i * step
+        while j < len(by_T) - 2 and by_T[j + 1][0] < T:
+            j += 1
+        (T_a, pwm_a), (T_b, pwm_b) = by_T[j], by_T[min(j + 1, len(by_T) - 1)]
+        x = (T - T_a) / (T_b - T_a) if T_b != T_a else 0
+        pwm.append(round(pwm_a + x * (pwm_b - pwm_a), 2))
+    return {'T0': T0, 'step': step, 'pwm': pwm}
+
+
+class PwmCalibration():
+    LEVELS = (0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100) # (%) Cooling PWM
+    STEADY_WINDOW = 1000 * 30 # (ms) Compare temperatures this far apart
+    STEADY_BAND = 0.05 # (deg C) Steady if it changed less than this
+    STEADY_WINDOWS = 2 # for this many windows in a row
+    LEVEL_MAX_TIME = 1000 * 60 * 10 # (ms) Take the reading after this anyway
+    GRID_STEP = 0.5 # (deg C) Spacing of the lookup table
+
+    def __init__(self, alta):
+        self.alta = alta
+        self.points = [] # (pwm, steady state T)
+
+    def level_steps(self, pwm, timer):
+        '''Hold pwm until the block is steady, then record the temperature'''
+        alta = self.alta
+        alta.set_pwm(pwm)
+        t = next(timer)
+        start = t
+        last_t = t
+        last_T = alta.ptd.read()
+        steady = 0
+        while True:
+            t = next(timer)
+            T = alta.ptd.read()
+            alta.screen_put('PWM {:3d} {:5.1f}'.format(pwm, T), 1)
+            if t - last_t >= self.STEADY_WINDOW:
+                if abs(T - last_T) < self.STEADY_BAND:
+                    steady += 1
+                    if steady >= self.STEADY_WINDOWS:
+                        break
+                else:
+                    steady = 0
+                last_t = t
+                last_T = T
+            if t - start >= self.LEVEL_MAX_TIME:
+                print('pwm {}: not steady after {} s'.format(
+                    pwm, (t - start) // 1000))
+                break
+            alta.service()
+            yield
+        print('pwm {}: {} deg C'.format(pwm, T))
+        self.points.append((pwm, T))
+
+    def calibrate_steps(self, config_path=None):
+        '''Step through LEVELS and save the table to config_path'''
+        alta = self.alta
+        alta.screen_put('PWM calibration')
+        alta.relay_cool()
+        timer = alta.timer()
+        for pwm in self.LEVELS:
+            yield from self.level_steps(pwm, timer)
+        alta.switch_off()
+
+        alta.pwm_table = build_table(self.points, self.GRID_STEP)
+        if config_path is not None:
+            config.update(config_path, pwm=alta.pwm_table)
+        alta.outcome = True
+
+    def calibrate(self, config_path=None):
+        '''Blocking calibrate_steps, returns the table'''
+        self.alta.run(self.calibrate_steps(config_path))
+        return self.alta.pwm_table
@@ -33,6 +33,12 @@ class I2cLcd(LcdApi):
         # Put LCD into 4 bit mode
         self.hal_write_init_nibble(self.LCD_FUNCTION)
         delay(1)
+        # Room for a whole screen, with a cursor move for each line, at four
+        # PCF8574 writes per byte
+        self.buf = bytearray(4 * (num_columns + 1) * num_lines)
+        self.buf_mv = memoryview(self.buf)
+        self.row_mv = self.buf_mv[:4 * (num_columns + 1)] # As write_row sends
+        self.byte_buf = bytearray(4) # A single command or character
         LcdApi.__init__(self, num_lines, num_columns)
         cmd = self.LCD_FUNCTION
         if num_lines > 1:
@@ -57,16 +63,11 @@ class I2cLcd(LcdApi):
 
     def hal_write_command(self, cmd):
         """Writes a command to the LCD.
-        Data is latched on the falling edge of E.
+        Data is latched on the falling edge of E. All four edges are sent
+        in one I2C transaction.
         """
-        byte = ((self.backlight << SHIFT_BACKLIGHT) |
-                (((cmd >> 4) & 0x0f) << SHIFT_DATA))
-        self.i2c.send(byte | MASK_E, self.i2c_addr)
-        self.i2c.send(byte, self.i2c_addr)
-        byte = ((self.backlight << SHIFT_BACKLIGHT) |
-                ((cmd & 0x0f) << SHIFT_DATA))
-        self.i2c.send(byte | MASK_E, self.i2c_addr, )
-        self.i2c.send(byte, self.i2c_addr)
+        self.encode(self.byte_buf, 0, cmd, 0)
+        self.i2c.send(self.byte_buf, self.i2c_addr)
         if cmd <= 3:
             # The home and clear commands require a worst
             # case delay of 4.1 msec
@@ -74,13 +75,74 @@ class I2cLcd(LcdApi):
 
     def hal_write_data(self, data):
         """Write data to the LCD."""
-        byte = (MASK_RS |
+        self.encode(self.byte_buf, 0, data)
+        self.i2c.send(self.byte_buf, self.i2c_addr)
+
+    def encode(self, buf, i, value, rs=MASK_RS):
+        """Encodes a data (or with rs=0, command) byte into buf at i as the
+        four PCF8574 writes which clock it into the LCD. Returns the next
+        index into buf.
+        """
+        byte = (rs |
                 (self.backlight << SHIFT_BACKLIGHT) |
-                (((data >> 4) & 0x0f) << SHIFT_DATA))
-        self.i2c.send(byte | MASK_E, self.i2c_addr)
-        self.i2c.send(byte, self.i2c_addr)
-        byte = (MASK_RS |
+                (((value >> 4) & 0x0f) << SHIFT_DATA))
+        buf[i] = byte | MASK_E
+        buf[i + 1] = byte
+        byte = (rs |
                 (self.backlight << SHIFT_BACKLIGHT) |
-                ((data & 0x0f) << SHIFT_DATA))
-        self.i2c.send(byte | MASK_E, self.i2c_addr)
-        self.i2c.send(byte, self.i2c_addr)
+                ((value & 0x0f) << SHIFT_DATA))
+        buf[i + 2] = byte | MASK_E
+        buf[i + 3] = byte
+        return i + 4
+
+    def ddram_addr(self, cursor_x, cursor_y):
+        """Returns the DDRAM address of a cursor position, as move_to."""
+        addr = cursor_x & 0x3f
+        if cursor_y & 1:
+            addr += 0x40    # Lines 1 & 3 add 0x40
+        if cursor_y & 2:
+            addr += 0x14    # Lines 2 & 3 add 0x14
+        return addr
+
+    def putstr(self, string):
+        """Write the indicated string to the LCD at the current cursor
+        position and advances the cursor position appropriately.
+        The whole string is sent as one I2C transaction, rather than four
+        per character. Accepts str, bytes or bytearray.
+        """
+        if isinstance(string, str):
+            string = string.encode()
+        buf = self.buf
+        i = 0
+        for char in string:
+            if i + 8 > len(buf):
+                self.i2c.send(self.buf_mv[:i], self.i2c_addr)
+                i = 0
+            if char != 0x0a:    # Newline
+                i = self.encode(buf, i, char)
+                self.cursor_x += 1
+            if self.cursor_x >= self.num_columns or char == 0x0a:
+                self.cursor_x = 0
+                self.cursor_y += 1
+                if self.cursor_y >= self.num_lines:
+                    self.cursor_y = 0
+                i = self.encode(buf, i,
+                                self.LCD_DDRAM |
+                                self.ddram_addr(self.cursor_x, self.cursor_y),
+                                0)
+        if i:
+            self.i2c.send(self.buf_mv[:i], self.i2c_addr)
+
+    def write_row(self, row, string):
+        """Replace a whole row with string, padded or truncated to fit, in
+        one I2C transaction. Leaves the cursor after the end of the row.
+        """
+        if isinstance(string, str):
+            string = string.encode()
+        buf = self.buf
+        i = self.encode(buf, 0, self.LCD_DDRAM | self.ddram_addr(0, row), 0)
+        for x in range(self.num_columns):
+            i = self.encode(buf, i, string[x] if x < len(string) else 0x20)
+        self.i2c.send(self.row_mv, self.i2c_addr)
+        self.cursor_x = self.num_columns
+        self.cursor_y = row
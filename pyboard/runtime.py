@@ -0,0 +1,275 @@
+'''
+uasyncio runtime for ALTA: control, display, logging, telemetry and commands
+as separate tasks.
+
+Run by itself, each experiment does its own LCD refresh and SD writes after
+the control work of every tick, so a slow peripheral delays the next reading.
+Here each job is a task:
+- control: Woken by the Ticker interrupt, reads the sensors and sets the
+outputs (one step of an ALTA generator, e.g. alta.isothermal_campaign). It
+never waits on the other tasks, it only puts onto their queues.
+- display: Refreshes the LCD from the framebuffer once a second.
+- logging: Writes buffered run data to the SD card a block at a time.
+- telemetry: Writes each sample to the USB serial port, a short piece at a
+time and only while the port can take it, as TelemetryLink does. A line the
+port hasn't taken within WRITE_WAIT_MS (the host stopped reading) is dropped.
+- command: Reads command lines from the USB serial port.
+
+uasyncio has no task priorities, so the control task gets them by the others
+doing only a short piece of work each time they run, and the logging task
+leaving the card alone while a tick is due. Under backpressure the other
+tasks degrade rather than the control loop: the LCD updates less often, the
+log buffer drops samples, and the telemetry queue drops the oldest ones.
+
+    runtime = Runtime(alta)
+    runtime.run(alta.isothermal_campaign('data/', -15))
+
+Commands, one per line:
+    stop   Switch off and end the experiment
+    status Send the loop timing and queue statistics as telemetry
+'''
+
+import select
+import sys
+
+from linebuf import LineBuffer
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    ThreadSafeFlag = asyncio.ThreadSafeFlag
+except AttributeError: # CPython, the simulated interrupts run on the loop
+    class ThreadSafeFlag(asyncio.Event):
+        async def wait(self):
+            await asyncio.Event.wait(self)
+            self.clear()
+
+
+async def sleep_ms(ms):
+    if hasattr(asyncio, 'sleep_ms'):
+        await asyncio.sleep_ms(ms)
+    else:
+        await asyncio.sleep(ms / 1000)
+
+
+class BoundedQueue():
+    '''
+    FIFO holding at most size items. put() never blocks: when full the oldest
+    item is dropped and counted, so a slow consumer can't stall the producer.
+    The items are kept in a ring allocated once.
+    With line_size, put_from() queues copies of lines in LineBuffers of that
+    size, also allocated once, so queueing a sample allocates nothing
+    '''
+    def __init__(self, size, line_size=0):
+        self.size = size
+        self.items = [None] * size
+        self.head = 0 # Index of the oldest item
+        self.count = 0
+        self.dropped = 0
+        self.event = asyncio.Event()
+        # One more than the items, for the line just taken off
+        self.lines = [LineBuffer(line_size) for _ in range(size + 1)] \
+            if line_size else None
+        self.next_line = 0
+
+    def put(self, item):
+        if self.count == self.size:
+            self.head = (self.head + 1) % self.size
+            self.count -= 1
+            self.dropped += 1
+        self.items[(self.head + self.count) % self.size] = item
+        self.count += 1
+        self.event.set()
+
+    def put_from(self, data, n):
+        '''
+        Queue a copy of the first n bytes of data, e.g. a LineBuffer's, byte
+        by byte into the next of lines. A line taken off the queue is only
+        valid until the next put_from
+        '''
+        line = self.lines[self.next_line]
+        self.next_line = (self.next_line + 1) % (self.size + 1)
+        buf = line.buf
+        for i in range(n):
+            buf[i] = data[i]
+        line.n = n
+        self.put(line)
+
+    def get_nowait(self):
+        '''Oldest item, or None if empty'''
+        if not self.count:
+            return None
+        item = self.items[self.head]
+        self.items[self.head] = None
+        self.head = (self.head + 1) % self.size
+        self.count -= 1
+        return item
+
+    async def get(self):
+        while not self.count:
+            self.event.clear()
+            await self.event.wait()
+        return self.get_nowait()
+
+
+class Runtime():
+    TELEMETRY_SIZE = 50 # Samples queued for USB, 10 s at 200 ms
+    COMMAND_SIZE = 4 # Command lines queued for the control task
+    WRITE_MAX = 32 # (chars) Written at once, well inside the USB buffer
+    WRITE_WAIT_MS = 1000 # (ms) Longest a line waits for the port
+    WRITE_POLL_MS = 20 # (ms) Between looks at a full port
+
+    def __init__(self, alta, reader=None, writer=None):
+        '''
+        alta: ALTA instance, preferably made with buffered_log=True
+        reader: Stream of command lines, the USB serial port if None
+        writer: Stream for telemetry, the USB serial port if None
+        '''
+        self.alta = alta
+        self.ticker = alta.ticker
+        if reader is None:
+            reader = asyncio.StreamReader(sys.stdin)
+        self.reader = reader
+        if writer is None:
+            writer = sys.stdout
+        self.writer = writer
+        self.poller = None
+        if hasattr(writer, 'fileno') or hasattr(writer, 'ioctl'):
+            try:
+                self.poller = select.poll()
+                self.poller.register(writer, select.POLLOUT)
+            except (OSError, ValueError): # Not pollable, e.g. io.StringIO
+                self.poller = None
+        self.lines_dropped = 0 # Telemetry lines the port wouldn't take
+        self.telemetry = BoundedQueue(self.TELEMETRY_SIZE,
+                                      len(alta.line.buf) if alta.zero_alloc
+                                      else 0)
+        self.commands = BoundedQueue(self.COMMAND_SIZE)
+        self.running = False
+
+    async def control(self, steps):
+        '''Step the experiment once per tick'''
+        flag = ThreadSafeFlag()
+        self.ticker.flag = flag
+        self.ticker.reset()
+        try:
+            for _ in steps:
+                while not self.ticker.pending:
+                    await flag.wait()
+                self.ticker.consume()
+                command = self.commands.get_nowait()
+                if command is not None and not self.command(command):
+                    steps.close()
+                    break
+        finally:
+            self.ticker.flag = None
+            self.alta.switch_off()
+            self.running = False
+
+    def command(self, line):
+        '''Act on a command line, returns False to stop'''
+        words = line.split()
+        if not words:
+            return True
+        if words[0] == 'stop':
+            self.alta.screen_put('Stopped', 1)
+            return False
+        if words[0] == 'status':
+            self.telemetry.put('# {}\n# {}\n'.format(self.ticker.summary(),
+                                                   self.summary()))
+        else:
+            self.telemetry.put('# unknown command {}\n'.format(words[0]))
+        return True
+
+    async def display(self):
+        screen = self.alta.screen
+        while self.running:
+            screen.refresh()
+            await sleep_ms(screen.refresh_ms)
+
+    async def logging(self):
+        log = self.alta.log
+        period = self.ticker.period_ms
+        link = self.alta.link
+        while self.running:
+            log.service() # One block at most, not while a tick is due
+            if link is not None:
+                link.service() # Never blocks
+            await sleep_ms(period // 4)
+
+    async def send_telemetry(self):
+        while self.running:
+            line = await self.telemetry.get()
+            if isinstance(line, LineBuffer): # Copied from the sample's
+                line = bytes(line.buf[:line.n]).decode()
+            await self.write(line)
+
+    def writable(self):
+        if self.poller is None:
+            return True
+        return bool(self.poller.poll(0))
+
+    async def write(self, line):
+        '''
+        Write line a piece at a time while the port can take it, never
+        blocking the loop. Dropped if the port takes nothing for WRITE_WAIT_MS
+        '''
+        waited_ms = 0
+        while line:
+            written = None
+            if self.writable():
+                try:
+                    written = self.writer.write(line[:self.WRITE_MAX])
+                except OSError: # Would block, or the host went away
+                    written = None
+            if written:
+                line = line[written:]
+                waited_ms = 0
+                await sleep_ms(0) # Let the control task in between pieces
+            elif waited_ms >= self.WRITE_WAIT_MS:
+                self.lines_dropped += 1
+                return
+            else:
+                await sleep_ms(self.WRITE_POLL_MS)
+                waited_ms += self.WRITE_POLL_MS
+
+    async def read_commands(self):
+        while self.running:
+            line = await self.reader.readline()
+            if not line:
+                break
+            if isinstance(line, bytes):
+                line = line.decode()
+            self.commands.put(line)
+
+    async def main(self, steps):
+        self.running = True
+        self.alta.background_io = True
+        self.alta.telemetry = self.telemetry
+        tasks = [asyncio.create_task(task) for task in (self.display(),
+                                                        self.logging(),
+                                                        self.send_telemetry(),
+                                                        self.read_commands())]
+        try:
+            await self.control(steps)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.alta.background_io = False
+            self.alta.telemetry = None
+            self.alta.screen.refresh(force=True)
+        print(self.ticker.summary())
+        print(self.summary())
+
+    def run(self, steps):
+        '''Run the steps (e.g. alta.isothermal_campaign(...)) until done'''
+        asyncio.run(self.main(steps))
+
+    def summary(self):
+        return '{} telemetry dropped {} commands dropped {}'.format(
+            self.alta.log.summary(),
+            self.telemetry.dropped + self.lines_dropped,
+            self.commands.dropped)
@@ -0,0 +1,161 @@
+'''
+Adaptive isothermal campaigns over several temperatures, run until the
+nucleation rate at each is known to a target precision.
+
+At each setpoint the nucleation rate is estimated as ALTA_stats.py does: k is
+the freezes divided by the total time held liquid (repeats which froze during
+the cool are 'early', and count only as repeats). Its confidence interval
+depends on the number of freezes alone, k */ exp(Z / sqrt(freezes)), so a
+target relative half width, e.g. 0.5 for k within a factor of 1.5, is met
+after a fixed number of freezes at each setpoint:
+
+    need = ceil((Z / ln(1 + target)) ** 2) # 24 for 0.5, 77 for 0.25
+
+The repeats a setpoint still takes are its missing freezes over its chance
+of freezing in a repeat. Every setpoint gets min_repeats first, in turn, to
+estimate that chance, then each repeat goes to the unfinished setpoint which
+needs the fewest more. No repeat is spent on a setpoint which has met the
+target, or which has run max_repeats without freezing enough (too warm to
+measure in the hold), and the campaign stops when every setpoint is done.
+Running the nearest first finishes the setpoints one by one, so a campaign
+stopped early leaves as many as possible complete.
+
+The state is a plain dict, which Checkpoint saves as the campaign's setpoint,
+so a campaign carries on after a reset with its counts:
+
+    plan = new_plan([-13, -14, -15], target=0.5)
+    alta.run(alta.campaign_steps('adaptive', 'data/', plan))
+
+Each decision is appended to schedule.csv in the data directory: the repeat,
+the setpoint chosen, and its repeats, freezes, k (1/s) and relative half width
+so far, and the repeats it is expected to need still. The repeats are
+isothermal repeat files like any other, for ALTA_stats.py.
+'''
+
+import math
+
+Z = 1.96 # 95% confidence
+REPEATS = 0 # Columns of each setpoint's counts
+FROZEN = 1
+EARLY = 2
+LIQUID_S = 3 # (s) Total time held liquid
+
+
+def new_plan(setpoints, target=0.5, min_repeats=3, max_repeats=200):
+    '''
+    State of a campaign starting at setpoints (deg C)
+    target: Relative half width of the confidence interval on k to reach
+    min_repeats: Repeats of each setpoint before choosing between them
+    max_repeats: Repeats after which a setpoint is given up
+    '''
+    return {'setpoints': list(setpoints),
+            'target': target,
+            'min_repeats': min_repeats,
+            'max_repeats': max_repeats,
+            'counts': [[0, 0, 0, 0.0] for _ in setpoints],
+            'current': None}
+
+
+class Schedule():
+    def __init__(self, plan):
+        '''plan: State from new_plan, updated in place'''
+        self.plan = plan
+        self.setpoints = plan['setpoints']
+        self.counts = plan['counts']
+        self.need = int(math.ceil((Z / math.log(1 + plan['target'])) ** 2))
+
+    def setpoint(self):
+        '''The setpoint being run'''
+        return self.setpoints[self.plan['current']]
+
+    def met(self, i):
+        return self.counts[i][FROZEN] >= self.need
+
+    def finished(self, i):
+        return self.met(i) or \
+            self.counts[i][REPEATS] >= self.plan['max_repeats']
+
+    def rate(self, i):
+        '''Nucleation rate (1/s) at setpoint i, None before a freeze'''
+        counts = self.counts[i]
+        if not counts[FROZEN] or not counts[LIQUID_S]:
+            return None
+        return counts[FROZEN] / counts[LIQUID_S]
+
+    def half_width(self, i):
+        '''Relative half width of the confidence interval on the rate'''
+        frozen = self.counts[i][FROZEN]
+        if not frozen:
+            return None
+        return math.exp(Z / math.sqrt(frozen)) - 1
+
+    def remaining(self, i):
+        '''Repeats setpoint i is expected to need still'''
+        repeats, frozen = self.counts[i][REPEATS], self.counts[i][FROZEN]
+        if frozen >= self.need:
+            return 0
+        # Chance of a freeze, pulled towards 1/2 while there are few repeats
+        return (self.need - frozen) * (repeats + 2) / (frozen + 1)
+
+    def choose(self):
+        '''
+        Pick the setpoint to run next, and return it. None when every one is
+        finished
+        '''
+        running = [i for i in range(len(self.setpoints))
+                   if not self.finished(i)]
+        if not running:
+            self.plan['current'] = None
+            return None
+        fewest = running[0] # Fewest repeats, earliest listed
+        for i in running:
+            if self.counts[i][REPEATS] < self.counts[fewest][REPEATS]:
+                fewest = i
+        if self.counts[fewest][REPEATS] < self.plan['min_repeats']:
+            best = fewest
+        else:
+            best = running[0]
+            for i in running:
+                if self.remaining(i) < self.remaining(best):
+                    best = i
+        self.plan['current'] = best
+        return self.setpoints[best]
+
+    def record(self, outcome, value, hold_ms):
+        '''
+        Count the outcome of the repeat just run at the current setpoint.
+        value: Time (ms) it froze, or ran to if liquid, hold_ms: time the
+        hold started
+        '''
+        counts = self.counts[self.plan['current']]
+        counts[REPEATS] += 1
+        if outcome == 'early':
+            counts[EARLY] += 1
+            return
+        if outcome == 'frozen':
+            counts[FROZEN] += 1
+        counts[LIQUID_S] += (value - hold_ms) / 1000
+
+    def decision(self, i):
+        '''What setpoint i stands at, for schedule.csv'''
+        rate = self.rate(i)
+        half_width = self.half_width(i)
+        return (self.setpoints[i], self.counts[i][REPEATS],
+                self.counts[i][FROZEN],
+                '' if rate is None else '{:.3e}'.format(rate),
+                '' if half_width is None else round(half_width, 3),
+                round(self.remaining(i)))
+
+    def summary(self):
+        '''A line for each setpoint, for the REPL'''
+        lines = []
+        for i in range(len(self.setpoints)):
+            T, repeats, frozen, rate, half_width, remaining = self.decision(i)
+            lines.append('{} C: {} repeats, {} frozen, {} early, k {} 1/s '
+                         '+/- {}, {}'.format(
+                             T, repeats, frozen, self.counts[i][EARLY],
+                             rate or '-', half_width or '-',
+                             'met' if self.met(i) else 'given up'
+                             if self.finished(i) else
+                             '~{} repeats to go'.format(remaining)))
+        return '\n'.join(lines)
@@ -0,0 +1,122 @@
+'''
+Binary telemetry over USB: fixed size frames with sequence numbers and CRC.
+
+Printing every sample as CSV costs formatting time in the control loop, and
+print blocks when nobody is reading the port. Instead each sample is packed
+into a preallocated ring buffer of frames, without formatting, and service()
+writes as much as the port will take without blocking. Packing allocates
+little but not nothing: the CRC is taken over a view of the frame made once,
+but on the pyBoard a CRC of 2**30 or more, most of them, is a new long int.
+Each write in service() takes a new view too. If the host falls behind, new
+frames are dropped and the receiver sees the gap in the sequence numbers (see
+ALTA_telemetry.py).
+
+Every frame is FRAME_SIZE bytes, little endian:
+    sync      2 bytes  0xA5 0x5A
+    seq       uint16   Increments every frame, including dropped ones
+    type      uint8    SAMPLE, START or END
+    status    uint8    STATUSES code (SAMPLE), 1 if the setpoint is an int
+                       (START)
+    t         uint32   Time (ms) (SAMPLE), repeat number (START, END)
+    a         float32  Temperature (SAMPLE), setpoint (START), value (END)
+    b         float32  Calibrate/inner temperature (SAMPLE)
+    code      uint16   LDR (SAMPLE), MODES (START) or OUTCOMES (END) code
+    crc       uint32   CRC32 of the preceding bytes
+
+START and END frames bracket each repeat. START carries the setpoint, and
+END the outcome and the freeze time or temperature, as they are written in
+the repeat's filename, so the receiver can rebuild the repeat files.
+
+    link = TelemetryLink(pyb.USB_VCP())
+    alta = ALTA(..., link=link)
+'''
+
+import select
+import struct
+from binascii import crc32
+
+SYNC = b'\xa5\x5a'
+HEADER = '<2sHBBIffH' # Everything but the crc
+FRAME_SIZE = struct.calcsize(HEADER) + 4
+SAMPLE, START, END = 0, 1, 2
+MODES = ('isothermal', 'linear', 'profile')
+OUTCOMES = ('early', 'frozen', 'liquid')
+STATUSES = ('', 'Cool', 'Hold', 'Froz', 'Warm', 'Fast', 'Heat', 'Wait', 'Ramp')
+
+
+class TelemetryLink():
+    MAX_WRITE = 256 # (bytes) Most written per service(), bounds its time
+
+    def __init__(self, stream, frames=64):
+        '''
+        stream: Port to write to, e.g. pyb.USB_VCP() or a non-blocking file
+        frames: Size of the ring buffer in frames
+        '''
+        self.stream = stream
+        self.size = frames * FRAME_SIZE
+        self.buf = bytearray(self.size)
+        self.mv = memoryview(self.buf)
+        self.headers = [self.mv[i:i + FRAME_SIZE - 4] # What the CRC covers
+                        for i in range(0, self.size, FRAME_SIZE)]
+        self.head = 0 # Bytes packed into the buffer
+        self.tail = 0 # Bytes written to the stream
+        self.seq = 0
+        self.sent = 0 # Frames packed
+        self.dropped = 0 # Frames lost because the buffer was full
+        self.poller = None
+        if hasattr(stream, 'fileno') or hasattr(stream, 'ioctl'):
+            try:
+                self.poller = select.poll()
+                self.poller.register(stream, select.POLLOUT)
+            except (OSError, ValueError): # Not pollable, e.g. io.BytesIO
+                self.poller = None
+
+    def pack(self, kind, status, t, a, b, code):
+        '''Pack a frame into the ring buffer, dropping it if full'''
+        seq = self.seq
+        self.seq = (seq + 1) & 0xFFFF
+        if self.head - self.tail + FRAME_SIZE > self.size:
+            self.dropped += 1
+            return
+        start = self.head % self.size # Frames never straddle the end
+        struct.pack_into(HEADER, self.buf, start, SYNC, seq, kind, status,
+                         t, a, b, code)
+        crc = crc32(self.headers[start // FRAME_SIZE])
+        struct.pack_into('<I', self.buf, start + FRAME_SIZE - 4, crc)
+        self.head += FRAME_SIZE
+        self.sent += 1
+
+    def sample(self, t, T, calibrate, ldr, status=''):
+        code = STATUSES.index(status) if status in STATUSES else 0
+        self.pack(SAMPLE, code, int(t), T, calibrate, int(ldr))
+
+    def start(self, repeat, mode, setpoint):
+        whole = 1 if isinstance(setpoint, int) else 0 # Written -15, not -15.0
+        self.pack(START, whole, repeat, setpoint, 0, MODES.index(mode))
+
+    def end(self, repeat, outcome, value):
+        self.pack(END, 0, repeat, value, 0, OUTCOMES.index(outcome))
+
+    def writable(self):
+        if self.poller is None:
+            return True
+        return bool(self.poller.poll(0))
+
+    def service(self):
+        '''Write what the stream will take now, without blocking'''
+        budget = self.MAX_WRITE
+        while self.head > self.tail and budget > 0 and self.writable():
+            start = self.tail % self.size
+            n = min(self.head - self.tail, self.size - start, budget)
+            try:
+                written = self.stream.write(self.mv[start:start + n])
+            except OSError: # Would block, or the host went away
+                written = None
+            if not written:
+                break
+            self.tail += written
+            budget -= written
+
+    def summary(self):
+        return 'telemetry sent {} dropped {} queued {} bytes'.format(
+            self.sent, self.dropped, self.head - self.tail)
@@ -0,0 +1,101 @@
+'''
+Fixed rate loop timing driven by a hardware timer interrupt.
+
+Sleeping for a fixed delay after each reading makes the real period the delay
+plus however long the work took. Instead a Timer fires at exactly the period,
+and the loop waits for the next interrupt:
+
+    ticker = Ticker(200)
+    while running:
+        ticker.wait()
+        do_work()
+
+If the work overruns a period the missed deadlines are counted and skipped
+rather than run back to back. The observed period jitter is recorded, which
+can be reset at the start of each repeat.
+
+Under uasyncio (see runtime.py) give the Ticker a ThreadSafeFlag as flag,
+which the interrupt sets, and call consume() once the task has woken.
+'''
+
+import time
+import pyb
+from pyb import Timer
+
+
+class Ticker():
+    TIMER_ID = 7 # Basic timer, not used by the pyBoard itself
+
+    def __init__(self, period_ms, timer_id=TIMER_ID):
+        '''
+        period_ms: Time between ticks (ms)
+        timer_id: pyBoard Timer to use for the interrupt
+        '''
+        self.period_ms = period_ms
+        self.period_us = period_ms * 1000
+        self.pending = 0 # Ticks fired but not yet waited for
+        self.count = 0 # Ticks since the start, including any missed
+        self.flag = None # Set on each tick if given, e.g. ThreadSafeFlag
+        self.timer = Timer(timer_id, freq=1000/period_ms)
+        self.timer.callback(self._irq)
+        self.reset()
+
+    def _irq(self, timer):
+        '''Timer interrupt, must not allocate'''
+        self.pending += 1
+        if self.flag is not None:
+            self.flag.set()
+
+    def reset(self):
+        '''
+        Clear the statistics and restart the period from now, e.g. at the
+        start of each repeat
+        '''
+        irq_state = pyb.disable_irq()
+        self.pending = 0
+        pyb.enable_irq(irq_state)
+        self.timer.counter(0)
+
+        self.ticks = 0 # Ticks waited for
+        self.missed = 0 # Deadlines missed because the work overran
+        self.max_jitter_us = 0 # Largest deviation from the period
+        self.total_jitter_us = 0
+        self.last_us = None
+
+    def deinit(self):
+        self.timer.deinit()
+
+    def wait(self):
+        '''Block until the next tick'''
+        while not self.pending:
+            pyb.wfi() # Sleep until the next interrupt
+        self.consume()
+
+    def consume(self):
+        '''Take the pending ticks and update the statistics'''
+        irq_state = pyb.disable_irq()
+        pending = self.pending
+        self.pending = 0
+        pyb.enable_irq(irq_state)
+
+        now = time.ticks_us()
+        self.count += pending
+        if pending > 1:
+            self.missed += pending - 1
+        if self.last_us is not None:
+            interval = time.ticks_diff(now, self.last_us)
+            jitter = abs(interval - pending * self.period_us)
+            self.total_jitter_us += jitter
+            if jitter > self.max_jitter_us:
+                self.max_jitter_us = jitter
+        self.last_us = now
+        self.ticks += 1
+
+    def mean_jitter_us(self):
+        if self.ticks < 2:
+            return 0
+        return self.total_jitter_us / (self.ticks - 1)
+
+    def summary(self):
+        return 'ticks {} missed {} jitter mean {:.0f} max {} us'.format(
+            self.ticks, self.missed, self.mean_jitter_us(), self.max_jitter_us)
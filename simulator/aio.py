@@ -0,0 +1,58 @@
+'''
+asyncio event loop running on the virtual clock, for pyboard/runtime.py.
+
+The loop reads the time from the clock, and where it would block waiting for
+its next timer it advances the clock instead. Timer events (e.g. the Ticker
+interrupt) fire during the advance, on the loop's own thread.
+
+    loop = new_event_loop()
+    loop.run_until_complete(runtime.main(steps))
+'''
+
+import asyncio
+import selectors
+
+from clock import clock
+
+
+class VirtualSelector(selectors.DefaultSelector):
+    def select(self, timeout=None):
+        '''Wait until timeout or the next clock event, as an interrupt would'''
+        if timeout is None or timeout > 0:
+            us = None if timeout is None else int(timeout * 1000000) or 1
+            if clock.next_due is not None:
+                to_event = clock.next_due - clock.now_us
+                if us is None or to_event < us:
+                    us = to_event
+            clock.advance_us(1000 if us is None else us)
+        return selectors.DefaultSelector.select(self, 0)
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        asyncio.SelectorEventLoop.__init__(self, VirtualSelector())
+        self._clock_resolution = 1e-6
+
+    def time(self):
+        return clock.now_us / 1000000
+
+
+def new_event_loop():
+    loop = VirtualEventLoop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+class ScriptedReader():
+    '''Command stream giving each (time_s, line) at that virtual time'''
+    def __init__(self, script=()):
+        self.script = list(script)
+
+    async def readline(self):
+        if not self.script:
+            await asyncio.Event().wait() # Nothing more, like a quiet port
+        at_s, line = self.script.pop(0)
+        delay = at_s - clock.now_us / 1000000
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return line + '\n'
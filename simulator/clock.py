@@ -0,0 +1,105 @@
+'''
+Virtual clock for running ALTA faster than real time.
+
+Provides the subset of the MicroPython time module used by the pyboard code
+(ticks_ms, ticks_us, ticks_diff, ticks_add, sleep_ms, sleep_us) so that it can
+be swapped in for time inside the pyboard modules. Time only moves when the
+code sleeps, so a repeat that takes minutes on the rig runs in milliseconds.
+
+Periodic callbacks stand in for timer interrupts; they fire as time passes
+and wait_for_event() jumps straight to the next one, as pyb.wfi() would.
+'''
+
+TICKS_PERIOD = 1 << 30 # MicroPython ticks wrap at 2^30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+class VirtualClock():
+    def __init__(self, start_us=0):
+        '''
+        start_us: initial time (us), set close to TICKS_PERIOD * 1000 to
+        exercise tick roll-over
+        '''
+        self.reset(start_us)
+
+    def reset(self, start_us=0):
+        self.now_us = start_us
+        self.events = [] # [due_us, period_us, callback]
+        self.next_due = None # due_us of the next event
+
+    def add_periodic(self, period_us, callback):
+        '''Call callback() every period_us, returns a handle for cancel()'''
+        event = [self.now_us + period_us, period_us, callback]
+        self.events.append(event)
+        self._next_event()
+        return event
+
+    def cancel(self, event):
+        for i in range(len(self.events)):
+            if self.events[i] is event:
+                del self.events[i]
+                break
+        self._next_event()
+
+    def _next_event(self):
+        if not self.events:
+            self.next_due = None
+            return None
+        event = min(self.events, key=lambda event: event[0])
+        self.next_due = event[0]
+        return event
+
+    def advance_us(self, us):
+        '''Move time forward by us microseconds, firing any callbacks due'''
+        target = self.now_us + int(us)
+        if self.next_due is None or target < self.next_due:
+            self.now_us = target
+            return
+        event = self._next_event()
+        while event is not None and event[0] <= target:
+            self.now_us = event[0]
+            event[0] += event[1]
+            event[2]()
+            event = self._next_event()
+        self.now_us = target
+
+    def wait_for_event(self):
+        '''Jump to the next callback, or 1 ms if there are none'''
+        event = self._next_event()
+        if event is None:
+            self.advance_us(1000)
+        else:
+            self.advance_us(event[0] - self.now_us)
+
+    def ticks_ms(self):
+        return (self.now_us // 1000) & TICKS_MAX
+
+    def ticks_us(self):
+        return self.now_us & TICKS_MAX
+
+    def ticks_add(self, ticks, delta):
+        return (ticks + delta) & TICKS_MAX
+
+    def ticks_diff(self, end, start):
+        '''Signed difference between two tick values, as MicroPython'''
+        return ((end - start + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+    def sleep_ms(self, ms):
+        self.advance_us(ms * 1000)
+
+    def sleep_us(self, us):
+        self.advance_us(us)
+
+    def sleep(self, s):
+        self.advance_us(s * 1000000)
+
+    def time(self):
+        return self.now_us // 1000000
+
+    def elapsed_ms(self):
+        '''Total (unwrapped) ms since the clock started, for reporting'''
+        return self.now_us // 1000
+
+
+clock = VirtualClock() # Shared by the fake pyb module and the rig
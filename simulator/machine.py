@@ -0,0 +1,3 @@
+'''Stand-in for the MicroPython machine module, see pyb.py'''
+
+from pyb import Pin, SPI
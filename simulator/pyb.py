@@ -0,0 +1,249 @@
+'''
+Stand-in for the MicroPython pyb module on a host machine.
+
+Only the parts of pyb used by the ALTA code are provided. Peripherals keep
+their state in plain attributes so that the thermal model (thermal.py) and
+benchmarks can inspect them, and all timing comes from the shared virtual
+clock (clock.py).
+'''
+
+from clock import clock
+
+
+def millis():
+    return clock.ticks_ms()
+
+
+def micros():
+    return clock.ticks_us()
+
+
+def elapsed_millis(start):
+    return clock.ticks_diff(clock.ticks_ms(), start)
+
+
+def elapsed_micros(start):
+    return clock.ticks_diff(clock.ticks_us(), start)
+
+
+def delay(ms):
+    clock.sleep_ms(ms)
+
+
+def udelay(us):
+    clock.sleep_us(us)
+
+
+def wfi():
+    clock.wait_for_event()
+
+
+def disable_irq():
+    return True # Callbacks only run inside clock.advance_us
+
+
+def enable_irq(state=True):
+    pass
+
+
+class Pin():
+    IN = 0
+    OUT_PP = 1
+    OUT_OD = 2
+    AF_PP = 3
+    ANALOG = 4
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+
+    def __init__(self, id, mode=IN, pull=PULL_NONE, value=0):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        self._value = value
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    def low(self):
+        self._value = 0
+
+    def high(self):
+        self._value = 1
+
+    def toggle(self):
+        self._value ^= 1
+
+    def name(self):
+        return self.id
+
+    def irq(self, handler=None, trigger=IRQ_FALLING):
+        self.handler = handler
+
+    def fire(self):
+        '''Simulate the edge which triggers the irq handler'''
+        if getattr(self, 'handler', None) is not None:
+            self.handler(self)
+
+
+class TimerChannel():
+    def __init__(self, timer, channel, mode, pin=None):
+        self.timer = timer
+        self.channel = channel
+        self.mode = mode
+        self.pin = pin
+        self.percent = 0
+
+    def pulse_width_percent(self, value=None):
+        if value is None:
+            return self.percent
+        self.percent = value
+
+
+class Timer():
+    PWM = 0
+    PWM_INVERTED = 1
+    OC_TIMING = 2
+
+    def __init__(self, id, freq=None, callback=None):
+        self.id = id
+        self.channels = {}
+        self._event = None
+        self._callback = None
+        self.init(freq, callback)
+
+    def init(self, freq=None, callback=None):
+        self._freq = freq
+        self.callback(callback)
+
+    def deinit(self):
+        self.callback(None)
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self.init(value, self._callback)
+
+    def counter(self, value=None):
+        '''Restarting the count re-phases the periodic callback'''
+        if value is None:
+            return 0
+        self.callback(self._callback)
+
+    def callback(self, fun):
+        if self._event is not None:
+            clock.cancel(self._event)
+            self._event = None
+        self._callback = fun
+        if fun is not None and self._freq:
+            self._event = clock.add_periodic(int(1000000 / self._freq),
+                                             self._fire)
+
+    def _fire(self):
+        self._callback(self)
+
+    def channel(self, channel, mode=None, pin=None):
+        if channel not in self.channels:
+            self.channels[channel] = TimerChannel(self, channel, mode, pin)
+        return self.channels[channel]
+
+
+class ADC():
+    def __init__(self, pin):
+        self.pin = pin
+        self.source = None # Callable returning a 12 bit reading
+
+    def read(self):
+        if self.source is None:
+            return 0
+        return self.source()
+
+    def read_timed(self, buf, timer):
+        '''Fill buf with readings paced by timer (or a frequency in Hz)'''
+        freq = timer if isinstance(timer, int) else timer.freq()
+        start = clock.now_us
+        for i in range(len(buf)):
+            clock.advance_us(start + (i + 1) * 1000000 // freq - clock.now_us)
+            buf[i] = self.read()
+
+
+class I2C():
+    '''Records the traffic sent, for benchmarks'''
+    MASTER = 0
+    SLAVE = 1
+
+    def __init__(self, bus, mode=MASTER, baudrate=100000):
+        self.bus = bus
+        self.mode = mode
+        self.baudrate = baudrate
+        self.record = False # Keep a copy of every byte sent in self.sent
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.transactions = 0
+        self.bytes_sent = 0
+        self.sent = bytearray()
+
+    def send(self, send, addr=0x00, timeout=5000):
+        if isinstance(send, int):
+            send = bytes((send,))
+        self.transactions += 1
+        self.bytes_sent += len(send)
+        if self.record:
+            self.sent.extend(send)
+
+
+class SPI():
+    '''
+    Counts the traffic, for benchmarks. Subclasses simulate the device on
+    the bus by overriding transfer().
+    '''
+    MASTER = 0
+    SLAVE = 1
+    MSB = 0
+    LSB = 1
+
+    def __init__(self, bus, mode=MASTER, baudrate=328125, polarity=1,
+                 phase=0, firstbit=MSB):
+        self.bus = bus
+        self.mode = mode
+        self.baudrate = baudrate
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.transactions = 0
+        self.bytes_sent = 0
+
+    def transfer(self, send, recv):
+        '''Full duplex transfer, fills recv if given'''
+        pass
+
+    def send(self, send, timeout=5000):
+        if isinstance(send, int):
+            send = bytes((send,))
+        self.transactions += 1
+        self.bytes_sent += len(send)
+        self.transfer(send, None)
+
+    def recv(self, recv, timeout=5000):
+        if isinstance(recv, int):
+            recv = bytearray(recv)
+        self.transactions += 1
+        self.bytes_sent += len(recv)
+        self.transfer(bytes(len(recv)), recv)
+        return recv
+
+    def send_recv(self, send, recv=None, timeout=5000):
+        if recv is None:
+            recv = bytearray(len(send))
+        self.transactions += 1
+        self.bytes_sent += len(send)
+        self.transfer(send, recv)
+        return recv
@@ -0,0 +1,240 @@
+'''
+Simulated ALTA rig: the peripherals passed to ALTA, backed by ThermalModel.
+
+    rig = Rig(seed=1)
+    alta = rig.make_alta()
+
+Actuators bring the model up to date before changing state, so that the
+model integrates each interval with the outputs that were actually set.
+'''
+
+from clock import clock
+from pyb import ADC, Pin, SPI, Timer, TimerChannel
+from thermal import ThermalModel
+
+
+class ModelPin(Pin):
+    '''GPIO output which syncs the thermal model before switching'''
+    model = None
+
+    def value(self, value=None):
+        if value is not None and self.model is not None:
+            self.model.sync()
+        return Pin.value(self, value)
+
+    def low(self):
+        self.value(0)
+
+    def high(self):
+        self.value(1)
+
+    def toggle(self):
+        self.value(not self._value)
+
+
+class ModelChannel(TimerChannel):
+    '''PWM channel which syncs the thermal model before changing duty'''
+    model = None
+
+    def pulse_width_percent(self, value=None):
+        if value is not None and self.model is not None:
+            self.model.sync()
+        return TimerChannel.pulse_width_percent(self, value)
+
+
+class FakeRTD():
+    '''Stands in for MAX31865, reading the block or sample temperature'''
+    def __init__(self, read_temperature):
+        self.read_temperature = read_temperature
+        self.reads = 0
+        self.milli = None
+        self.temperature = None
+
+    def read_milli(self):
+        self.reads += 1
+        self.milli = round(self.read_temperature() * 1000)
+        self.temperature = ((self.milli + 50) // 100) / 10 # As MAX31865
+        return self.milli
+
+    def read(self):
+        self.read_milli()
+        return self.temperature
+
+
+class MAX31865Bus(SPI):
+    '''
+    SPI bus with a simulated MAX31865 on it, for running the real driver.
+    The RTD resistance follows the Callendar-Van Dusen equation for a PT100.
+    '''
+    REF_R = 400.0 # (Ohms)
+    R0 = 100.0 # (Ohms)
+    A = 3.9083e-3
+    B = -5.775e-7
+    C = -4.183e-12
+    CONVERSION_US = 20000 # Auto conversion with the 50 Hz filter
+
+    def __init__(self, bus, read_temperature, drdy_pin=None, **kwargs):
+        '''
+        read_temperature: Callable returning the RTD temperature (deg C)
+        drdy_pin: Pin to pulse at the end of each conversion
+        '''
+        SPI.__init__(self, bus, **kwargs)
+        self.read_temperature = read_temperature
+        self.registers = bytearray(8)
+        self.registers[3] = 0xFF # High fault threshold
+        self.registers[4] = 0xFF
+        self.fault = 0 # Fault status to report
+        self.held = False # Registers kept from the last conversion
+        if drdy_pin is not None:
+            clock.add_periodic(self.CONVERSION_US, drdy_pin.fire)
+
+    def resistance(self, T):
+        R = 1 + self.A * T + self.B * T * T
+        if T < 0:
+            R += self.C * (T - 100) * T * T * T
+        return self.R0 * R
+
+    def convert(self):
+        raw = int(self.resistance(self.read_temperature()) / self.REF_R * 32768)
+        raw = min(raw, 0x7FFF) << 1
+        if self.fault:
+            raw |= 1
+        self.registers[1] = raw >> 8
+        self.registers[2] = raw & 0xFF
+        self.registers[7] = self.fault
+
+    def transfer(self, send, recv):
+        address = send[0]
+        if address & 0x80: # Write
+            for i in range(1, len(send)):
+                self.registers[(address & 0x7F) + i - 1] = send[i]
+            if self.registers[0] & 0x02: # Clear fault
+                self.fault = 0
+                self.registers[0] &= ~0x02
+            return
+        if address == 1 and not self.held:
+            self.convert()
+        if recv is not None:
+            for i in range(1, len(recv)):
+                recv[i] = self.registers[(address + i - 1) & 0x07]
+
+
+class FakeLcd():
+    '''Records what would be shown on a num_lines x num_columns LCD'''
+    def __init__(self, num_lines=2, num_columns=16):
+        self.num_lines = num_lines
+        self.num_columns = num_columns
+        self.cursor_x = 0
+        self.cursor_y = 0
+        self.chars_written = 0
+        self.rows = [bytearray(b' ' * num_columns) for _ in range(num_lines)]
+
+    def clear(self):
+        for row in self.rows:
+            row[:] = b' ' * self.num_columns
+        self.move_to(0, 0)
+
+    def move_to(self, cursor_x, cursor_y):
+        self.cursor_x = cursor_x
+        self.cursor_y = cursor_y
+
+    def putchar(self, char):
+        if char != '\n':
+            self.rows[self.cursor_y][self.cursor_x] = ord(char)
+            self.cursor_x += 1
+            self.chars_written += 1
+        if self.cursor_x >= self.num_columns or char == '\n':
+            self.cursor_x = 0
+            self.cursor_y = (self.cursor_y + 1) % self.num_lines
+
+    def putstr(self, string):
+        for char in string:
+            self.putchar(char)
+
+    def write_row(self, row, string):
+        '''As I2cLcd.write_row, string may be str or bytes'''
+        for x in range(self.num_columns):
+            char = string[x] if x < len(string) else ' '
+            self.rows[row][x] = char if isinstance(char, int) else ord(char)
+            self.chars_written += 1
+        self.move_to(self.num_columns, row)
+
+    def text(self):
+        return '\n'.join(row.decode() for row in self.rows)
+
+
+class Rig():
+    def __init__(self, seed=None, drivers=False, drdy=False):
+        '''
+        seed: Seed for the nucleation and sensor noise
+        drivers: Read the PRTs through the real MAX31865 driver and a
+            simulated SPI bus, rather than FakeRTD
+        drdy: With drivers, trigger reads from the DRDY interrupt
+        '''
+        self.clock = clock
+        self.timer = Timer(4, freq=100)
+        self.pwm_channel = ModelChannel(self.timer, 4, Timer.PWM)
+        self.relay_1 = ModelPin('X11', mode=Pin.OUT_PP)
+        self.relay_2 = ModelPin('X12', mode=Pin.OUT_PP)
+        self.fans_pin = Pin('Y3', mode=Pin.OUT_PP)
+
+        self.model = ThermalModel(clock,
+                                  self.pwm_channel,
+                                  self.relay_1,
+                                  self.relay_2,
+                                  seed)
+        for actuator in (self.pwm_channel, self.relay_1, self.relay_2):
+            actuator.model = self.model
+
+        if drivers:
+            self.ptd = self.make_max31865(1, 'X5', 'X4' if drdy else None,
+                                          self.model.block_temperature)
+            self.calibrate = self.make_max31865(2, 'Y5', 'Y4' if drdy else None,
+                                                self.model.sample_temperature)
+        else:
+            self.ptd = FakeRTD(self.model.block_temperature)
+            self.calibrate = FakeRTD(self.model.sample_temperature)
+        self.ldr_pin = ADC(Pin('Y12'))
+        self.ldr_pin.source = self.model.ldr
+        self.lcd = FakeLcd()
+
+    def hold(self, held=True):
+        '''
+        Keep the sensors reading what they read now, and the model still,
+        until hold(False). Benchmarks hold the rig over the code they measure,
+        so that what is allocated there is ALTA's alone
+        '''
+        self.model.hold(held)
+        for sensor in (self.ptd, self.calibrate):
+            bus = getattr(sensor, 'spi', None)
+            if isinstance(bus, MAX31865Bus):
+                bus.held = False
+                if held:
+                    bus.convert()
+                    bus.held = True
+
+    def make_max31865(self, bus, cs, drdy, read_temperature):
+        from max31865 import MAX31865
+        drdy_pin = None if drdy is None else Pin(drdy, Pin.IN, Pin.PULL_UP)
+        spi = MAX31865Bus(bus, read_temperature, drdy_pin,
+                          mode=SPI.MASTER, baudrate=1000000, polarity=0,
+                          phase=1)
+        return MAX31865(spi, Pin(cs, mode=Pin.OUT_PP), drdy_pin=drdy_pin)
+
+    def make_alta(self, alta_class=None, lcd=True, **kwargs):
+        '''
+        Build an ALTA instance wired to this rig
+        lcd: False for no LCD, e.g. for a cell sharing one (see cells.py)
+        kwargs: Passed on to ALTA, e.g. ticker, buffered_log
+        '''
+        if alta_class is None:
+            from ALTA import ALTA as alta_class
+        return alta_class(self.ptd,
+                          self.calibrate,
+                          self.pwm_channel,
+                          self.ldr_pin,
+                          self.lcd if lcd else None,
+                          self.fans_pin,
+                          self.relay_1,
+                          self.relay_2,
+                          **kwargs)
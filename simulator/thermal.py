@@ -0,0 +1,167 @@
+'''
+Lumped thermal model of the ALTA Peltier/aluminium block/sample stack.
+
+Three parts:
+1. The Peltier elements pump heat out of (or into) the block. The direction
+is set by the relays and the power by the PWM duty cycle.
+2. The aluminium block, which leaks heat to the ambient through the insulation
+and exchanges heat with the sample.
+3. The sample, which lags the block, supercools and nucleates stochastically
+with a temperature dependent rate. On freezing latent heat is released
+(recalescence) and the sample becomes opaque to the LED.
+
+The constants are chosen so that the equilibrium PWM is close to
+ALTA.PWM_FIT_COEFFS, which was measured on the rig.
+'''
+
+import math
+import random
+
+
+def gauss(sd):
+    '''Normally distributed noise (Box-Muller, random.gauss is not in MicroPython)'''
+    u = 1 - random.random() # (0, 1]
+    return sd * math.sqrt(-2 * math.log(u)) * math.cos(2 * math.pi * random.random())
+
+
+class ThermalModel():
+    AMBIENT = 20.0 # (deg C)
+    C_BLOCK = 25.0 # (J/K) Aluminium block heat capacity
+    G_AMBIENT = 0.5 # (W/K) Block to ambient conductance
+    Q_COOL = 32.0 # (W) Peltier heat pumped at 100% PWM
+    Q_JOULE = 5.85 # (W) Joule heating at 100% PWM, scales with PWM^2
+    Q_HEAT = 40.0 # (W) Heat delivered at 100% PWM in the heating direction
+    C_SAMPLE = 2.1 # (J/K) 0.5 g of water
+    G_SAMPLE = 0.1 # (W/K) Block to sample conductance
+    LATENT = 167.0 # (J) Latent heat of 0.5 g of water
+
+    # Nucleation rate k(T) = K_REF * exp(-GAMMA * (T - T_REF)) per second
+    K_REF = 1 / 90 # (1/s)
+    T_REF = -15.0 # (deg C)
+    GAMMA = 0.7 # (1/K)
+
+    LDR_CLEAR = 2400 # (ADC counts) Clear liquid sample
+    LDR_DROP = 700 # (ADC counts) Drop in LDR reading when opaque
+    LDR_NOISE = 8 # (ADC counts) Standard deviation
+    ICE_OPAQUE = 0.02 # Ice fraction at which the sample is fully opaque
+    PTD_NOISE = 0.03 # (deg C) Standard deviation
+
+    MAX_STEP_MS = 100 # Integration step
+
+    def __init__(self, clock, pwm_channel, relay_1, relay_2, seed=None):
+        '''
+        clock: VirtualClock that drives the model
+        pwm_channel: TimerChannel whose duty cycle sets the Peltier power
+        relay_1, relay_2: Pins setting the current direction
+        seed: Seed for the nucleation and sensor noise
+        '''
+        self.clock = clock
+        self.pwm_channel = pwm_channel
+        self.relay_1 = relay_1
+        self.relay_2 = relay_2
+        if seed is not None:
+            random.seed(seed)
+
+        self.block = self.AMBIENT # (deg C)
+        self.sample = self.AMBIENT # (deg C)
+        self.ice = 0.0 # Ice fraction of the sample
+        self.freezes = 0 # Number of nucleation events
+        self.last_ms = clock.ticks_ms()
+        self.held = None # Readings repeated while held, see hold()
+
+    def nucleation_rate(self, T):
+        '''Nucleation rate (1/s) of the whole sample at T (deg C)'''
+        if T >= 0:
+            return 0
+        return self.K_REF * math.exp(-self.GAMMA * (T - self.T_REF))
+
+    def peltier_power(self):
+        '''Heat (W) delivered to the block by the Peltiers'''
+        u = self.pwm_channel.pulse_width_percent() / 100
+        if u <= 0:
+            return 0
+        if not self.relay_1.value() and self.relay_2.value(): # Cooling
+            return -(self.Q_COOL * u - self.Q_JOULE * u * u)
+        if self.relay_1.value() and not self.relay_2.value(): # Heating
+            return self.Q_HEAT * u
+        return 0 # Both Peltier terminals on the same rail
+
+    def step(self, dt):
+        '''Integrate the model forward by dt seconds'''
+        q_sample = self.G_SAMPLE * (self.block - self.sample)
+        q_block = (self.peltier_power()
+                   + self.G_AMBIENT * (self.AMBIENT - self.block)
+                   - q_sample)
+        self.block += q_block * dt / self.C_BLOCK
+
+        if self.ice <= 0: # Liquid
+            self.sample += q_sample * dt / self.C_SAMPLE
+            rate = self.nucleation_rate(self.sample)
+            if rate and random.random() < 1 - math.exp(-rate * dt):
+                self.nucleate()
+        elif self.ice >= 1: # Solid
+            self.sample += q_sample * dt / self.C_SAMPLE
+            if self.sample > 0: # Start melting
+                self.sample = 0.0
+                self.ice = 1 - 1e-9
+        else: # Mixed phase, pinned at 0 deg C
+            self.ice -= q_sample * dt / self.LATENT
+            if self.ice <= 0:
+                self.ice = 0.0
+            elif self.ice >= 1:
+                self.ice = 1.0
+
+    def nucleate(self):
+        '''Supercooled sample freezes, latent heat warms it to 0 deg C'''
+        self.freezes += 1
+        ice = self.C_SAMPLE * -self.sample / self.LATENT
+        if ice >= 1:
+            self.ice = 1.0
+            self.sample += self.LATENT / self.C_SAMPLE
+        else:
+            self.ice = ice
+            self.sample = 0.0
+
+    def hold(self, held=True):
+        '''
+        Stop integrating and repeat the readings of now until hold(False),
+        which catches the model up
+        '''
+        self.held = None
+        if held:
+            self.held = (self.block_temperature(), self.sample_temperature(),
+                         self.ldr())
+
+    def sync(self):
+        '''Bring the model up to the current clock time'''
+        if self.held is not None:
+            return
+        now = self.clock.ticks_ms()
+        elapsed = self.clock.ticks_diff(now, self.last_ms)
+        while elapsed > 0:
+            step = min(elapsed, self.MAX_STEP_MS)
+            self.step(step / 1000)
+            elapsed -= step
+        self.last_ms = now
+
+    def block_temperature(self):
+        if self.held is not None:
+            return self.held[0]
+        self.sync()
+        return self.block + gauss(self.PTD_NOISE)
+
+    def sample_temperature(self):
+        if self.held is not None:
+            return self.held[1]
+        self.sync()
+        return self.sample + gauss(self.PTD_NOISE)
+
+    def ldr(self):
+        '''12 bit ADC reading of the LDR voltage divider'''
+        if self.held is not None:
+            return self.held[2]
+        self.sync()
+        opacity = min(1, self.ice / self.ICE_OPAQUE)
+        value = int(self.LDR_CLEAR - self.LDR_DROP * opacity
+                    + gauss(self.LDR_NOISE))
+        return min(4095, max(0, value))
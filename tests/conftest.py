@@ -0,0 +1,13 @@
+'''
+Tests run on the computer, against the simulated rig. Importing ALTA_sim puts
+pyboard/ and simulator/ on the path and the pyboard modules on virtual time.
+'''
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import ALTA_sim # noqa: E402,F401
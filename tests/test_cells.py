@@ -0,0 +1,29 @@
+import ALTA_sim
+from cells import SharedFans
+from clock import clock
+from pyb import Pin
+from rig import Rig
+
+
+def test_shared_fans_stay_on_while_any_cell_cools():
+    clock.reset()
+    ALTA_sim.use_virtual_time()
+    fans_pin = Pin('Y3', mode=Pin.OUT_PP)
+    fans = SharedFans(fans_pin)
+    cells = []
+    for seed in (1, 2):
+        rig = Rig(seed)
+        rig.fans_pin = fans.cell()
+        cells.append(rig.make_alta(lcd=False))
+    cooling, melting = cells
+    cooling.set_pwm(100)
+    melting.set_pwm(40)
+    assert fans_pin.value() == 1
+    melting.set_pwm(0) # Melt, with the fans off
+    assert fans_pin.value() == 1
+    melting.switch_off() # Finished
+    assert fans_pin.value() == 1
+    cooling.set_pwm(0)
+    assert fans_pin.value() == 0
+    melting.set_pwm(100)
+    assert fans_pin.value() == 1
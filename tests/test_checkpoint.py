@@ -0,0 +1,112 @@
+import ctypes
+import json
+import os
+
+import ALTA_sim
+from checkpoint import Checkpoint
+from clock import clock
+from rig import Rig
+
+HOLD_TICKS = 600 # Into the hold of the first repeat at -15 deg C
+
+
+def cut_campaign(tmp_path, ticks, until_frozen=False, **alta_kwargs):
+    '''
+    Run an isothermal campaign for ticks, or until the sample has frozen and
+    then ticks more, as if the power were then cut. Returns the rig, the data
+    directory and the checkpoint path. The steps are never closed, even at
+    exit: that would end the repeat and the campaign, which a power cut
+    doesn't
+    '''
+    clock.reset()
+    ALTA_sim.use_virtual_time()
+    data = str(tmp_path / 'data')
+    os.makedirs(data)
+    path = str(tmp_path / 'checkpoint.json')
+    rig = Rig(7)
+    alta = rig.make_alta(buffered_log=True, checkpoint=Checkpoint(path),
+                         **alta_kwargs)
+    steps = alta.isothermal_campaign(data, -15)
+    alta.ticker.reset()
+    while until_frozen and not rig.model.freezes:
+        next(steps)
+        alta.ticker.wait()
+    for _ in range(ticks):
+        next(steps)
+        alta.ticker.wait()
+    alta.switch_off()
+    alta.ticker.deinit()
+    ctypes.pythonapi.Py_IncRef(ctypes.py_object(steps))
+    return rig, data, path
+
+
+def recover(rig, data, path, down_s, hours=0.25):
+    clock.advance_us(down_s * 1000000)
+    alta = rig.make_alta(buffered_log=True, checkpoint=Checkpoint(path))
+    steps = alta.resume_steps()
+    assert steps is not None
+    alta.run(ALTA_sim.until(steps, clock.elapsed_ms() / 3600000 + hours))
+    with open(data + '/recovery.csv') as f:
+        return f.read().strip().split(',')
+
+
+def repeat_values(data):
+    return [int(float(name[:-4].split('_')[3])) for name in os.listdir(data)
+            if name.split('_')[0].isdigit()]
+
+
+def test_down_s_unknown_when_rtc_went_back():
+    ALTA_sim.use_virtual_time()
+    checkpoint = Checkpoint()
+    state = {'phase': 'hold', 'T': -15.0, 'time': clock.time() + 3600}
+    assert checkpoint.down_s(state) is None
+    assert not checkpoint.can_resume(state, -15.0)
+    state['time'] = clock.time() - 5
+    assert checkpoint.down_s(state) == 5
+    assert checkpoint.can_resume(state, -15.0)
+
+
+def test_brief_reset_resumes_the_repeat(tmp_path):
+    rig, data, path = cut_campaign(tmp_path, HOLD_TICKS)
+    repeat, phase, down_s, action, lost = recover(rig, data, path, 3)
+    assert (repeat, phase, action) == ('1', 'hold', 'resume')
+    assert 0 < int(down_s) <= Checkpoint.RESUME_MAX_S
+    assert all(0 <= value <= 200000 for value in repeat_values(data))
+
+
+def test_rtc_reset_discards_the_repeat(tmp_path):
+    rig, data, path = cut_campaign(tmp_path, HOLD_TICKS)
+    with open(path) as f:
+        state = json.load(f)
+    state['time'] = clock.time() + 24 * 3600 # The RTC restarted at its epoch
+    with open(path, 'w') as f:
+        json.dump(state, f)
+    repeat, phase, down_s, action, lost = recover(rig, data, path, 3)
+    assert (repeat, phase, down_s, action) == ('1', 'hold', '', 'discard')
+    values = repeat_values(data)
+    assert values # The campaign carried on, running the repeat again
+    assert all(0 <= value <= 200000 for value in values)
+
+
+def test_adaptive_melt_after_a_reset_waits_for_the_melt_time(tmp_path):
+    rig, data, path = cut_campaign(tmp_path, 5, until_frozen=True,
+                                        adaptive_melt=True)
+    assert rig.model.ice > 0
+    clock.advance_us(3000000)
+    alta = rig.make_alta(buffered_log=True, checkpoint=Checkpoint(path),
+                         adaptive_melt=True)
+    steps = alta.resume_steps()
+    alta.melt_ms = None
+    alta.ticker.reset()
+    while alta.melt_ms is None: # No baseline on the liquid sample to go by
+        next(steps)
+        alta.ticker.wait()
+    assert alta.melt_ms >= alta.MELT_TIME
+    assert rig.model.ice == 0
+    alta.melt_ms = None
+    while alta.melt_ms is None: # The next repeat's melt can end early
+        next(steps)
+        alta.ticker.wait()
+    assert alta.melt_ms < alta.MELT_TIME
+    assert rig.model.ice == 0
+    steps.close()
@@ -0,0 +1,63 @@
+import os
+
+import ALTA_journal
+import ALTA_sim
+from clock import clock
+from journal import JOURNAL, Journal
+from rig import Rig
+
+
+def run(steps, alta, ticks=None):
+    '''Step for ticks, or until the steps end'''
+    alta.ticker.reset()
+    n = 0
+    for _ in steps:
+        alta.ticker.wait()
+        n += 1
+        if n == ticks:
+            return
+
+
+def test_closed_repeat_ends_with_an_error_footer(tmp_path):
+    clock.reset()
+    ALTA_sim.use_virtual_time()
+    data = str(tmp_path)
+    alta = Rig(1).make_alta(buffered_log=True, journal=True)
+    steps = alta.isothermal_campaign(data, -15)
+    run(steps, alta, 333) # Cooling, with samples still in the log buffer
+    steps.close() # e.g. stop from the host
+    run(alta.isothermal_campaign(data, -15, last=2), alta)
+
+    found = list(ALTA_journal.repeats(data + '/' + JOURNAL))
+    assert [r[:4] for r in found] == [(1, 'isothermal', '-15', 'error'),
+                                      (2, 'isothermal', '-15', found[1][3])]
+    assert found[0][4] == 'closed'
+    assert found[1][3] in ('frozen', 'liquid')
+    assert len(found[0][7]) == 333 # Every sample, the buffer flushed
+    for r in found:
+        times = [int(line.split(b',')[0]) for line in r[7]]
+        assert times == sorted(times) and times[0] == 0
+    with open(data + '/' + JOURNAL, 'rb') as f:
+        for line in f:
+            assert line[:1].isdigit() or line.startswith((b'#start,',
+                                                          b'#end,'))
+    assert Journal(data).last_repeat() == 2
+    assert ALTA_journal.explode(data + '/' + JOURNAL,
+                                str(tmp_path / 'out')) == 1
+    assert os.listdir(str(tmp_path / 'out'))[0].startswith('2_isothermal-15_')
+
+
+def test_header_after_a_line_cut_by_a_reset(tmp_path):
+    journal = Journal(str(tmp_path))
+    with journal.begin(1, 'isothermal', -15) as f:
+        f.write('0,19.9,20.0,2394,Cool\n6380') # Power cut mid line
+    with journal.begin(1, 'isothermal', -15) as f:
+        f.write('0,19.9,20.0,2394,Cool\n')
+    journal.end(1, 'liquid', 900000)
+    with open(journal.path) as f:
+        lines = f.read().split('\n')
+    assert lines[2:] == ['6380', # Left as a line of its own
+                         '#start,1,isothermal,-15',
+                         '0,19.9,20.0,2394,Cool',
+                         '#end,1,liquid,900000', '']
+    assert journal.read(1).startswith(b'#start,1,')
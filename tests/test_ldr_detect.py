@@ -0,0 +1,125 @@
+'''
+Freeze detection latency and false-freeze rate on simulated LDR traces.
+
+Compares the original detector (one ADC reading per tick compared with the
+first reading) against LdrDetector (burst median and CUSUM), on:
+1. Freezing traces: the reading drops by DROP counts over RAMP_MS at a
+random instant. Measures the delay until detection and the error in the
+estimated freeze instant.
+2. Liquid traces: no freeze, but with the LED slowly fading. Measures false
+freezes per hour.
+Both have Gaussian noise and occasional single-sample spikes. LdrDetector
+must stay within the LIMITS, and ahead of the single reading where it was
+meant to be.
+'''
+
+import random
+
+import ALTA_sim
+from clock import clock
+from ldr import LdrDetector
+from pyb import ADC
+from thermal import gauss
+
+TICK_MS = 200
+THRESHOLD = 150
+CLEAR = 2400
+DROP = 700 # (counts) Frozen sample
+RAMP_MS = 50 # Time for the sample to become opaque
+NOISE = 8 # (counts) Standard deviation
+SPIKE_P = 0.002 # Chance of any one sample being a spike
+SPIKE = -400 # (counts)
+FADE = -60 # (counts/min) LED fading in liquid traces
+TRIALS = 200
+LIMITS = {'latency': 150, # (ms) Mean from the onset to detection
+          'max_latency': 250, # (ms) Longest, a tick and a quarter
+          'error': 60, # (ms) Mean error in the estimated onset
+          'early': 0, # Detected before the onset
+          'false_per_hour': 0}
+
+
+class Trace():
+    def __init__(self, onset_ms=None, fade=0):
+        self.onset_ms = onset_ms
+        self.fade = fade
+
+    def __call__(self):
+        t = clock.now_us / 1000
+        value = CLEAR + self.fade * t / 60000 + gauss(NOISE)
+        if self.onset_ms is not None and t > self.onset_ms:
+            value -= DROP * min(1, (t - self.onset_ms) / RAMP_MS)
+        if random.random() < SPIKE_P:
+            value += SPIKE
+        return int(value)
+
+
+def legacy(adc, ticks):
+    '''Original detector, returns (detect time, estimated onset) or None'''
+    clock.reset()
+    clear = adc.read()
+    for tick in range(1, ticks):
+        clock.reset(tick * TICK_MS * 1000)
+        if adc.read() < clear - THRESHOLD:
+            t = tick * TICK_MS
+            return t, t
+    return None
+
+
+def oversampled(adc, ticks):
+    '''LdrDetector, returns (detect time, estimated onset) or None'''
+    detector = LdrDetector(adc, THRESHOLD)
+    for tick in range(ticks):
+        clock.reset(tick * TICK_MS * 1000)
+        detector.read()
+        if detector.frozen:
+            t = tick * TICK_MS
+            return t, t + detector.onset_ms
+    return None
+
+
+def measure(detect):
+    '''Latency, onset error and false freezes of detect, as in LIMITS'''
+    ALTA_sim.use_virtual_time()
+    random.seed(1)
+    adc = ADC('Y12')
+    latency = []
+    error = []
+    for _ in range(TRIALS):
+        onset = 10000 + random.random() * 10000
+        adc.source = Trace(onset)
+        result = detect(adc, 30000 // TICK_MS)
+        if result is not None:
+            latency.append(result[0] - onset)
+            error.append(abs(result[1] - onset))
+
+    false = 0
+    hours = 0
+    for _ in range(TRIALS // 10):
+        adc.source = Trace(None, FADE)
+        ticks = 150000 // TICK_MS # One isothermal MAXIMUM_WAIT
+        if detect(adc, ticks) is not None:
+            false += 1
+        hours += ticks * TICK_MS / 3600000
+
+    early = len([t for t in latency if t < 0]) # Detected before the onset
+    error = [e for t, e in zip(latency, error) if t >= 0]
+    latency = [t for t in latency if t >= 0]
+    return {'latency': sum(latency) / len(latency),
+            'max_latency': max(latency),
+            'error': sum(error) / len(error),
+            'early': early,
+            'false_per_hour': false / hours}
+
+
+def test_oversampled_detector_within_limits():
+    result = measure(oversampled)
+    for key, limit in LIMITS.items():
+        assert result[key] <= limit, key
+
+
+def test_oversampled_detector_beats_a_single_reading():
+    single = measure(legacy)
+    result = measure(oversampled)
+    assert result['error'] < single['error'] / 2 # Onset within the tick
+    assert result['false_per_hour'] < single['false_per_hour']
+    assert result['early'] < single['early'] # Spikes no longer end a repeat
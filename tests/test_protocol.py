@@ -0,0 +1,165 @@
+import json
+import os
+
+import ALTA_journal
+import ALTA_sim
+from clock import clock
+from journal import JOURNAL
+from protocol import CommandServer
+from rig import Rig
+
+
+class StalledPort():
+    '''A USB port the host has stopped reading: takes requests, never writes'''
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+
+    def fileno(self):
+        return self.write_fd
+
+    def write(self, data):
+        return 0
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+class NeverWritable():
+    '''poll for POLLOUT on a stalled port: waits the timeout, on the clock'''
+    def poll(self, timeout_ms):
+        clock.advance_us(timeout_ms * 1000)
+        return []
+
+
+def stalled_server(tmp_path):
+    clock.reset()
+    ALTA_sim.use_virtual_time()
+    alta = Rig(1).make_alta(buffered_log=True)
+    port = StalledPort()
+    server = CommandServer(alta, port, str(tmp_path))
+    server.poll_out = NeverWritable()
+    return server, port
+
+
+def test_reply_to_a_stalled_host_is_dropped_within_the_deadline(tmp_path):
+    for i in range(50):
+        (tmp_path / '{}_isothermal-15_liquid_150000.csv'.format(i)).write_text(
+            '0,-15.0,-14.2,2394,Hold\n')
+    server, port = stalled_server(tmp_path)
+    for line in ('status', 'ls', 'chunk 0 4096',
+                 'get {} 0 4096'.format(tmp_path / '0_isothermal-15_liquid_'
+                                                   '150000.csv')):
+        start = clock.ticks_ms()
+        server.handle(line)
+        assert clock.ticks_diff(clock.ticks_ms(), start) <= \
+            CommandServer.SEND_WAIT_MS
+    assert server.dropped == 4
+    port.close()
+
+
+def test_control_loop_keeps_stepping_while_the_host_is_stalled(tmp_path):
+    server, port = stalled_server(tmp_path)
+    server.handle('start isothermal -15 0 {}'.format(tmp_path / 'data'))
+    assert server.steps is not None
+    T = server.alta.ptd.read()
+    server.alta.ticker.reset()
+    for _ in range(20):
+        server.step()
+        server.handle('status')
+        server.alta.ticker.wait()
+    assert server.alta.T < T - 1 # Cooling went on
+    assert server.dropped == 21
+    server.stop()
+    port.close()
+
+
+class RecordingPort(StalledPort):
+    '''A USB port the host reads as fast as it is written'''
+    def __init__(self):
+        super().__init__()
+        self.written = bytearray()
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def replies(self):
+        '''What was written since the last call'''
+        data = bytes(self.written)
+        self.written = bytearray()
+        return data
+
+
+def test_large_directory_is_listed_a_page_at_a_time(tmp_path):
+    sizes = {}
+    for i in range(150):
+        name = '{}_isothermal-15_liquid_150000.csv'.format(i)
+        (tmp_path / name).write_text('0,-15.0,-14.2,2394,Hold\n' * (i % 4))
+        sizes[name] = 24 * (i % 4)
+    clock.reset()
+    ALTA_sim.use_virtual_time()
+    port = RecordingPort()
+    server = CommandServer(Rig(1).make_alta(buffered_log=True), port,
+                           str(tmp_path))
+
+    listed = []
+    stats = []
+    real_stat = os.stat
+    os.stat = lambda path: stats.append(path) or real_stat(path)
+    try:
+        for start in (0, 64, 64, 128): # The second page asked for twice
+            server.handle('ls {} {}'.format(tmp_path, start))
+            lines = port.replies().decode().split('\n')
+            assert lines[0].startswith('OK ')
+            reply = json.loads(lines[0][3:])
+            assert reply['total'] == 150
+            assert reply['start'] == start
+            assert reply['files'] == min(64, 150 - start)
+            assert len(stats) <= 150 # Each file stat'ed once
+            page = [line.rsplit(',', 1) for line in lines[1:-1]]
+            assert len(page) == reply['files']
+            assert reply['bytes'] == sum(int(size) for _, size in page)
+            if start not in [s for s, _ in listed]:
+                listed.append((start, page))
+        server.handle('ls {} 151'.format(tmp_path))
+        assert port.replies().startswith(b'ERR ls ')
+    finally:
+        os.stat = real_stat
+    names = [name for _, page in listed for name, _ in page]
+    assert names == sorted(sizes)
+    assert all(int(size) == sizes[name] for _, page in listed
+               for name, size in page)
+
+    joined = b''
+    for offset in (0, 4096): # Everything listed, joined
+        server.handle('chunk {} 4096'.format(offset))
+        header, data = port.replies().split(b'\n', 1)
+        assert json.loads(header[3:])['size'] == sum(sizes.values())
+        joined += data
+    assert joined == b''.join((tmp_path / name).read_bytes()
+                              for name in sorted(sizes))
+    port.close()
+
+
+def test_stop_ends_the_repeat_with_an_error_and_the_samples_flushed(tmp_path):
+    clock.reset()
+    ALTA_sim.use_virtual_time()
+    port = RecordingPort()
+    alta = Rig(1).make_alta(buffered_log=True, journal=True)
+    server = CommandServer(alta, port, str(tmp_path))
+    data = str(tmp_path / 'data')
+    server.handle('start isothermal -15 0 {}'.format(data))
+    alta.ticker.reset()
+    for _ in range(333): # Cooling, with samples still in the log buffer
+        server.step()
+        alta.ticker.wait()
+    server.handle('stop')
+    assert port.replies().split(b'\n')[-2].startswith(b'OK {"state": "idle"')
+    assert server.steps is None and alta.pwm_channel.pulse_width_percent() == 0
+
+    found = list(ALTA_journal.repeats(data + '/' + JOURNAL))
+    assert [r[:5] for r in found] == [(1, 'isothermal', '-15.0', 'error',
+                                       'closed')]
+    assert len(found[0][7]) == 333
+    port.close()
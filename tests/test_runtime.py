@@ -0,0 +1,91 @@
+import os
+
+import aio
+import ALTA_sim
+from clock import clock
+from rig import Rig
+from runtime import Runtime
+
+
+class StalledStdout():
+    '''
+    The USB port with the host no longer reading: the pipe behind it is full,
+    and a write waits for it (the USB timeout) before giving up
+    '''
+    BLOCK_US = 2000000
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.write_fd, False)
+        try:
+            while True:
+                os.write(self.write_fd, bytes(4096))
+        except BlockingIOError:
+            pass
+        self.writes = 0
+
+    def fileno(self):
+        return self.write_fd
+
+    def write(self, line):
+        self.writes += 1
+        clock.advance_us(self.BLOCK_US)
+        return 0
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+def test_control_loop_keeps_time_while_the_host_is_stalled(tmp_path):
+    clock.reset()
+    ALTA_sim.use_virtual_time()
+    alta = Rig(3).make_alta(buffered_log=True)
+    writer = StalledStdout()
+    runtime = Runtime(alta, aio.ScriptedReader(), writer)
+    steps = alta.campaign_steps('isothermal', str(tmp_path) + '/', -15)
+    loop = aio.new_event_loop()
+    try:
+        loop.run_until_complete(runtime.main(ALTA_sim.until(steps, 0.05)))
+    finally:
+        loop.close()
+        writer.close()
+    assert writer.writes == 0
+    assert runtime.ticker.ticks > 800
+    assert runtime.ticker.missed == 0
+    assert runtime.lines_dropped > 0
+    assert 'telemetry dropped {}'.format(runtime.telemetry.dropped +
+                                         runtime.lines_dropped) in \
+        runtime.summary()
+
+
+class Host():
+    '''The USB port with the host reading everything'''
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+        return len(line)
+
+
+def test_zero_alloc_samples_reach_the_host_as_logged(tmp_path):
+    clock.reset()
+    ALTA_sim.use_virtual_time()
+    alta = Rig(3).make_alta(zero_alloc=True)
+    host = Host()
+    runtime = Runtime(alta, aio.ScriptedReader(), host)
+    loop = aio.new_event_loop()
+    try:
+        loop.run_until_complete(runtime.main(
+            alta.isothermal_steps(str(tmp_path), -15, 1)))
+    finally:
+        loop.close()
+    assert runtime.telemetry.lines is not None # Queued without allocating
+    assert runtime.telemetry.dropped == runtime.lines_dropped == 0
+    name, = [name for name in os.listdir(str(tmp_path))
+             if name.startswith('1_isothermal')]
+    with open(str(tmp_path / name)) as f:
+        logged = f.read()
+    assert logged.count('\n') > 700
+    assert ''.join(host.lines) == logged
@@ -0,0 +1,88 @@
+import numpy as np
+
+from ALTA_stats import (CONFIDENCE, ISOTHERMAL, LINEAR, fit_rates,
+                        frozen_fraction, kaplan_meier, median_temperature,
+                        rate_constants, survival_at, upper_bound)
+from ALTA_store import INDEX_DTYPE, OUTCOMES
+
+HOLD_MS = 120000
+
+
+def campaign(runs, mode=ISOTHERMAL):
+    '''
+    Index of repeats, each (setpoint, outcome, value): the lag (s) of an
+    isothermal repeat, the temperature (deg C) a linear one froze at, or the
+    time (s) into the ramp it ended liquid
+    '''
+    index = np.zeros(len(runs), INDEX_DTYPE)
+    for i, (setpoint, outcome, value) in enumerate(runs):
+        index[i]['repeat'] = i
+        index[i]['mode'] = mode
+        index[i]['setpoint'] = setpoint
+        index[i]['outcome'] = OUTCOMES.index(outcome)
+        index[i]['hold_ms'] = HOLD_MS
+        if mode == ISOTHERMAL or outcome == 'liquid':
+            value = HOLD_MS + value * 1000
+        index[i]['value'] = value
+    return index
+
+
+def test_kaplan_meier_matches_the_product_limit():
+    times = np.array([3, 1, 2, 4, 2], dtype=float)
+    events = np.array([True, True, False, False, True])
+    sorted_times, survival = kaplan_meier(times, events)
+    assert list(sorted_times) == [1, 2, 2, 3, 4]
+    # 5 at risk at 1 s, 4 at 2 s (the freeze before the censored), 2 at 3 s
+    assert np.allclose(survival, [4 / 5, 3 / 5, 3 / 5, 3 / 10, 3 / 10])
+    assert np.allclose(survival_at([0, 1.5, 2, 10], sorted_times, survival),
+                       [1, 4 / 5, 3 / 5, 3 / 10])
+
+    # Weights count repeats: the same as repeating them
+    weights = np.array([[2, 1, 0, 1, 1], [1, 1, 1, 1, 1]])
+    _, weighted = kaplan_meier(times, events, weights)
+    repeated, expected = kaplan_meier(np.repeat(times, weights[0]),
+                                      np.repeat(events, weights[0]))
+    grid = [0, 1, 2, 3, 4]
+    assert np.allclose(survival_at(grid, sorted_times, weighted[0]),
+                       survival_at(grid, repeated, expected))
+    assert np.allclose(weighted[1], survival)
+
+
+def test_no_freezes_give_an_upper_bound_left_out_of_the_fit():
+    frozen = [(-15, 'frozen', lag) for lag in (20, 60, 90, 150, 200)] + \
+             [(-13, 'frozen', lag) for lag in (100, 250, 400)] + \
+             [(-13, 'liquid', 600)] * 2
+    warm = [(-10, 'liquid', 600)] * 5 + [(-10, 'early', 0)]
+    rng = np.random.default_rng(1)
+    rates = rate_constants(campaign(frozen + warm), 200, rng)
+
+    r = rates[rates['T'] == -10][0]
+    assert (r['repeats'], r['frozen'], r['liquid'], r['early']) == (6, 0, 5, 1)
+    assert np.isnan(r['k'])
+    assert r['k_low'] == 0
+    assert r['k_high'] == upper_bound(3000)
+    assert abs(r['k_high'] - 3 / 3000) < 0.01 / 3000 # The rule of three
+    assert np.isclose(np.exp(-r['k_high'] * 3000), 1 - CONFIDENCE)
+
+    assert fit_rates(rates) == fit_rates(rates[rates['T'] != -10])
+    assert np.all(rates['k'][rates['frozen'] > 0] > 0)
+
+
+def test_frozen_fraction_leaves_out_early_and_unwatched_temperatures():
+    ramp_s = 25 * 60 # To -25 deg C at -1 deg C/min
+    runs = [(-1, 'frozen', T) for T in (-10, -12, -14, -16)] + \
+           [(-1, 'early', 1.5)] * 2 + [(-1, 'liquid', ramp_s)] * 2
+    grid = np.round(np.arange(0, -30.05, -0.1), 1)
+    fractions = frozen_fraction(campaign(runs, LINEAR), grid, 200,
+                                np.random.default_rng(1))
+    fraction, low, high, repeats, early = fractions[-1.0]
+    assert (repeats, early) == (6, 2)
+    at = dict(zip(grid, fraction))
+    assert at[-9.9] == 0
+    assert at[-11.0] == 1 / 6 # Not 1/8: the early ones are not in the ramp
+    assert at[-20.0] == 4 / 6
+    assert at[-25.0] == 4 / 6
+    assert np.all(np.isnan(fraction[grid < -25]))
+    assert np.all(np.isnan(low[grid < -25]) & np.isnan(high[grid < -25]))
+    assert np.all(low[grid >= -25] <= fraction[grid >= -25])
+    assert median_temperature(grid, fraction) == -14
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+
+from ALTA_store import OUTCOMES, RunStore, STATUSES
+
+
+def write_repeat(data, name, samples):
+    '''A repeat file of samples (t, T), Cool then Hold below -14 deg C'''
+    path = os.path.join(data, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        for t, T in samples:
+            f.write('{},{},{},2394,{}\n'.format(t, T, T + 0.5,
+                                                'Hold' if T < -14 else 'Cool'))
+
+
+def check(store, data):
+    '''Every stored repeat matches its file'''
+    assert sorted(store.files) == sorted(store.names)
+    assert len(store.index) == len(store.names)
+    for run in store.index:
+        name = store.name(run)
+        assert os.path.exists(os.path.join(data, name))
+        assert OUTCOMES[run['outcome']] in name
+        trace = store.trace(run)
+        with open(os.path.join(data, name)) as f:
+            rows = [line.split(',') for line in f]
+        assert np.allclose(trace[:, :2], [[float(t), float(T)]
+                                          for t, T, _, _, _ in rows])
+        assert STATUSES[int(trace[0, 4])] == rows[0][4].strip()
+
+
+def test_ingest_and_reingest(tmp_path):
+    data = str(tmp_path / 'data')
+    samples = [(t, 20 - t / 1000) for t in range(0, 40000, 200)]
+    for i in range(1, 4):
+        write_repeat(data, 'a/{}_isothermal-15_liquid_39800.csv'.format(i),
+                     samples)
+    write_repeat(data, 'b/1_isothermal-15_frozen_30000.csv', samples[:151])
+
+    store = RunStore(data)
+    assert store.ingest() == (4, 0)
+    check(store, data)
+    assert store.index['hold_ms'][0] == 34200
+    assert store.ingest() == (0, 0)
+
+    # One changed, one removed, one added
+    write_repeat(data, 'a/2_isothermal-15_liquid_39800.csv', samples[:50])
+    os.remove(os.path.join(data, 'a/3_isothermal-15_liquid_39800.csv'))
+    write_repeat(data, 'b/2_isothermal-15_frozen_20000.csv', samples[:101])
+    os.utime(os.path.join(data, 'a/2_isothermal-15_liquid_39800.csv'),
+             (1, 1)) # Changed, even within the clock's resolution
+    assert store.ingest() == (2, 2)
+    check(store, data)
+    assert 'a/3_isothermal-15_liquid_39800.csv' not in store.names
+    assert len(store.select(directory='b')) == 2
+
+    reloaded = RunStore(data) # From what was saved
+    assert reloaded.names == store.names
+    assert reloaded.index.tobytes() == store.index.tobytes()
+    check(reloaded, data)
+    assert reloaded.ingest() == (0, 0)
+
+
+def test_ingest_of_named_files_only(tmp_path):
+    data = str(tmp_path / 'data')
+    samples = [(t, 20 - t / 1000) for t in range(0, 40000, 200)]
+    for i in range(1, 4):
+        write_repeat(data, '{}_isothermal-15_liquid_39800.csv'.format(i),
+                     samples)
+    store = RunStore(data)
+    assert store.ingest() == (3, 0)
+
+    os.remove(os.path.join(data, '1_isothermal-15_liquid_39800.csv'))
+    write_repeat(data, '2_isothermal-15_liquid_39800.csv', samples[:50])
+    write_repeat(data, '4_isothermal-15_frozen_30000.csv', samples[:151])
+    os.utime(os.path.join(data, '2_isothermal-15_liquid_39800.csv'), (1, 1))
+    store.scan = None # Not walked
+    assert store.ingest(['4_isothermal-15_frozen_30000.csv',
+                         '2_isothermal-15_liquid_39800.csv',
+                         'notes.txt']) == (2, 1)
+    assert '1_isothermal-15_liquid_39800.csv' in store.names # Not looked at
+    assert len(store.trace(store.select(outcome='frozen')[0])) == 151
+    del store.scan
+    assert store.ingest() == (0, 1)
+    check(store, data)
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import ALTA_sim
+from ALTA_telemetry import Decoder, RepeatWriter
+from telemetry import TelemetryLink
+
+STEPS = [['cool', -10], ['wait'], ['hold', -10, 30000], ['ramp', -1, -14],
+         ['hold', -14, 60000], ['melt']]
+
+
+def repeat_files(path):
+    files = {}
+    for name in os.listdir(path):
+        if name.split('_')[0].isdigit():
+            with open(os.path.join(path, name)) as f:
+                files[name] = f.read()
+    return files
+
+
+@pytest.mark.parametrize('mode, setpoint', [('isothermal', -15),
+                                            ('isothermal', -12.3),
+                                            ('linear', -1),
+                                            ('linear', -0.7),
+                                            ('profile', STEPS)])
+def test_rebuilt_repeats_match_the_sd_card(tmp_path, mode, setpoint):
+    sd = str(tmp_path / 'sd')
+    with open(str(tmp_path / 'telemetry.bin'), 'wb', buffering=0) as f:
+        link = TelemetryLink(f)
+        ALTA_sim.simulate(mode, setpoint, repeats=2, filepath=sd, seed=3,
+                          link=link)
+        assert link.dropped == 0
+    decoder = Decoder()
+    writer = RepeatWriter(str(tmp_path / 'rebuilt'), store=False)
+    with open(str(tmp_path / 'telemetry.bin'), 'rb') as f:
+        for frame in decoder.feed(f.read()):
+            writer.frame(*frame)
+    assert decoder.lost == decoder.crc_errors == 0
+    sd_files = repeat_files(sd)
+    assert len(sd_files) == 2
+    assert repeat_files(str(tmp_path / 'rebuilt')) == sd_files